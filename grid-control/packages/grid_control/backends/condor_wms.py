@@ -415,6 +415,8 @@ class Condor(BasicWMS):
 	def submitJobs(self, jobNumListFull, module):
 		submitBatch=25
 		for index in range(0,len(jobNumListFull),submitBatch):
+			if utils.abort():
+				raise StopIteration
 			jobNumList=jobNumListFull[index:index+submitBatch]
 			self.debugOut("\nStarted submitting: %s" % jobNumList)
 			self.debugPool()
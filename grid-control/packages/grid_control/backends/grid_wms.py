@@ -37,6 +37,7 @@ class GridWMS(BasicWMS):
 		'done':      Job.DONE,
 		'cleared':   Job.ABORTED
 	}
+	submitThreadsDefault = 4
 
 
 	def __init__(self, config, wmsName):
@@ -232,8 +233,8 @@ class GridWMS(BasicWMS):
 		return False
 
 
-	# Submit job and yield (jobNum, WMS ID, other data)
-	def _submitJob(self, jobNum, module):
+	# Write jdl file and return function which submits the job and returns (jobNum, WMS ID, other data)
+	def _prepareSubmit(self, jobNum, module):
 		fd, jdl = tempfile.mkstemp('.jdl')
 		try:
 			data = self.makeJDL(jobNum, module)
@@ -241,29 +242,28 @@ class GridWMS(BasicWMS):
 		except:
 			utils.removeFiles([jdl])
 			raise RethrowError('Could not write jdl data to %s.' % jdl)
+		tmp = utils.filterDict(self._submitParams, vF = lambda v: v)
+		params = str.join(' ', map(lambda (x, y): '%s %s' % (x, y), tmp.items()))
 
-		try:
-			tmp = utils.filterDict(self._submitParams, vF = lambda v: v)
-			params = str.join(' ', map(lambda (x, y): '%s %s' % (x, y), tmp.items()))
-
+		def submit():
 			log = tempfile.mktemp('.log')
-			activity = utils.ActivityLog('submitting jobs')
-			proc = utils.LoggedProcess(self._submitExec, '%s --nomsg --noint --logfile "%s" "%s"' % (params, log, jdl))
+			try:
+				proc = utils.LoggedProcess(self._submitExec, '%s --nomsg --noint --logfile "%s" "%s"' % (params, log, jdl))
 
-			wmsId = None
-			for line in filter(lambda x: x.startswith('http'), map(str.strip, proc.iter())):
-				wmsId = line
-			retCode = proc.wait()
-			del activity
+				wmsId = None
+				for line in filter(lambda x: x.startswith('http'), map(str.strip, proc.iter())):
+					wmsId = line
+				retCode = proc.wait()
 
-			if (retCode != 0) or (wmsId == None):
-				if self.explainError(proc, retCode):
-					pass
-				else:
-					proc.logError(self.errorLog, log = log, jdl = jdl)
-		finally:
-			utils.removeFiles([log, jdl])
-		return (jobNum, QM(wmsId, self._createId(wmsId), None), {'jdl': str.join('', data)})
+				if (retCode != 0) or (wmsId == None):
+					if self.explainError(proc, retCode):
+						pass
+					else:
+						proc.logError(self.errorLog, log = log, jdl = jdl)
+			finally:
+				utils.removeFiles([log, jdl])
+			return (jobNum, QM(wmsId, self._createId(wmsId), None), {'jdl': str.join('', data)})
+		return submit
 
 
 	# Check status of jobs and yield (jobNum, wmsID, status, other data)
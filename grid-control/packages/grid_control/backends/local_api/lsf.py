@@ -18,6 +18,7 @@ from grid_control import ConfigError, RethrowError, Job, utils
 from grid_control.backends import WMS, LocalWMS
 
 class LSF(LocalWMS):
+	arraySupport = True
 	_statusMap = {
 		'PEND':  Job.QUEUED,  'PSUSP': Job.WAITING,
 		'USUSP': Job.WAITING, 'SSUSP': Job.WAITING,
@@ -57,11 +58,20 @@ class LSF(LocalWMS):
 		return params
 
 
+	def getArrayArguments(self, jobName, nJobs):
+		return ('"%s[1-%d]"' % (jobName, nJobs), '')
+
+
 	def parseSubmitOutput(self, data):
 		# Job <34020017> is submitted to queue <1nh>.
 		return data.split()[1].strip('<>').strip()
 
 
+	def parseArraySubmitOutput(self, data, nJobs):
+		arrayId = self.parseSubmitOutput(data)
+		return map(lambda idx: '%s[%d]' % (arrayId, idx), range(1, nJobs + 1))
+
+
 	def parseStatus(self, status):
 		next(status)
 		tmpHead = ['id', 'user', 'status', 'queue', 'from', 'dest_host', 'job_name']
@@ -73,14 +83,20 @@ class LSF(LocalWMS):
 				jobinfo['dest'] = 'N/A'
 				if jobinfo['dest_host'] != '-':
 					jobinfo['dest'] = '%s/%s' % (jobinfo['dest_host'], jobinfo['queue'])
+				if jobinfo['job_name'].endswith(']') and ('[' in jobinfo['job_name']): # array job: name[index]
+					jobinfo['id'] += jobinfo['job_name'][jobinfo['job_name'].rindex('['):]
 				yield jobinfo
 			except:
 				raise RethrowError('Error reading job info:\n%s' % jobline)
 
 
 	def getCheckArguments(self, wmsIds):
-		return '-aw %s' % str.join(' ', wmsIds)
+		return '-aw %s' % str.join(' ', map(lambda wmsId: '"%s"' % wmsId, wmsIds))
+
+
+	def getCheckAllArguments(self):
+		return '-aw' # all unfinished and recently finished jobs of the user
 
 
 	def getCancelArguments(self, wmsIds):
-		return str.join(' ', wmsIds)
+		return str.join(' ', map(lambda wmsId: '"%s"' % wmsId, wmsIds))
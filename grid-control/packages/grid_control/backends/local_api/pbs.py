@@ -30,7 +30,8 @@ class PBS(PBSGECommon):
 		PBSGECommon.__init__(self, config, wmsName)
 		self.nodesExec = utils.resolveInstallPath('pbsnodes')
 		self._server = config.get('server', '', onChange = None)
-		self.fqid = lambda wmsId: QM(self._server, '%s.%s' % (wmsId, self._server), wmsId)
+		self.fqid = lambda wmsId: QM(self._server, '"%s.%s"' % (wmsId, self._server), '"%s"' % wmsId)
+		self._arrayFlag = config.get('array flag', '-t', onChange = None) # Torque: -t, PBS Pro: -J
 
 
 	def getSubmitArguments(self, jobNum, jobName, reqs, sandbox, stdout, stderr):
@@ -44,11 +45,22 @@ class PBS(PBSGECommon):
 		return params
 
 
+	def getArrayArguments(self, jobName, nJobs):
+		return (jobName, '%s 1-%d' % (self._arrayFlag, nJobs))
+
+
 	def parseSubmitOutput(self, data):
 		# 1667161.ekpplusctl.ekpplus.cluster
 		return data.split('.')[0].strip()
 
 
+	def parseArraySubmitOutput(self, data, nJobs):
+		# 1667161[].ekpplusctl.ekpplus.cluster
+		arrayId = data.split('.')[0].strip()
+		if arrayId.endswith('[]'):
+			return map(lambda idx: '%s[%d]' % (arrayId[:-2], idx), range(1, nJobs + 1))
+
+
 	def parseStatus(self, status):
 		for section in utils.accumulate(status, '', lambda x, buf: x == '\n'):
 			try:
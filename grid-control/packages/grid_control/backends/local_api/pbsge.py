@@ -17,6 +17,8 @@ from grid_control import ConfigError, RethrowError, Job, utils
 from grid_control.backends import WMS, LocalWMS
 
 class PBSGECommon(LocalWMS):
+	arraySupport = True
+
 	def __init__(self, config, wmsName = None):
 		LocalWMS.__init__(self, config, wmsName,
 			submitExec = utils.resolveInstallPath('qsub'),
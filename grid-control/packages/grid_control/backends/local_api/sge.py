@@ -45,11 +45,29 @@ class OGE(PBSGECommon):
 		return params + PBSGECommon.getSubmitArguments(self, jobNum, jobName, reqs, sandbox, stdout, stderr, reqMap)
 
 
+	def getArrayArguments(self, jobName, nJobs):
+		return (jobName, '-t 1-%d' % nJobs)
+
+
 	def parseSubmitOutput(self, data):
 		# Your job 424992 ("test.sh") has been submitted
 		return data.split()[2].strip()
 
 
+	def parseArraySubmitOutput(self, data, nJobs):
+		# Your job-array 424992.1-10:1 ("test.sh") has been submitted
+		arrayId = data.split()[2].split('.')[0].strip()
+		return map(lambda idx: '%s.%d' % (arrayId, idx), range(1, nJobs + 1))
+
+
+	def _getTaskIds(self, tasks): # Parse task ranges like "1-10:2,12"
+		for taskRange in tasks.split(','):
+			(taskRange, step) = (taskRange.split(':') + ['1'])[:2]
+			(first, last) = (taskRange.split('-') + [taskRange])[:2]
+			for taskId in range(int(first), int(last) + 1, int(step)):
+				yield taskId
+
+
 	def parseStatus(self, status):
 		try:
 			dom = xml.dom.minidom.parseString(str.join('', status))
@@ -69,9 +87,15 @@ class OGE(PBSGECommon):
 				if 'queue_name' in jobinfo:
 					queue, node = jobinfo['queue_name'].split('@')
 					jobinfo['dest'] = '%s/%s' % (node, queue)
+				taskIds = []
+				if 'tasks' in jobinfo: # Tasks of array jobs
+					taskIds = list(self._getTaskIds(jobinfo['tasks']))
 			except:
 				raise RethrowError('Error reading job info:\n%s' % jobentry.toxml())
-			yield jobinfo
+			if not taskIds:
+				yield jobinfo
+			for taskId in taskIds:
+				yield utils.mergeDicts([jobinfo, {'id': '%s.%d' % (jobinfo['id'], taskId)}])
 
 
 	def parseJobState(self, state):
@@ -86,6 +110,10 @@ class OGE(PBSGECommon):
 		return '-xml' + QM(self.user, ' -u %s' % self.user, '')
 
 
+	def getCheckAllArguments(self):
+		return self.getCheckArguments([])
+
+
 	def getCancelArguments(self, wmsIds):
 		return str.join(',', wmsIds)
 
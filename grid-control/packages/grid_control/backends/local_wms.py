@@ -12,13 +12,16 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import sys, os, tempfile, shutil, time, random, glob
-from grid_control import AbstractError, ConfigError, Job, utils
+import sys, os, tempfile, shutil, time, random, glob, threading
+from python_compat import set
+from grid_control import AbstractError, ConfigError, RethrowError, Job, utils
 from wms import WMS, BasicWMS
 from broker import Broker
 
 class LocalWMS(BasicWMS):
 	getConfigSections = BasicWMS.createFunction_getConfigSections(['local'])
+	submitThreadsDefault = 4
+	arraySupport = False
 
 	def __init__(self, config, wmsName, submitExec, statusExec, cancelExec):
 		config.set('broker', 'RandomBroker', override = False)
@@ -35,6 +38,13 @@ class LocalWMS(BasicWMS):
 		self.scratchPath = config.getList('scratch path', ['TMPDIR', '/tmp'], onChange = True)
 		self.submitOpts = config.get('submit options', '', onChange = None)
 		self.memory = config.getInt('memory', -1, onChange = None)
+		# Maximum number of jobs submitted together as array job (if supported by the batch system)
+		self._arraySize = config.getInt('array size', 0, onChange = None)
+		# Status query results are reused for <n> seconds, ids are passed in chunks of <n> ids
+		self._statusCacheTime = config.getTime('status cache time', 0, onChange = None)
+		self._statusChunkSize = max(1, config.getInt('status chunk size', 1000, onChange = None))
+		(self._statusCache, self._statusCacheIds, self._statusCacheTimestamp) = ({}, None, 0)
+		self._statusLock = threading.Lock()
 
 
 	def getTimings(self):
@@ -47,26 +57,54 @@ class LocalWMS(BasicWMS):
 			raise StopIteration
 
 		activity = utils.ActivityLog('checking job status')
-		proc = utils.LoggedProcess(self.statusExec, self.getCheckArguments(self._getRawIDs(ids)))
-
-		tmp = {}
-		for data in self.parseStatus(proc.iter()):
-			wmsId = self._createId(data['id'])
-			tmp[wmsId] = (wmsId, self.parseJobState(data['status']), data)
+		statusMap = self._getStatusMap(self._getRawIDs(ids))
+		del activity
 
 		for wmsId, jobNum in ids:
-			if wmsId not in tmp:
+			if wmsId not in statusMap:
 				yield (jobNum, wmsId, Job.DONE, {})
 			else:
-				yield tuple([jobNum] + list(tmp[wmsId]))
+				yield tuple([jobNum, wmsId] + list(statusMap[wmsId]))
 
-		retCode = proc.wait()
-		del activity
 
-		if retCode != 0:
-			for line in proc.getError().splitlines():
-				if not self.unknownID() in line:
-					utils.eprint(line)
+	# Return {wmsId: (status, data)} for the given raw ids - results are shared for 'status cache time' seconds
+	def _getStatusMap(self, rawIds):
+		self._statusLock.acquire() # status can be checked from several threads
+		try:
+			return dict(self._getCachedStatus(rawIds))
+		finally:
+			self._statusLock.release()
+
+
+	def _getCachedStatus(self, rawIds):
+		if time.time() - self._statusCacheTimestamp >= self._statusCacheTime:
+			(self._statusCache, self._statusCacheIds, self._statusCacheTimestamp) = ({}, None, time.time())
+		checkAllArgs = self.getCheckAllArguments()
+		if checkAllArgs != None: # single query for all jobs of the user
+			if self._statusCacheIds == None:
+				self._statusCache.update(self._queryStatus([checkAllArgs]))
+				self._statusCacheIds = True
+		else:
+			if self._statusCacheIds == None:
+				self._statusCacheIds = set()
+			rawIds = filter(lambda rawId: rawId not in self._statusCacheIds, rawIds)
+			chunks = map(lambda idx: rawIds[idx:idx + self._statusChunkSize], range(0, len(rawIds), self._statusChunkSize))
+			self._statusCache.update(self._queryStatus(map(self.getCheckArguments, chunks)))
+			self._statusCacheIds.update(rawIds)
+		return self._statusCache
+
+
+	def _queryStatus(self, argsList):
+		result = {}
+		for args in argsList:
+			proc = utils.LoggedProcess(self.statusExec, args)
+			for data in self.parseStatus(proc.iter()):
+				result[self._createId(data['id'])] = (self.parseJobState(data['status']), data)
+			if proc.wait() != 0:
+				for line in proc.getError().splitlines():
+					if not self.unknownID() in line:
+						utils.eprint(line)
+		return result
 
 
 	def cancelJobs(self, ids):
@@ -74,6 +112,7 @@ class LocalWMS(BasicWMS):
 			raise StopIteration
 
 		activity = utils.ActivityLog('cancelling jobs')
+		self._statusCacheTimestamp = 0
 		proc = utils.LoggedProcess(self.cancelExec, self.getCancelArguments(self._getRawIDs(ids)))
 		if proc.wait() != 0:
 			for line in proc.getError().splitlines():
@@ -93,6 +132,7 @@ class LocalWMS(BasicWMS):
 			except:
 				raise RuntimeError('Sandbox for job %d with wmsId "%s" could not be deleted' % (jobNum, wmsId))
 			yield (jobNum, wmsId)
+		self._cleanupArrayLists()
 		del activity
 
 
@@ -110,10 +150,8 @@ class LocalWMS(BasicWMS):
 		return searchSandbox(filter(lambda x: x not in oldCache, self.sandCache))
 
 
-	# Submit job and yield (jobNum, WMS ID, other data)
-	def _submitJob(self, jobNum, module):
-		activity = utils.ActivityLog('submitting jobs')
-
+	# Create sandbox with job config and return (sandbox, requirements, job description)
+	def _prepareSandbox(self, jobNum, module):
 		try:
 			sandbox = self.sandPath # defined here for exception message in case os.mkdir fails
 			if not os.path.exists(self.sandPath):
@@ -131,31 +169,138 @@ class LocalWMS(BasicWMS):
 		reqs = dict(self.brokerQueue.brokerAdd(reqs, WMS.QUEUES))
 		if (self.memory > 0) and (reqs.get(WMS.MEMORY, 0) < self.memory):
 			reqs[WMS.MEMORY] = self.memory # local jobs need higher (more realistic) memory requirements
+		return (sandbox, reqs, module.getDescription(jobNum))
 
-		(stdout, stderr) = (os.path.join(sandbox, 'gc.stdout'), os.path.join(sandbox, 'gc.stderr'))
-		(taskName, jobName, jobType) = module.getDescription(jobNum)
-		proc = utils.LoggedProcess(self.submitExec, '%s %s "%s" %s' % (self.submitOpts,
-			self.getSubmitArguments(jobNum, jobName, reqs, sandbox, stdout, stderr),
-			utils.pathShare('gc-local.sh'), self.getJobArguments(jobNum, sandbox)))
+
+	# Run submit command and return the job id(s) extracted by parseOutput
+	# onMissingId is called with the output of successful submissions without job id(s)
+	def _runSubmit(self, submitArgs, parseOutput, onMissingId = None):
+		proc = utils.LoggedProcess(self.submitExec, submitArgs)
 		retCode = proc.wait()
+		self._statusCacheTimestamp = 0 # cached job status doesn't contain the new job
 		wmsIdText = proc.getOutput().strip().strip('\n')
 		try:
-			wmsId = self.parseSubmitOutput(wmsIdText)
+			wmsId = parseOutput(wmsIdText)
 		except:
 			wmsId = None
 
-		del activity
-
 		if retCode != 0:
 			utils.eprint('WARNING: %s failed:' % self.submitExec)
 		elif wmsId == None:
 			utils.eprint('WARNING: %s did not yield job id:\n%s' % (self.submitExec, wmsIdText))
-		if wmsId:
-			wmsId = self._createId(wmsId)
-			open(os.path.join(sandbox, wmsId), 'w')
-		else:
+		if not wmsId:
+			proc.logError(self.errorLog)
+		if (retCode == 0) and not wmsId and onMissingId:
+			onMissingId(wmsIdText)
+		return wmsId
+
+
+	# Cancel submitted job whose job ids are unknown - it would run in addition to the resubmitted jobs
+	def _cancelUnknownSubmit(self, wmsIdText):
+		try:
+			wmsId = self.parseSubmitOutput(wmsIdText)
+		except:
+			wmsId = None
+		if not wmsId:
+			utils.eprint('WARNING: Unable to cancel submitted job - it has to be removed manually:\n%s' % wmsIdText)
+			return
+		utils.eprint('Cancelling job %s with unknown job ids' % wmsId)
+		proc = utils.LoggedProcess(self.cancelExec, self.getCancelArguments([wmsId]))
+		if proc.wait() != 0:
+			utils.eprint('WARNING: Unable to cancel job %s - it has to be removed manually!' % wmsId)
 			proc.logError(self.errorLog)
-		return (jobNum, utils.QM(wmsId, wmsId, None), {'sandbox': sandbox})
+
+
+	# Prepare sandbox and return function which submits the job and returns (jobNum, WMS ID, other data)
+	def _prepareSubmit(self, jobNum, module):
+		(sandbox, reqs, (taskName, jobName, jobType)) = self._prepareSandbox(jobNum, module)
+		return self._prepareSandboxSubmit(jobNum, jobName, reqs, sandbox)
+
+
+	def _prepareSandboxSubmit(self, jobNum, jobName, reqs, sandbox):
+		(stdout, stderr) = (os.path.join(sandbox, 'gc.stdout'), os.path.join(sandbox, 'gc.stderr'))
+		submitArgs = '%s %s "%s" %s' % (self.submitOpts,
+			self.getSubmitArguments(jobNum, jobName, reqs, sandbox, stdout, stderr),
+			utils.pathShare('gc-local.sh'), self.getJobArguments(jobNum, sandbox))
+
+		def submit():
+			wmsId = self._runSubmit(submitArgs, self.parseSubmitOutput)
+			if wmsId:
+				wmsId = self._createId(wmsId)
+				open(os.path.join(sandbox, wmsId), 'w')
+			return (jobNum, wmsId, {'sandbox': sandbox})
+		return submit
+
+
+	# Return function which submits jobList = [(jobNum, jobName, sandbox), ...] as single array job
+	def _prepareArraySubmit(self, jobList, taskName, reqs, module):
+		if len(jobList) == 1: # arrays with a single job are rejected by some batch systems (eg. PBS Pro)
+			submit = self._prepareSandboxSubmit(jobList[0][0], jobList[0][1], reqs, jobList[0][2])
+			return lambda: [submit()]
+		# The array job gets a file with the sandbox of each array index - gc-local.sh selects the right one
+		# It is removed by _cleanupArrayLists after all sandboxes were retrieved or cancelled
+		try:
+			fd, sandboxList = tempfile.mkstemp('.array', '%s.' % module.taskID, self.sandPath)
+			utils.safeWrite(os.fdopen(fd, 'w'), map(lambda (jobNum, jobName, sandbox): sandbox + '\n', jobList))
+		except:
+			raise RethrowError('Unable to write sandbox list of array job to "%s"!' % self.sandPath)
+		(arrayName, arrayArgs) = self.getArrayArguments(taskName, len(jobList))
+		submitArgs = '%s %s %s "%s" %s' % (self.submitOpts,
+			self.getSubmitArguments(jobList[0][0], arrayName, reqs, sandboxList, '/dev/null', '/dev/null'),
+			arrayArgs, utils.pathShare('gc-local.sh'), self.getJobArguments(jobList[0][0], sandboxList))
+
+		def submit():
+			wmsIdList = self._runSubmit(submitArgs, lambda data: self.parseArraySubmitOutput(data, len(jobList)),
+				self._cancelUnknownSubmit)
+			if not wmsIdList:
+				utils.removeFiles([sandboxList])
+			result = []
+			for idx, (jobNum, jobName, sandbox) in enumerate(jobList):
+				wmsId = None
+				if wmsIdList:
+					wmsId = self._createId(wmsIdList[idx])
+					open(os.path.join(sandbox, wmsId), 'w')
+				result.append((jobNum, wmsId, {'sandbox': sandbox}))
+			return result
+		return submit
+
+
+	# Remove sandbox lists of array jobs whose sandboxes were all retrieved or cancelled
+	def _cleanupArrayLists(self):
+		for sandboxList in glob.glob(os.path.join(self.sandPath, '*.array')):
+			try:
+				sandboxes = open(sandboxList).read().splitlines()
+			except:
+				continue
+			if not filter(os.path.exists, sandboxes):
+				utils.removeFiles([sandboxList])
+
+
+	def submitJobs(self, jobNumList, module):
+		if (self._arraySize <= 1) or not self.arraySupport:
+			for result in BasicWMS.submitJobs(self, jobNumList, module):
+				yield result
+			raise StopIteration
+
+		# Jobs with the same submit arguments are collected into array jobs
+		def prepareArrays():
+			arrayMap = {}
+			for jobNum in jobNumList:
+				if utils.abort():
+					raise StopIteration
+				(sandbox, reqs, (taskName, jobName, jobType)) = self._prepareSandbox(jobNum, module)
+				key = self.getSubmitArguments(jobNum, taskName, reqs, '', '', '')
+				(jobList, taskName, reqs) = arrayMap.setdefault(key, ([], taskName, reqs))
+				jobList.append((jobNum, jobName, sandbox))
+				if len(jobList) >= self._arraySize:
+					yield self._prepareArraySubmit(arrayMap.pop(key)[0], taskName, reqs, module)
+			for (jobList, taskName, reqs) in arrayMap.values():
+				yield self._prepareArraySubmit(jobList, taskName, reqs, module)
+		activity = utils.ActivityLog('submitting array jobs')
+		for resultList in utils.getThreadedResults(prepareArrays(), self._submitThreads):
+			for result in resultList:
+				yield result
+		del activity
 
 
 	def _getJobsOutput(self, ids):
@@ -174,6 +319,7 @@ class LocalWMS(BasicWMS):
 			utils.removeFiles(filter(lambda x: x not in outFiles, map(lambda fn: os.path.join(path, fn), os.listdir(path))))
 
 			yield (jobNum, path)
+		self._cleanupArrayLists()
 		del activity
 
 
@@ -207,6 +353,12 @@ class LocalWMS(BasicWMS):
 	def getSubmitArguments(self, jobNum, jobName, reqs, sandbox, stdout, stderr):
 		raise AbstractError
 
+	def getArrayArguments(self, jobName, nJobs): # Return (job name, additional submit arguments) of array job
+		raise AbstractError
+
+	def parseArraySubmitOutput(self, data, nJobs): # Return list with raw ids of the array subjobs
+		raise AbstractError
+
 	def parseSubmitOutput(self, data):
 		raise AbstractError
 
@@ -218,3 +370,6 @@ class LocalWMS(BasicWMS):
 
 	def getCheckArguments(self, wmsIds):
 		raise AbstractError
+
+	def getCheckAllArguments(self): # Arguments to query the status of all jobs of the user (None: unsupported)
+		return None
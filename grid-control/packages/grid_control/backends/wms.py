@@ -102,6 +102,8 @@ class InactiveWMS(WMS):
 
 
 class BasicWMS(WMS):
+	submitThreadsDefault = 1
+
 	def __init__(self, config, wmsName, wmsClass):
 		WMS.__init__(self, config, wmsName, wmsClass)
 		if self.wmsName != self.__class__.__name__.upper():
@@ -113,6 +115,8 @@ class BasicWMS(WMS):
 		self._outputPath = config.getWorkPath('output')
 		utils.ensureDirExists(self._outputPath, 'output directory')
 		self._failPath = config.getWorkPath('fail')
+		# Number of jobs which are submitted at the same time
+		self._submitThreads = config.getInt('submit threads', self.submitThreadsDefault, onChange = None)
 
 		# Initialise proxy, broker and storage manager
 		self.proxy = ClassFactory(config, ('proxy', 'TrivialProxy'), ('proxy manager', 'MultiProxy'),
@@ -163,10 +167,23 @@ class BasicWMS(WMS):
 
 
 	def submitJobs(self, jobNumList, module):
-		for jobNum in jobNumList:
-			if utils.abort():
-				raise StopIteration
-			yield self._submitJob(jobNum, module)
+		if self._submitThreads <= 1:
+			for jobNum in jobNumList:
+				if utils.abort():
+					raise StopIteration
+				yield self._submitJob(jobNum, module)
+			raise StopIteration
+
+		# Jobs are prepared one after another - only the returned submit functions run in parallel
+		def prepareJobs():
+			for jobNum in jobNumList:
+				if utils.abort():
+					raise StopIteration
+				yield self._prepareSubmit(jobNum, module)
+		activity = utils.ActivityLog('submitting jobs')
+		for result in utils.getThreadedResults(prepareJobs(), self._submitThreads):
+			yield result
+		del activity
 
 
 	def retrieveJobs(self, ids): # Process output sandboxes returned by getJobsOutput
@@ -296,7 +313,14 @@ class BasicWMS(WMS):
 
 
 	def _submitJob(self, jobNum, module):
-		raise AbstractError # Return (jobNum, wmsId, data) for successfully submitted jobs
+		activity = utils.ActivityLog('submitting jobs')
+		result = self._prepareSubmit(jobNum, module)()
+		del activity
+		return result
+
+
+	def _prepareSubmit(self, jobNum, module):
+		raise AbstractError # Return function which submits the job and returns (jobNum, wmsId, data)
 
 
 	def _getJobsOutput(self, ids):
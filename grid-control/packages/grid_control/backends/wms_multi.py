@@ -12,7 +12,7 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-from grid_control import RuntimeError
+from grid_control import QM, RuntimeError
 from wms import WMS
 from broker import Broker
 # Distribute to WMS according to job id prefix
@@ -32,6 +32,8 @@ class MultiWMS(WMS):
 		self.timing = (waitIdle, waitDefault)
 		self.brokerWMS = config.getClass('wms broker', 'RandomBroker',
 			cls = Broker, tags = [self]).getInstance('wms', 'wms', self.wmsMap.keys)
+		# Split job ids of a backend into chunks of <n> ids for check, retrieve and cancel
+		self._chunkSize = config.getInt('wms chunk size', 0, onChange = None)
 
 
 	def getTimings(self):
@@ -59,19 +61,22 @@ class MultiWMS(WMS):
 		def brokerJobs(jobNum):
 			jobReq = self.brokerWMS.brokerAdd(module.getRequirements(jobNum), WMS.BACKEND)
 			return dict(jobReq).get(WMS.BACKEND)[0]
-		return self._forwardCall(jobNumList, brokerJobs, lambda wmsObj, args: wmsObj.submitJobs(args, module))
+		return self._forwardCall(jobNumList, brokerJobs, lambda wmsObj, args: wmsObj.submitJobs(args, module), 0)
 
 
 	def checkJobs(self, ids):
-		return self._forwardCall(ids, lambda (wmsId, jobNum): self._splitId(wmsId)[0], lambda wmsObj, args: wmsObj.checkJobs(args))
+		return self._forwardCall(ids, lambda (wmsId, jobNum): self._splitId(wmsId)[0],
+			lambda wmsObj, args: wmsObj.checkJobs(args), self._chunkSize)
 
 
 	def retrieveJobs(self, ids):
-		return self._forwardCall(ids, lambda (wmsId, jobNum): self._splitId(wmsId)[0], lambda wmsObj, args: wmsObj.retrieveJobs(args))
+		return self._forwardCall(ids, lambda (wmsId, jobNum): self._splitId(wmsId)[0],
+			lambda wmsObj, args: wmsObj.retrieveJobs(args), self._chunkSize)
 
 
 	def cancelJobs(self, ids):
-		return self._forwardCall(ids, lambda (wmsId, jobNum): self._splitId(wmsId)[0], lambda wmsObj, args: wmsObj.cancelJobs(args))
+		return self._forwardCall(ids, lambda (wmsId, jobNum): self._splitId(wmsId)[0],
+			lambda wmsObj, args: wmsObj.cancelJobs(args), self._chunkSize)
 
 
 	def _assignArgs(self, args, assignFun):
@@ -84,8 +89,18 @@ class MultiWMS(WMS):
 		return argMap
 
 
-	def _forwardCall(self, args, assignFun, callFun):
-		argMap = self._assignArgs(args, assignFun)
+	# Return list with (wmsPrefix, generator) - the args of each backend are split into chunks of chunkSize args
+	def _getCalls(self, args, assignFun, callFun, chunkSize):
+		(argMap, result) = (self._assignArgs(args, assignFun), [])
 		for wmsPrefix in filter(lambda wmsPrefix: wmsPrefix in argMap, self.wmsMap):
-			for result in callFun(self.wmsMap[wmsPrefix], argMap[wmsPrefix]):
+			wmsArgs = argMap[wmsPrefix]
+			wmsChunkSize = QM(chunkSize > 0, chunkSize, len(wmsArgs))
+			for idx in range(0, len(wmsArgs), wmsChunkSize):
+				result.append((wmsPrefix, callFun(self.wmsMap[wmsPrefix], wmsArgs[idx:idx + wmsChunkSize])))
+		return result
+
+
+	def _forwardCall(self, args, assignFun, callFun, chunkSize):
+		for (wmsPrefix, generator) in self._getCalls(args, assignFun, callFun, chunkSize):
+			for result in generator:
 				yield result
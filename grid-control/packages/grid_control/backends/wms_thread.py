@@ -12,14 +12,20 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import threading
 from grid_control import utils
 from wms_multi import MultiWMS
 
 class ThreadedMultiWMS(MultiWMS):
-	def _forwardCall(self, args, assignFun, callFun):
-		argMap = self._assignArgs(args, assignFun)
-		makeGenerator = lambda wmsPrefix: (wmsPrefix, callFun(self.wmsMap[wmsPrefix], argMap[wmsPrefix]))
-		activeWMS = filter(lambda wmsPrefix: wmsPrefix in argMap, self.wmsMap)
-		for result in utils.getThreadedGenerator(map(makeGenerator, activeWMS)):
+	def __init__(self, config, defaultWMS, wmsList):
+		MultiWMS.__init__(self, config, defaultWMS, wmsList)
+		# Limits for parallel backend calls (0: unlimited) and number of buffered results
+		self._executor = utils.GeneratorExecutor(
+			maxThreads = config.getInt('wms threads', 0, onChange = None),
+			maxGroupThreads = config.getInt('wms backend threads', 1, onChange = None),
+			maxQueue = config.getInt('wms queue size', 1000, onChange = None),
+			timeout = config.getTime('wms timeout', 0, onChange = None))
+
+
+	def _forwardCall(self, args, assignFun, callFun, chunkSize):
+		for result in self._executor.iterResults(self._getCalls(args, assignFun, callFun, chunkSize)):
 			yield result
@@ -12,7 +12,8 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import os, cStringIO, copy
+import sys, os, cStringIO, copy, marshal, array
+from python_compat import set
 from grid_control import QM, utils, LoadableObject, AbstractError, ConfigError, noDefault, Config, DatasetError
 from nickname_base import NickNameProducer
 
@@ -32,6 +33,9 @@ class DataProvider(LoadableObject):
 		self.emptyFiles = config.getBool('remove empty files', True)
 		self.limitEvents = config.getInt('limit events', -1)
 		self.limitFiles = config.getInt('limit files', -1)
+		# Only retrieve blocks with changed fingerprints during resyncs (if supported by the provider)
+		self.incrementalRefresh = config.getBool('incremental refresh', True, onChange = None)
+		self._blockSelection = None
 
 		nickProducerClass = config.getClass('nickname source', 'SimpleNickNameProducer', cls = NickNameProducer)
 		self._nickProducer = nickProducerClass.getInstance(config)
@@ -157,6 +161,65 @@ class DataProvider(LoadableObject):
 		self._cache = None
 
 
+	# Restrict the retrieval of blocks to the given set of (dataset, block name) keys (None: all blocks)
+	def setBlockSelection(self, selection):
+		self._blockSelection = selection
+
+
+	def getBlockKey(block):
+		return (block[DataProvider.Dataset], block.get(DataProvider.BlockName, '0'))
+	getBlockKey = staticmethod(getBlockKey)
+
+
+	# Fingerprint of a block based on its file list, metadata and locations:
+	# (number of files, number of events, hash of the URLs, metadata and locations)
+	def getBlockFingerprint(block):
+		fileList = block[DataProvider.FileList]
+		fileInfos = utils.sorted(map(lambda fi: (fi[DataProvider.URL], fi.get(DataProvider.Metadata)), fileList))
+		locations = block.get(DataProvider.Locations)
+		if locations != None:
+			locations = utils.sorted(locations)
+		blockHash = utils.md5(repr((fileInfos, block.get(DataProvider.Metadata), locations))).hexdigest()
+		return (len(fileList), sum(map(lambda fi: fi[DataProvider.NEntries], fileList)), blockHash)
+	getBlockFingerprint = staticmethod(getBlockFingerprint)
+
+
+	# Returns {(dataset, block name): fingerprint} - the same fingerprints are stored in the ResyncInfo of the
+	# blocks by the provider - should be cheaper than retrieving the file lists (None: not supported)
+	def getFingerprints(self):
+		return None
+
+
+	# Refresh the cached blocks - returns (blocks, changed flag)
+	# Blocks with unchanged fingerprint are taken from the old blocks, so only changed blocks are retrieved again
+	def refreshBlocks(self, oldBlocks):
+		self.clearCache()
+		fingerprints = None
+		if self.incrementalRefresh and (self.limitEvents < 0) and (self.limitFiles < 0):
+			fingerprints = self.getFingerprints()
+		if fingerprints == None:
+			return (self.getBlocks(), True)
+		(oldBlockMap, unchanged) = ({}, [])
+		for block in oldBlocks:
+			oldBlockMap[DataProvider.getBlockKey(block)] = block
+		for (key, fingerprint) in fingerprints.items():
+			if (fingerprint != None) and (oldBlockMap.get(key, {}).get(DataProvider.ResyncInfo) == fingerprint):
+				block = dict(oldBlockMap[key]) # old and new blocks are modified independently during the resync
+				block[DataProvider.FileList] = list(block[DataProvider.FileList])
+				unchanged.append(block)
+		changedKeys = set(fingerprints).difference(map(DataProvider.getBlockKey, unchanged))
+		changedBlocks = []
+		if changedKeys:
+			utils.vprint('Retrieving %d changed blocks (%d blocks unchanged)' % (len(changedKeys), len(unchanged)), 1)
+			self.setBlockSelection(changedKeys)
+			try:
+				changedBlocks = filter(lambda block: DataProvider.getBlockKey(block) in changedKeys, self.getBlocks())
+			finally:
+				self.setBlockSelection(None)
+		self._cache = unchanged + changedBlocks
+		return (self._cache, (len(unchanged) != len(oldBlocks)) or (len(changedBlocks) > 0))
+
+
 	# Print information about datasets
 	def printDataset(self, level = 2):
 		utils.vprint('Provided datasets:', level)
@@ -220,13 +283,107 @@ class DataProvider(LoadableObject):
 	saveStateRaw = staticmethod(saveStateRaw)
 
 
-	def saveState(self, path, dataBlocks = None, stripMetadata = False):
+	# Save dataset information in binary, columnar format - file names are split into (interned) directories and
+	# base names, the number of events and each metadata item are stored as typed column for all files of a block
+	(binaryMagic, binaryVersion) = ('GCDC', 1)
+	binaryInfos = ['Dataset', 'BlockName', 'Nickname', 'DatasetID', 'NEntries', 'Locations', 'Metadata', 'ResyncInfo']
+	def saveStateBinary(stream, dataBlocks, stripMetadata = False):
+		def encodeColumn(values):
+			try:
+				marshal.dumps(values)
+			except ValueError:
+				return ('r', map(repr, values)) # fallback for metadata without marshal support
+			if values and not filter(lambda x: (type(x) != type(values[0])) or (x != values[0]), values):
+				return ('c', values[0])
+			if not filter(lambda x: (type(x) != int) or (abs(x) >= 2**31), values):
+				return ('i', array.array('i', values).tostring())
+			if not filter(lambda x: type(x) != float, values):
+				return ('d', array.array('d', values).tostring())
+			return ('m', values)
+
+		stream.write(DataProvider.binaryMagic)
+		marshal.dump((DataProvider.binaryVersion, sys.byteorder), stream)
+		dirMap = {}
+		for block in dataBlocks:
+			blockInfo = {}
+			for key in DataProvider.binaryInfos:
+				if block.get(getattr(DataProvider, key)) != None:
+					blockInfo[key] = block[getattr(DataProvider, key)]
+			fileList = block[DataProvider.FileList]
+			(dirNew, dirCol, nameCol) = ([], array.array('i'), [])
+			for url in map(lambda fi: fi[DataProvider.URL], fileList):
+				pos = url.rfind('/') + 1
+				if url[:pos] not in dirMap:
+					dirMap[url[:pos]] = len(dirMap)
+					dirNew.append(url[:pos])
+				dirCol.append(dirMap[url[:pos]])
+				nameCol.append(url[pos:])
+			metaCols = []
+			if stripMetadata:
+				blockInfo.pop('Metadata', None)
+			elif 'Metadata' in blockInfo:
+				metaCols = map(lambda idx: encodeColumn(map(lambda fi: fi[DataProvider.Metadata][idx], fileList)),
+					range(len(blockInfo['Metadata'])))
+			eventCol = encodeColumn(map(lambda fi: fi[DataProvider.NEntries], fileList))
+			marshal.dump((blockInfo, dirNew, dirCol.tostring(), nameCol, eventCol, metaCols), stream)
+	saveStateBinary = staticmethod(saveStateBinary)
+
+
+	# Lazily read blocks from binary dataset information
+	def loadStateBinary(stream):
+		if stream.read(len(DataProvider.binaryMagic)) != DataProvider.binaryMagic:
+			raise DatasetError('Invalid binary dataset information!')
+		(version, byteorder) = marshal.load(stream)
+		if version != DataProvider.binaryVersion:
+			raise DatasetError('Unsupported version of binary dataset information: %s' % version)
+		def decodeArray(fmt, data):
+			result = array.array(fmt)
+			result.fromstring(data)
+			if byteorder != sys.byteorder:
+				result.byteswap()
+			return result.tolist()
+		def decodeColumn((fmt, data), nFiles):
+			if fmt == 'c':
+				return [data] * nFiles
+			elif fmt in ['i', 'd']:
+				return decodeArray(fmt, data)
+			elif fmt == 'r':
+				return map(eval, data)
+			return data
+
+		dirList = []
+		while True:
+			try:
+				(blockInfo, dirNew, dirCol, nameCol, eventCol, metaCols) = marshal.load(stream)
+			except EOFError:
+				break
+			dirList.extend(dirNew)
+			block = {DataProvider.Locations: None}
+			for (key, value) in blockInfo.items():
+				block[getattr(DataProvider, key)] = value
+			urls = map(lambda (dirIdx, name): dirList[dirIdx] + name, zip(decodeArray('i', dirCol), nameCol))
+			fileList = map(lambda (url, events): {DataProvider.URL: url, DataProvider.NEntries: events},
+				zip(urls, decodeColumn(eventCol, len(nameCol))))
+			if metaCols:
+				for (fi, metadata) in zip(fileList, zip(*map(lambda col: decodeColumn(col, len(nameCol)), metaCols))):
+					fi[DataProvider.Metadata] = list(metadata)
+			block[DataProvider.FileList] = fileList
+			yield block
+	loadStateBinary = staticmethod(loadStateBinary)
+
+
+	def saveState(self, path, dataBlocks = None, stripMetadata = False, binary = False):
 		if dataBlocks == None:
 			dataBlocks = self.getBlocks()
-		DataProvider.saveStateRaw(open(path, 'wb'), dataBlocks, stripMetadata)
+		if binary:
+			stream = open(path, 'wb')
+			DataProvider.saveStateBinary(stream, dataBlocks, stripMetadata)
+			stream.close()
+		else:
+			DataProvider.saveStateRaw(open(path, 'wb'), dataBlocks, stripMetadata)
 
 
-	# Load dataset information using ListProvider
+	# Load dataset information (text or binary format) using ListProvider
 	def loadState(path, config = Config()):
 		# None, None = Don't override NickName and ID
 		return DataProvider.open('ListProvider', config.addSections(['dataset']), path, None, None)
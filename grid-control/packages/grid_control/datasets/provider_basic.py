@@ -12,6 +12,7 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
+import os
 from python_compat import rsplit
 from grid_control import QM, utils, ConfigError
 from provider_base import DataProvider
@@ -50,6 +51,15 @@ class ListProvider(DataProvider):
 		self._filename = config.resolvePath(path, True, 'Error resolving dataset file: %s' % path)
 
 
+	# Replace the common prefix of the files (as determined by saveStateRaw) with the forced prefix
+	def _replacePrefix(self, block):
+		urls = map(lambda fi: fi[DataProvider.URL], block[DataProvider.FileList])
+		cPrefix = str.join('/', os.path.commonprefix(urls).split('/')[:-1])
+		cPrefix = QM(len(cPrefix) > 6, cPrefix + '/', '')
+		for fi in block[DataProvider.FileList]:
+			fi[DataProvider.URL] = '%s/%s' % (self._forcePrefix, fi[DataProvider.URL][len(cPrefix):])
+
+
 	def getBlocksInternal(self):
 		def doFilter(block):
 			if self._filter:
@@ -57,8 +67,19 @@ class ListProvider(DataProvider):
 				return self._filter in name
 			return True
 
+		fp = open(self._filename, 'rb')
+		if fp.read(len(DataProvider.binaryMagic)) == DataProvider.binaryMagic:
+			fp.seek(0)
+			for block in DataProvider.loadStateBinary(fp):
+				if self._forcePrefix:
+					self._replacePrefix(block)
+				if doFilter(block):
+					yield block
+			return
+		fp.seek(0)
+
 		(blockinfo, commonMetadata) = (None, [])
-		for line in open(self._filename, 'rb'):
+		for line in fp:
 			# Found start of block:
 			line = line.strip()
 			if line.startswith(';'):
@@ -34,6 +34,28 @@ class DataMultiplexer(DataProvider):
 		return getProposal(splitter)
 
 
+	def clearCache(self):
+		DataProvider.clearCache(self)
+		for provider in self.subprovider:
+			provider.clearCache()
+
+
+	def setBlockSelection(self, selection):
+		DataProvider.setBlockSelection(self, selection)
+		for provider in self.subprovider:
+			provider.setBlockSelection(selection)
+
+
+	def getFingerprints(self):
+		result = {}
+		for provider in self.subprovider:
+			fingerprints = provider.getFingerprints()
+			if fingerprints == None:
+				return None
+			result.update(fingerprints)
+		return result
+
+
 	def getBlocksInternal(self):
 		exceptions = ''
 		for provider in self.subprovider:
@@ -12,11 +12,11 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import os, fnmatch, operator
+import os, fnmatch, operator, itertools
 from grid_control import QM, utils, ConfigError, storage, JobSelector, LoadableObject, Config, DefaultFilesConfigFiller, FileConfigFiller
 from provider_base import DataProvider
 from python_compat import set, md5
-from scanner_base import InfoScanner
+from scanner_base import InfoScanner, ScanCache
 
 class ScanProviderBase(DataProvider):
 	def __init__(self, config, datasetExpr, datasetNick, datasetID = 0):
@@ -29,17 +29,38 @@ class ScanProviderBase(DataProvider):
 		self.kSelectDS = config.getList('dataset key select', [])
 		scanList = config.getList('scanner', datasetExpr)
 		self.scanner = map(lambda cls: InfoScanner.open(cls, config), scanList)
+		# Per-file scanners (eg. event counting) are run in a pool of worker threads and their results
+		# are cached between scans (empty cache path: disabled)
+		self.scanThreads = config.getInt('scanner threads', 4, onChange = None)
+		self.scanCache = ScanCache(config.get('scanner cache', config.getWorkPath('scancache.dat'), onChange = None))
+		for scanner in self.scanner:
+			scanner.setCache(self.scanCache)
 
 
 	def collectFiles(self):
+		def getTask(scanner, level, data):
+			def runScanner(): # entries are copied since scanners update and yield the same dicts
+				result = []
+				for (path, metadata, nEvents, seList, objStore) in scanner.getEntriesVerbose(level, *data):
+					result.append((path, dict(metadata), nEvents, seList, dict(objStore)))
+				return result
+			return runScanner
 		def recurse(level, collectorList, args):
-			if len(collectorList):
+			if len(collectorList) and collectorList[-1].parallel and (self.scanThreads > 1):
+				tasks = itertools.imap(lambda (path, metadata, nEvents, seList, objStore): getTask(collectorList[-1], level,
+					(path, metadata, nEvents, seList, dict(objStore))), recurse(level - 1, collectorList[:-1], args))
+				for result in utils.getThreadedResults(tasks, self.scanThreads, ordered = True):
+					for entry in result:
+						yield entry
+			elif len(collectorList):
 				for data in recurse(level - 1, collectorList[:-1], args):
-					for (path, metadata, nEvents, seList, objStore) in collectorList[-1](level, *data):
+					for (path, metadata, nEvents, seList, objStore) in collectorList[-1].getEntriesVerbose(level, *data):
 						yield (path, dict(metadata), nEvents, seList, objStore)
 			else:
 				yield args
-		return recurse(len(self.scanner), map(lambda x: x.getEntriesVerbose, self.scanner), (None, {}, None, None, {}))
+		for fileInfo in recurse(len(self.scanner), self.scanner, (None, {}, None, None, {})):
+			yield fileInfo
+		self.scanCache.save()
 
 
 	def generateKey(self, keys, base, path, metadata, events, seList, objStore):
@@ -113,13 +134,20 @@ class ScanProviderBase(DataProvider):
 				fnProps = lambda (path, metadata, events, seList, objStore): {
 					DataProvider.URL: path, DataProvider.NEntries: events,
 					DataProvider.Metadata: map(lambda x: metadata.get(x), metaKeys)}
-				yield {
+				block = {
 					DataProvider.Dataset: hashNameDictDS[hashDS],
 					DataProvider.BlockName: hashNameDictB[hashB][1],
 					DataProvider.Locations: blockSEList,
 					DataProvider.Metadata: metaKeys,
 					DataProvider.FileList: map(fnProps, protoBlocks[hashDS][hashB])
 				}
+				block[DataProvider.ResyncInfo] = DataProvider.getBlockFingerprint(block)
+				yield block
+
+
+	# The file lists are only known after scanning - unchanged blocks still don't need to be resynced
+	def getFingerprints(self):
+		return dict(map(lambda block: (DataProvider.getBlockKey(block), block[DataProvider.ResyncInfo]), self.getBlocks()))
 
 
 # Get dataset information from storage url
@@ -12,12 +12,97 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
+import os, marshal, threading
 from grid_control import utils, LoadableObject, AbstractError
 
+# Persistent cache of per-file scan results - entries are keyed by scanner, path and file stamp
+# Local files are identified by size and modification time, remote files are assumed to be immutable
+# Only entries used during the last scan are written back, failed (None) results are not cached
+# Large values shared between files (eg. config contents) are stored only once - keyed by their hash
+class ScanCache(object):
+	def __init__(self, path):
+		(self._path, self._lock, self._used) = (path, threading.Lock(), {})
+		try:
+			self._data = marshal.loads(open(path, 'rb').read())
+		except Exception:
+			self._data = {}
+
+	def getStamp(self, path):
+		if ('://' in path) and not path.startswith('file://'):
+			return None
+		try:
+			stat = os.stat(path.replace('file://', '', 1))
+			return (stat.st_size, int(stat.st_mtime))
+		except OSError:
+			return False # not cacheable
+
+	def lookup(self, scanner, path, fun):
+		stamp = self.getStamp(path)
+		if stamp == False:
+			return fun()
+		key = (scanner, path, stamp)
+		self._lock.acquire()
+		try:
+			if key in self._data:
+				self._used[key] = self._data[key]
+				return self._used[key]
+		finally:
+			self._lock.release()
+		result = fun()
+		try:
+			marshal.dumps(result)
+		except ValueError:
+			return result
+		if result == None:
+			return result
+		self._lock.acquire()
+		try:
+			self._used[key] = result
+		finally:
+			self._lock.release()
+		return result
+
+	def share(self, key, value):
+		self._lock.acquire()
+		try:
+			self._used[('shared', key)] = self._data.setdefault(('shared', key), value)
+		finally:
+			self._lock.release()
+
+	def getShared(self, key):
+		self._lock.acquire()
+		try:
+			if ('shared', key) in self._data:
+				self._used[('shared', key)] = self._data[('shared', key)]
+				return self._used[('shared', key)]
+		finally:
+			self._lock.release()
+
+	def save(self):
+		if not (self._path and os.path.exists(os.path.dirname(self._path))):
+			return
+		fp = open(self._path + '.tmp', 'wb')
+		fp.write(marshal.dumps(self._used))
+		fp.close()
+		os.rename(self._path + '.tmp', self._path)
+
+
 class InfoScanner(LoadableObject):
+	parallel = False # Scanners processing each file independently can run in the worker pool
+	_cache = None
+
 	def __init__(self, config):
 		pass
 
+	def setCache(self, cache):
+		self._cache = cache
+
+	# Returns the cached result of fun for the given file (keyed by scanner name, options and file stamp)
+	def cached(self, path, options, fun):
+		if self._cache:
+			return self._cache.lookup((self.__class__.__name__, options), path, fun)
+		return fun()
+
 	def getGuards(self):
 		return ([], [])
 
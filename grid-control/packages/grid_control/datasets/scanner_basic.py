@@ -12,7 +12,7 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import os, sys
+import os, sys, threading
 from grid_control import QM, utils, ConfigError, storage, JobSelector, LoadableObject, Config, JobDB, JobSelector, Job, RethrowError, DefaultFilesConfigFiller, FileConfigFiller
 from scanner_base import InfoScanner
 from grid_control.datasets import DataProvider
@@ -178,12 +178,14 @@ class MatchDelimeter(InfoScanner):
 
 
 class ParentLookup(InfoScanner):
+	parallel = True
+
 	def __init__(self, config):
 		self.parentKeys = config.getList('parent keys', [])
 		self.looseMatch = config.getInt('parent match level', 1)
 		self.source = config.get('parent source', '')
 		self.merge = config.getBool('merge parents', False)
-		self.lfnMap = {}
+		(self.lfnMap, self.lfnLock) = ({}, threading.Lock())
 
 	def getGuards(self):
 		return ([], QM(self.merge, [], ['PARENT_PATH']))
@@ -197,10 +199,14 @@ class ParentLookup(InfoScanner):
 	def getEntries(self, path, metadata, events, seList, objStore):
 		datacachePath = os.path.join(objStore.get('GC_WORKDIR', ''), 'datacache.dat')
 		source = QM((self.source == '') and os.path.exists(datacachePath), datacachePath, self.source)
-		if source and (source not in self.lfnMap):
-			pSource = DataProvider.create(Config(), None, source, 'ListProvider')
-			for (n, fl) in map(lambda b: (b[DataProvider.Dataset], b[DataProvider.FileList]), pSource.getBlocks()):
-				self.lfnMap.setdefault(source, {}).update(dict(map(lambda fi: (self.lfnTrans(fi[DataProvider.URL]), n), fl)))
+		self.lfnLock.acquire()
+		try:
+			if source and (source not in self.lfnMap):
+				pSource = DataProvider.create(Config(), None, source, 'ListProvider')
+				for (n, fl) in map(lambda b: (b[DataProvider.Dataset], b[DataProvider.FileList]), pSource.getBlocks()):
+					self.lfnMap.setdefault(source, {}).update(dict(map(lambda fi: (self.lfnTrans(fi[DataProvider.URL]), n), fl)))
+		finally:
+			self.lfnLock.release()
 		pList = set()
 		for key in filter(lambda k: k in metadata, self.parentKeys):
 			pList.update(map(lambda pPath: self.lfnMap.get(source, {}).get(self.lfnTrans(pPath)), metadata[key]))
@@ -209,6 +215,8 @@ class ParentLookup(InfoScanner):
 
 
 class DetermineEvents(InfoScanner):
+	parallel = True
+
 	def __init__(self, config):
 		self.eventsCmd = config.get('events command', '')
 		self.eventsKey = config.get('events key', '')
@@ -217,8 +225,12 @@ class DetermineEvents(InfoScanner):
 	def getEntries(self, path, metadata, events, seList, objStore):
 		events = int(metadata.get(self.eventsKey, QM(events >= 0, events, self.eventsDefault)))
 		if self.eventsCmd:
-			try:
-				events = int(os.popen('%s %s' % (self.eventsCmd, path)).readlines()[-1])
-			except:
-				pass
+			def getEvents():
+				try:
+					return int(os.popen('%s %s' % (self.eventsCmd, path)).readlines()[-1])
+				except:
+					return None
+			cmdEvents = self.cached(path, self.eventsCmd, getEvents)
+			if cmdEvents != None:
+				events = cmdEvents
 		yield (path, metadata, events, seList, objStore)
@@ -12,22 +12,42 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-from python_compat import next
-import os, tarfile, time, copy, cStringIO, threading, gzip
+from python_compat import next, set
+import os, sys, tarfile, time, copy, cStringIO, threading, gzip, tempfile, marshal, itertools
 from grid_control import QM, LoadableObject, AbstractError, RuntimeError, utils, ConfigError, Config, noDefault
 from provider_base import DataProvider
 
-def fast_search(lst, cmp_op):
-	def bisect_left_cmp(lst, cmp_op):
-		(lo, hi) = (0, len(lst))
-		while lo < hi:
-			mid = (lo + hi) / 2
-			if cmp_op(lst[mid]) < 0: lo = mid + 1
-			else: hi = mid
-		return lo
-	idx = bisect_left_cmp(lst, cmp_op)
-	if idx < len(lst) and cmp_op(lst[idx]) == 0:
-		return lst[idx]
+try:	# multiprocessing >= Python 2.6
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
+
+# Splittings are spooled to a temporary file to keep the memory usage during resyncs bounded
+class SplitSpool(object):
+	def __init__(self, tmpDir):
+		(self._fp, self._len) = (tempfile.TemporaryFile(dir = tmpDir), 0)
+
+	def __len__(self):
+		return self._len
+
+	def append(self, entry):
+		marshal.dump(entry, self._fp)
+		self._len += 1
+
+	def __iter__(self):
+		self._fp.seek(0)
+		for idx in xrange(self._len):
+			yield marshal.load(self._fp)
+
+# Helper functions to split groups of blocks (executed in worker processes)
+# The splitter is inherited by the forked workers - blocks and splittings are transferred with marshal
+def initSplitWorker(splitter):
+	global workerSplitter
+	workerSplitter = splitter
+
+def splitBlockGroup(blocks):
+	splitInfoList = list(workerSplitter.splitDatasetInternal(marshal.loads(blocks)))
+	return marshal.dumps((splitInfoList, workerSplitter._protocol))
 
 ResyncMode = utils.makeEnum(['disable', 'complete', 'changed', 'ignore']) # prio: "disable" overrides "complete", etc.
 ResyncMode.noChanged = [ResyncMode.disable, ResyncMode.complete, ResyncMode.ignore]
@@ -65,6 +85,13 @@ class DataSplitter(LoadableObject):
 		#   behaviour in case of job changes - disable changed jobs, preserve job number of changed jobs or reorder
 		self.resyncOrder = getResyncConfig('jobs', ResyncOrder.append, ResyncOrder.allMembers, ResyncOrder)
 
+		# Memory budget (in MB) for decoded chunks of the job mapping file and number of chunks to read ahead
+		self.cacheSize = config.getInt('splitting cache size', 64, onChange = None) * 1024 * 1024
+		self.readAhead = config.getInt('splitting read ahead', 1, onChange = None)
+		# Number of worker processes (0: number of cores) and number of blocks per worker task for the initial splitting
+		self.splitProcesses = config.getInt('splitting processes', 1, onChange = None)
+		self.splitGroupSize = config.getInt('splitting group size', 100, onChange = None)
+
 
 
 	def setup(self, func, block, item, default = noDefault):
@@ -103,9 +130,43 @@ class DataSplitter(LoadableObject):
 		raise AbstractError
 
 
+	def _getSplitProcesses(self):
+		if not multiprocessing:
+			return 1
+		return QM(self.splitProcesses > 0, self.splitProcesses, multiprocessing.cpu_count())
+
+
+	# Blocks are split independently in a pool of worker processes - results are yielded in block order
+	def _splitDatasetParallel(self, blocks):
+		if (self._getSplitProcesses() <= 1) or (len(blocks) <= self.splitGroupSize):
+			for splitInfo in self.splitDatasetInternal(blocks):
+				yield splitInfo
+			return
+		# Query the splitting settings of each nickname before starting the workers - config access
+		# and the protocol of the splitter are not transferred back from the worker processes
+		nickDone = set()
+		for block in blocks:
+			if block.get(DataProvider.Nickname) not in nickDone:
+				nickDone.add(block.get(DataProvider.Nickname))
+				list(self.splitDatasetInternal([copy.deepcopy(block)]))
+		groupList = map(lambda idx: marshal.dumps(blocks[idx:idx + self.splitGroupSize]), range(0, len(blocks), self.splitGroupSize))
+		pool = multiprocessing.Pool(self._getSplitProcesses(), initSplitWorker, (self,))
+		try:
+			for (splitInfoList, protocol) in itertools.imap(marshal.loads, pool.imap(splitBlockGroup, groupList)):
+				for (key, value) in protocol.items():
+					self._protocol.setdefault(key, value)
+				for splitInfo in splitInfoList:
+					yield splitInfo
+		except: # also if the consumer stops early - no try/finally around yield for older python versions
+			excInfo = sys.exc_info()
+			pool.terminate()
+			raise excInfo[0], excInfo[1], excInfo[2]
+		pool.terminate()
+
+
 	def splitDataset(self, path, blocks):
 		log = utils.ActivityLog('Splitting dataset into jobs')
-		self.saveState(path, self.splitDatasetInternal(blocks))
+		self.saveState(path, self._splitDatasetParallel(blocks))
 		self.importState(path)
 
 
@@ -153,23 +214,37 @@ class DataSplitter(LoadableObject):
 
 	def resyncMapping(self, newSplitPath, oldBlocks, newBlocks):
 		log = utils.ActivityLog('Performing resynchronization of dataset')
+		timings = [('compare blocks', time.time())]
 		(blocksAdded, blocksMissing, blocksMatching) = DataProvider.resyncSources(oldBlocks, newBlocks)
-		for rmBlock in blocksMissing: # Files in matching blocks are already sorted
-			rmBlock[DataProvider.FileList].sort(lambda a, b: cmp(a[DataProvider.URL], b[DataProvider.URL]))
+		blockMap = {}
+		for rmBlock in blocksMissing:
+			blockMap[(rmBlock[DataProvider.Dataset], rmBlock[DataProvider.BlockName])] = (rmBlock, None, rmBlock[DataProvider.FileList], [])
+		for blockInfo in blocksMatching: # compare with old block
+			blockMap[(blockInfo[0][DataProvider.Dataset], blockInfo[0][DataProvider.BlockName])] = blockInfo
 		del log
 
-		# Get block information (oldBlock, newBlock, filesMissing, filesMatched) which splitInfo is based on
+		# Get URL-keyed index of the block information (oldBlock, newBlock, filesMissing, filesMatched)
+		# which splitInfo is based on - the index is built on first use of each block
+		blockIndex = {}
 		def getMatchingBlock(splitInfo):
-			# Comparison operator between dataset block and splitting
-			def cmpSplitBlock(dsBlock, splitInfo):
-				if dsBlock[DataProvider.Dataset] == splitInfo[DataSplitter.Dataset]:
-					return cmp(dsBlock[DataProvider.BlockName], splitInfo[DataSplitter.BlockName])
-				return cmp(dsBlock[DataProvider.Dataset], splitInfo[DataSplitter.Dataset])
-			# Search for block in missing and matched blocks
-			result = fast_search(blocksMissing, lambda x: cmpSplitBlock(x, splitInfo))
-			if result:
-				return (result, None, result[DataProvider.FileList], [])
-			return fast_search(blocksMatching, lambda x: cmpSplitBlock(x[0], splitInfo)) # compare with old block
+			key = (splitInfo[DataSplitter.Dataset], splitInfo[DataSplitter.BlockName])
+			if key not in blockIndex:
+				(oldBlock, newBlock, filesMissing, filesMatched) = blockMap[key]
+				(oldFileMap, missingMap, matchedMap) = ({}, {}, {})
+				for fi in oldBlock[DataProvider.FileList]:
+					oldFileMap[fi[DataProvider.URL]] = fi
+				for fi in filesMissing:
+					missingMap[fi[DataProvider.URL]] = fi
+				changedURLs = set(missingMap)
+				for (oldFI, newFI) in filesMatched:
+					matchedMap[oldFI[DataProvider.URL]] = (oldFI, newFI)
+					if (oldFI[DataProvider.NEntries] != newFI[DataProvider.NEntries]) or \
+							(oldFI.get(DataProvider.Metadata) != newFI.get(DataProvider.Metadata)):
+						changedURLs.add(oldFI[DataProvider.URL])
+				# Any change of the block metadata affects all splittings of the block
+				allChanged = (not newBlock) or (oldBlock.get(DataProvider.Metadata) != newBlock.get(DataProvider.Metadata))
+				blockIndex[key] = (oldBlock, newBlock, oldFileMap, missingMap, matchedMap, changedURLs, allChanged)
+			return blockIndex[key]
 
 		#######################################
 		# Process modifications of event sizes
@@ -182,14 +257,21 @@ class DataSplitter(LoadableObject):
 			if oldSplit.get(DataSplitter.Invalid, False):
 				return (oldSplit, ResyncMode.ignore, [])
 
-			(oldBlock, newBlock, filesMissing, filesMatched) = getMatchingBlock(oldSplit)
+			(oldBlock, newBlock, oldFileMap, missingMap, matchedMap, changedURLs, allChanged) = getMatchingBlock(oldSplit)
+			# Splittings without modified files only need to be copied if the locations have changed
+			if not (allChanged or changedURLs.intersection(oldSplit[DataSplitter.FileList])) and \
+					oldSplit[DataSplitter.FileList] and (oldSplit[DataSplitter.NEntries] > 0):
+				if oldSplit.get(DataSplitter.Locations) == newBlock.get(DataProvider.Locations):
+					return (oldSplit, ResyncMode.ignore, [])
+				modSI = copy.copy(oldSplit)
+				modSI[DataSplitter.Locations] = newBlock.get(DataProvider.Locations)
+				return (modSI, ResyncMode.ignore, [])
 
 			modSI = copy.deepcopy(oldSplit)
 			if newBlock:
 				modSI[DataSplitter.Locations] = newBlock.get(DataProvider.Locations)
 			# Determine size infos and get started
-			search_url = lambda url: fast_search(oldBlock[DataProvider.FileList], lambda x: cmp(x[DataProvider.URL], url))
-			sizeInfo = map(lambda url: search_url(url)[DataProvider.NEntries], modSI[DataSplitter.FileList])
+			sizeInfo = map(lambda url: oldFileMap[url][DataProvider.NEntries], modSI[DataSplitter.FileList])
 			extended = []
 			metaIdxLookup = []
 			for meta in self.metaOpts:
@@ -318,7 +400,7 @@ class DataSplitter(LoadableObject):
 			while idx < len(modSI[DataSplitter.FileList]):
 				url = modSI[DataSplitter.FileList][idx]
 
-				rmFI = fast_search(filesMissing, lambda x: cmp(x[DataProvider.URL], url))
+				rmFI = missingMap.get(url)
 				if rmFI:
 					removeFile(idx, rmFI)
 					procMode = min(procMode, self.mode_removed)
@@ -326,7 +408,7 @@ class DataSplitter(LoadableObject):
 						procMode = min(procMode, self.metaOpts.get(meta, ResyncMode.ignore))
 					continue # dont increase filelist index!
 
-				(oldFI, newFI) = fast_search(filesMatched, lambda x: cmp(x[0][DataProvider.URL], url))
+				(oldFI, newFI) = matchedMap[url]
 				if DataProvider.Metadata in newFI:
 					newMetadata.append(newFI[DataProvider.Metadata])
 					for (oldMI, newMI, metaProc) in metaIdxLookup:
@@ -370,10 +452,12 @@ class DataSplitter(LoadableObject):
 			return (modSI, procMode, extended)
 
 		# Process splittings
+		tmpDir = os.path.dirname(os.path.abspath(newSplitPath))
 		def resyncIterator_raw():
-			extList = []
+			extList = SplitSpool(tmpDir)
 			# Perform resync of existing splittings
-			for jobNum in range(self.getMaxJobs()):
+			timings.append(('resync splittings', time.time()))
+			for jobNum in xrange(self.getMaxJobs()):
 				splitInfo = self.getSplitInfo(jobNum)
 				if DataSplitter.Comment not in splitInfo:
 					splitInfo[DataSplitter.Comment] = 'src: %d ' % jobNum
@@ -383,18 +467,21 @@ class DataSplitter(LoadableObject):
 					modSplitInfo = copy.copy(splitInfo)
 					modSplitInfo[DataSplitter.Invalid] = True
 					procMode = ResyncMode.disable
-				extList.extend(extended)
+				for extSplitInfo in extended:
+					extList.append(extSplitInfo)
 				yield (jobNum, modSplitInfo, procMode)
 			# Yield collected extensions of existing splittings
+			timings.append(('extend splittings', time.time()))
 			for extSplitInfo in extList:
 				yield (None, extSplitInfo, ResyncMode.ignore)
 			# Yield completely new splittings
+			timings.append(('split new blocks', time.time()))
 			if self.mode_new == ResyncMode.complete:
 				for newSplitInfo in self.splitDatasetInternal(blocksAdded):
 					yield (None, newSplitInfo, ResyncMode.ignore)
 
 		def getSplitContainer():
-			(rawInfo, extInfo) = ([], [])
+			(rawInfo, extInfo) = (SplitSpool(tmpDir), SplitSpool(tmpDir))
 			for (jobNum, splitInfo, procMode) in resyncIterator_raw():
 				if jobNum != None: # Separate existing and new splittings
 					rawInfo.append((jobNum, splitInfo, procMode))
@@ -424,7 +511,7 @@ class DataSplitter(LoadableObject):
 				resyncIter = getReorderIterator(rawInfo, iter(extInfo))
 			elif self.resyncOrder == ResyncOrder.reorder:
 				rawInfo, extInfo = getSplitContainer()
-				tsc = utils.TwoSidedContainer(rawInfo + extInfo)
+				tsc = utils.TwoSidedContainer(list(rawInfo) + list(extInfo))
 				resyncIter = getReorderIterator(tsc.forward(), tsc.backward())
 			else:
 				resyncIter = resyncIterator_raw()
@@ -442,6 +529,10 @@ class DataSplitter(LoadableObject):
 		self.saveState(newSplitPathTMP, resyncIterator(), sourceLen = self.getMaxJobs(),
 			message = 'Performing resynchronization of dataset map (progress is estimated)')
 
+		timings.append(('total', time.time()))
+		timeInfo = map(lambda ((phase, start), (nextPhase, end)): '%s: %.2fs' % (phase, end - start), zip(timings, timings[1:]))
+		utils.vprint('Dataset resync timings - %s (total: %.2fs)' % (str.join(', ', timeInfo), timings[-1][1] - timings[0][1]), 1)
+
 		if self.interactive:
 			# PRINT INFO, ASK
 			if not getUserBool('Do you want to use the new dataset splitting?', False):
@@ -454,20 +545,21 @@ class DataSplitter(LoadableObject):
 	# Save as tar file to allow random access to mapping data with little memory overhead
 	def saveState(self, path, source = None, sourceLen = None, message = 'Writing job mapping file'):
 		from splitter_io import DataSplitterIO
-		if source and not sourceLen:
-			source = list(source)
-			sourceLen = len(source)
-		elif not source:
+		if not source:
 			(source, sourceLen) = (self.splitSource, self.getMaxJobs())
 		# Write metadata to allow reconstruction of data splitter
 		meta = {'ClassName': self.__class__.__name__}
 		meta.update(self._protocol)
-		DataSplitterIO().saveState(path, meta, source, sourceLen, message)
+		def protocolSource(): # protocol is completed while splitting - metadata is written at the end
+			for splitInfo in source:
+				yield splitInfo
+			meta.update(self._protocol)
+		DataSplitterIO().saveState(path, meta, protocolSource(), sourceLen, message)
 
 
 	def importState(self, path):
 		from splitter_io import DataSplitterIO
-		self.splitSource = DataSplitterIO().loadState(path)
+		self.splitSource = DataSplitterIO().loadState(path, self.cacheSize, self.readAhead)
 
 
 	def loadState(path, cfg = None):
@@ -12,27 +12,108 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import os, tarfile, time, copy, cStringIO, threading, gzip
+import os, tarfile, time, copy, cStringIO, threading, gzip, struct, marshal, mmap, zlib
 from grid_control import QM, LoadableObject, AbstractError, RuntimeError, utils, ConfigError, Config, noDefault
 from provider_base import DataProvider
 from splitter_base import DataSplitter
 
-class BaseJobFileTarAdaptor(object):
-	def __init__(self, path):
-		log = utils.ActivityLog('Reading job mapping file')
-		self.mutex = threading.Semaphore()
-		self._fmt = utils.DictFormat()
-		self._tar = tarfile.open(path, 'r:')
-		(self._cacheKey, self._cacheTar) = (None, None)
-
-		metadata = self._fmt.parse(self._tar.extractfile('Metadata').readlines(), keyParser = {None: str})
+class BaseJobFileAdaptor(object):
+	def _readMetadata(self, lines):
+		metadata = self._fmt.parse(lines, keyParser = {None: str})
 		self.maxJobs = metadata.pop('MaxJobs')
 		self.classname = metadata.pop('ClassName')
 		self.metadata = {None: dict(filter(lambda (k, v): not k.startswith('['), metadata.items()))}
 		for (k, v) in filter(lambda (k, v): k.startswith('['), metadata.items()):
 			self.metadata.setdefault('None %s' % k.split(']')[0].lstrip('['), {})[k.split(']')[1].strip()] = v
+
+
+# LRU cache of decoded chunks of the job mapping file with a memory budget (in bytes)
+# Sequential access to chunks triggers decoding of the following chunks in the background
+class SplitChunkCache(object):
+	def __init__(self, loadFun, cacheSize, readAhead):
+		(self._loadFun, self._cacheSize, self._readAhead) = (loadFun, cacheSize, readAhead)
+		(self._lock, self._cache, self._order, self._size) = (threading.Lock(), {}, [], 0)
+		(self._lastIdx, self._prefetchThread, self._prefetchIdx) = (None, None, [])
+		(self.hits, self.misses) = (0, 0)
+
+	def __repr__(self):
+		return '%s(chunks = %d, size = %d, hits = %d, misses = %d)' % (self.__class__.__name__,
+			len(self._order), self._size, self.hits, self.misses)
+
+	def _lookup(self, idx, count = True):
+		self._lock.acquire()
+		try:
+			result = self._cache.get(idx)
+			if result:
+				self._order.remove(idx)
+				self._order.append(idx)
+				self.hits += int(count)
+			return result
+		finally:
+			self._lock.release()
+
+	def _insert(self, idx, value):
+		(size, data) = value
+		self._lock.acquire()
+		try:
+			if idx in self._cache:
+				return
+			(self._cache[idx], self._size) = (value, self._size + size)
+			self._order.append(idx)
+			while (self._size > self._cacheSize) and (len(self._order) > 1):
+				self._size -= self._cache.pop(self._order.pop(0))[0]
+		finally:
+			self._lock.release()
+
+	def _prefetch(self, idxList):
+		for idx in idxList:
+			if not self._lookup(idx, count = False):
+				try:
+					self._insert(idx, self._loadFun(idx))
+				except:
+					return # chunk is missing (end of file) - errors are reported on regular access
+
+	def get(self, idx):
+		result = self._lookup(idx)
+		prefetchActive = self._prefetchThread and self._prefetchThread.isAlive()
+		if (not result) and prefetchActive and (idx in self._prefetchIdx):
+			self._prefetchThread.join() # chunk is already being decoded
+			(result, prefetchActive) = (self._lookup(idx), False)
+		if not result:
+			self.misses += 1
+			result = self._loadFun(idx)
+			self._insert(idx, result)
+		# Decode following chunks in the background during sequential scans
+		if (self._readAhead > 0) and (self._lastIdx == idx - 1) and not prefetchActive:
+			self._prefetchIdx = filter(lambda nextIdx: nextIdx not in self._cache, range(idx + 1, idx + 1 + self._readAhead))
+			if self._prefetchIdx:
+				self._prefetchThread = utils.gcStartThread('Decoding job mapping file', self._prefetch, self._prefetchIdx)
+		self._lastIdx = idx
+		return result[1]
+
+
+class BaseJobFileTarAdaptor(BaseJobFileAdaptor):
+	def __init__(self, path, keySize = 100, cacheSize = 64 * 1024 * 1024, readAhead = 1):
+		log = utils.ActivityLog('Reading job mapping file')
+		self.mutex = threading.Semaphore()
+		self._fmt = utils.DictFormat()
+		(self._tar, self._tarLock, self.keySize) = (tarfile.open(path, 'r:'), threading.Lock(), keySize)
+		self._cache = SplitChunkCache(self._loadChunk, cacheSize, readAhead)
+		self._readMetadata(self._tar.extractfile('Metadata').readlines())
 		del log
 
+	def _loadChunk(self, idx):
+		self._tarLock.acquire()
+		try:
+			data = self._tar.extractfile('%03dXX.tgz' % idx).read()
+		finally:
+			self._tarLock.release()
+		data = gzip.GzipFile(fileobj = cStringIO.StringIO(data)).read() # 3-4x speedup for sequential access
+		return (len(data), tarfile.open(mode = 'r', fileobj = cStringIO.StringIO(data)))
+
+	def _getChunk(self, key):
+		return self._cache.get(key / self.keySize)
+
 
 class DataSplitterIO_V1:
 	# Save as tar file to allow random access to mapping data with little memory overhead
@@ -57,7 +138,7 @@ class DataSplitterIO_V1:
 				subTarFileObj = cStringIO.StringIO()
 				subTarFile = tarfile.open(mode = 'w:gz', fileobj = subTarFileObj)
 				del log
-				log = utils.ActivityLog('%s [%d / %d]' % (message, jobNum, sourceLen))
+				log = utils.ActivityLog('%s [%s]' % (message, QM(sourceLen == None, jobNum, '%d / %s' % (jobNum, sourceLen))))
 			# Determine shortest way to store file list
 			tmp = entry.pop(DataSplitter.FileList)
 			commonprefix = os.path.commonprefix(tmp)
@@ -92,22 +173,18 @@ class DataSplitterIO_V1:
 		tar.close()
 
 
-	def loadState(self, path):
+	def loadState(self, path, cacheSize = 64 * 1024 * 1024, readAhead = 1):
 		class JobFileTarAdaptor_V1(BaseJobFileTarAdaptor):
 			def __getitem__(self, key):
 				self.mutex.acquire()
-				if not self._cacheKey == key / 100:
-					self._cacheKey = key / 100
-					subTarFileObj = self._tar.extractfile('%03dXX.tgz' % (key / 100))
-					subTarFileObj = cStringIO.StringIO(gzip.GzipFile(fileobj = subTarFileObj).read()) # 3-4x speedup for sequential access
-					self._cacheTar = tarfile.open(mode = 'r', fileobj = subTarFileObj)
+				chunkTar = self._getChunk(key)
 				parserMap = { None: str, DataSplitter.NEntries: int, DataSplitter.Skipped: int, 
 					DataSplitter.DatasetID: int, DataSplitter.Invalid: utils.parseBool,
 					DataSplitter.Locations: utils.parseList, DataSplitter.MetadataHeader: eval,
 					DataSplitter.Metadata: lambda x: eval(x.strip("'")) }
-				data = self._fmt.parse(self._cacheTar.extractfile('%05d/info' % key).readlines(),
+				data = self._fmt.parse(chunkTar.extractfile('%05d/info' % key).readlines(),
 					keyParser = {None: int}, valueParser = parserMap)
-				fileList = self._cacheTar.extractfile('%05d/list' % key).readlines()
+				fileList = chunkTar.extractfile('%05d/list' % key).readlines()
 				if DataSplitter.CommonPrefix in data:
 					fileList = map(lambda x: '%s/%s' % (data[DataSplitter.CommonPrefix], x), fileList)
 				data[DataSplitter.FileList] = map(str.strip, fileList)
@@ -115,7 +192,7 @@ class DataSplitterIO_V1:
 				return data
 
 		try:
-			return JobFileTarAdaptor_V1(path)
+			return JobFileTarAdaptor_V1(path, 100, cacheSize, readAhead)
 		except:
 			raise ConfigError("No valid dataset splitting found in '%s'." % path)
 
@@ -147,7 +224,7 @@ class DataSplitterIO_V2:
 				subTarFileObj = cStringIO.StringIO()
 				subTarFile = tarfile.open(mode = 'w:gz', fileobj = subTarFileObj)
 				del log
-				log = utils.ActivityLog('%s [%d / %d]' % (message, jobNum, sourceLen))
+				log = utils.ActivityLog('%s [%s]' % (message, QM(sourceLen == None, jobNum, '%d / %s' % (jobNum, sourceLen))))
 			# Determine shortest way to store file list
 			tmp = entry.pop(DataSplitter.FileList)
 			commonprefix = os.path.commonprefix(tmp)
@@ -183,26 +260,18 @@ class DataSplitterIO_V2:
 		tar.close()
 
 
-	def loadState(self, path):
+	def loadState(self, path, cacheSize = 64 * 1024 * 1024, readAhead = 1):
 		class JobFileTarAdaptor_V2(BaseJobFileTarAdaptor):
-			def __init__(self, path, keySize):
-				BaseJobFileTarAdaptor.__init__(self, path)
-				self.keySize = keySize
-
 			def __getitem__(self, key):
 				if key >= self.maxJobs:
 					raise IndexError
 				self.mutex.acquire()
-				if not self._cacheKey == key / self.keySize:
-					self._cacheKey = key / self.keySize
-					subTarFileObj = self._tar.extractfile('%03dXX.tgz' % (key / self.keySize))
-					subTarFileObj = cStringIO.StringIO(gzip.GzipFile(fileobj = subTarFileObj).read()) # 3-4x speedup for sequential access
-					self._cacheTar = tarfile.open(mode = 'r', fileobj = subTarFileObj)
+				chunkTar = self._getChunk(key)
 				parserMap = { None: str, DataSplitter.NEntries: int, DataSplitter.Skipped: int, 
 					DataSplitter.DatasetID: int, DataSplitter.Invalid: utils.parseBool,
 					DataSplitter.Locations: utils.parseList, DataSplitter.MetadataHeader: eval,
 					DataSplitter.Metadata: lambda x: eval(x.strip("'")) }
-				fullData = self._cacheTar.extractfile('%05d' % key).readlines()
+				fullData = chunkTar.extractfile('%05d' % key).readlines()
 				data = self._fmt.parse(filter(lambda x: not x.startswith('='), fullData),
 					keyParser = {None: int}, valueParser = parserMap)
 				fileList = map(lambda x: x[1:], filter(lambda x: x.startswith('='), fullData))
@@ -213,26 +282,124 @@ class DataSplitterIO_V2:
 				return data
 
 		try:
-			return JobFileTarAdaptor_V2(path, self.keySize)
+			return JobFileTarAdaptor_V2(path, self.keySize, cacheSize, readAhead)
+		except:
+			raise ConfigError("No valid dataset splitting found in '%s'." % path)
+
+
+# Flat binary file with fixed-width offset index, which is memory mapped to allow O(1) random access
+# Layout: header | job records | string table | metadata | index (offset of each job record)
+# Job records are compressed, marshalled dicts - names of datasets, blocks, nicknames, locations and file prefixes
+# are replaced by their position in the string table
+class DataSplitterIO_V3:
+	(magic, header, indexEntry) = ('GCS3', '>4sIQQQ', '>Q')
+	(headerSize, indexEntrySize) = (struct.calcsize(header), struct.calcsize(indexEntry))
+	stringKeys = [DataSplitter.Dataset, DataSplitter.BlockName, DataSplitter.Nickname, DataSplitter.CommonPrefix]
+
+	def saveState(self, path, meta, source, sourceLen, message):
+		fp = open(path, 'wb')
+		fp.write('\0' * self.headerSize) # header is written at the end
+		(stringMap, stringList, offsetList) = ({}, [], [])
+		def getStringIdx(value):
+			if value not in stringMap:
+				stringMap[value] = len(stringList)
+				stringList.append(value)
+			return stringMap[value]
+
+		log = None
+		(jobNum, lastValid) = (-1, -1)
+		for jobNum, entry in enumerate(source):
+			if not entry.get(DataSplitter.Invalid, False):
+				lastValid = jobNum
+			if jobNum % 100 == 0:
+				del log
+				log = utils.ActivityLog('%s [%s]' % (message, QM(sourceLen == None, jobNum, '%d / %s' % (jobNum, sourceLen))))
+			record = dict(entry)
+			# Determine shortest way to store file list
+			fileList = record.pop(DataSplitter.FileList)
+			commonprefix = str.join('/', os.path.commonprefix(fileList).split('/')[:-1])
+			if len(commonprefix) > 6:
+				record[DataSplitter.CommonPrefix] = commonprefix
+				fileList = map(lambda x: x.replace(commonprefix + '/', ''), fileList)
+			record[DataSplitter.FileList] = fileList
+			for key in filter(lambda key: record.get(key) != None, self.stringKeys):
+				record[key] = getStringIdx(record[key])
+			if record.get(DataSplitter.Locations) != None:
+				record[DataSplitter.Locations] = map(getStringIdx, record[DataSplitter.Locations])
+			offsetList.append(fp.tell())
+			fp.write(zlib.compress(marshal.dumps(record)))
+		del log
+
+		stringOffset = fp.tell()
+		fp.write(marshal.dumps(stringList))
+		# Write metadata to allow reconstruction of data splitter
+		meta['MaxJobs'] = lastValid + 1
+		metaOffset = fp.tell()
+		fp.write(str.join('', utils.DictFormat().format(meta)))
+		indexOffset = fp.tell()
+		fp.write(str.join('', map(lambda offset: struct.pack(self.indexEntry, offset), offsetList + [stringOffset])))
+		fp.seek(0)
+		fp.write(struct.pack(self.header, self.magic, len(offsetList), stringOffset, metaOffset, indexOffset))
+		fp.close()
+
+
+	def loadState(self, path):
+		class JobFileMapAdaptor_V3(BaseJobFileAdaptor):
+			def __init__(self, path, ioCls):
+				self._fmt = utils.DictFormat()
+				self._fp = open(path, 'rb')
+				self._map = mmap.mmap(self._fp.fileno(), 0, access = mmap.ACCESS_READ)
+				(magic, self._nRecords, stringOffset, metaOffset, self._indexOffset) = \
+					struct.unpack(ioCls.header, self._map[:ioCls.headerSize])
+				if magic != ioCls.magic:
+					raise RuntimeError('Invalid dataset splitting file')
+				(self._stringKeys, self._indexEntry, self._indexEntrySize) = (ioCls.stringKeys, ioCls.indexEntry, ioCls.indexEntrySize)
+				self._stringList = marshal.loads(self._map[stringOffset:metaOffset])
+				self._readMetadata(self._map[metaOffset:self._indexOffset])
+
+			def __getitem__(self, key):
+				if (key >= self.maxJobs) or (key >= self._nRecords):
+					raise IndexError
+				pos = self._indexOffset + key * self._indexEntrySize
+				(start, end) = struct.unpack('>2' + self._indexEntry[1:], self._map[pos:pos + 2 * self._indexEntrySize])
+				data = marshal.loads(zlib.decompress(self._map[start:end]))
+				for strKey in filter(lambda strKey: strKey in data, self._stringKeys):
+					data[strKey] = self._stringList[data[strKey]]
+				if data.get(DataSplitter.Locations) != None:
+					data[DataSplitter.Locations] = map(lambda idx: self._stringList[idx], data[DataSplitter.Locations])
+				if DataSplitter.CommonPrefix in data:
+					data[DataSplitter.FileList] = map(lambda x: '%s/%s' % (data[DataSplitter.CommonPrefix], x), data[DataSplitter.FileList])
+				return data
+
+		try:
+			return JobFileMapAdaptor_V3(path, self)
 		except:
 			raise ConfigError("No valid dataset splitting found in '%s'." % path)
 
 
 class DataSplitterIO:
-	def saveState(self, path, meta, source, sourceLen, message = 'Writing job mapping file', version = 2):
+	def saveState(self, path, meta, source, sourceLen, message = 'Writing job mapping file', version = 3):
 		if version == 1:
 			writer = DataSplitterIO_V1()
-		else:
+		elif version == 2:
 			writer = DataSplitterIO_V2()
+		else:
+			writer = DataSplitterIO_V3()
 		writer.saveState(path, meta, source, sourceLen, message)
 
-	def loadState(self, path):
+	# Chunked tar files (V1 / V2) keep up to <cacheSize> bytes of decoded chunks in memory
+	def loadState(self, path, cacheSize = 64 * 1024 * 1024, readAhead = 1):
+		try:
+			if open(path, 'rb').read(len(DataSplitterIO_V3.magic)) == DataSplitterIO_V3.magic:
+				return DataSplitterIO_V3().loadState(path)
+		except IOError:
+			raise ConfigError("No valid dataset splitting found in '%s'." % path)
 		try:
 			version = int(tarfile.open(path, 'r:').extractfile('Version').read())
 		except:
 			version = 1
 		if version == 1:
-			state = DataSplitterIO_V1().loadState(path)
+			state = DataSplitterIO_V1().loadState(path, cacheSize, readAhead)
 		else:
-			state = DataSplitterIO_V2().loadState(path)
+			state = DataSplitterIO_V2().loadState(path, cacheSize, readAhead)
 		return state
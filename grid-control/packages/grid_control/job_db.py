@@ -12,18 +12,26 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import sys, os, time, fnmatch, operator, utils
+import sys, os, time, fnmatch, operator, itertools, marshal, array, threading, utils
+from python_compat import set, sorted
 from abstract import LoadableObject
 from exceptions import ConfigError, RuntimeError, RethrowError
 from utils import QM
 
-class Job:
+try:	# multiprocessing >= Python 2.6
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
+
+class Job(object):
+	__slots__ = ('state', 'nextstate', 'attempt', 'history', 'wmsId', 'submitted', 'changed', 'dict')
 	states = ('INIT', 'SUBMITTED', 'DISABLED', 'READY', 'WAITING', 'QUEUED', 'ABORTED',
 		'RUNNING', 'CANCELLED', 'DONE', 'FAILED', 'SUCCESS')
 	_stateDict = {}
 	for idx, state in enumerate(states):
 		_stateDict[state] = idx
 		locals()[state] = idx
+	del idx, state
 	__internals = ('wmsId', 'status')
 
 
@@ -38,6 +46,14 @@ class Job:
 		self.dict = {}
 
 
+	def __getstate__(self):
+		return (self.state, self.nextstate, self.attempt, self.history, self.wmsId, self.submitted, self.changed, self.dict)
+
+
+	def __setstate__(self, state):
+		(self.state, self.nextstate, self.attempt, self.history, self.wmsId, self.submitted, self.changed, self.dict) = state
+
+
 	def loadData(cls, name, data):
 		try:
 			job = Job(cls._stateDict[data.get('status', 'FAILED')])
@@ -89,7 +105,7 @@ class Job:
 
 
 	def getAll(self):
-		data = self.dict
+		data = dict(self.dict)
 		data['status'] = self.states[self.state]
 		data['attempt'] = self.attempt
 		data['submitted'] = self.submitted
@@ -100,6 +116,7 @@ class Job:
 			data['id'] = self.wmsId
 			if self.dict.get('legacy', None): # Legacy support
 				data['id'] = self.dict.pop('legacy')
+				data.pop('legacy')
 		return data
 
 
@@ -124,6 +141,208 @@ class Job:
 		self.submitted = time.time()
 
 
+# Compact job storage for large tasks - the fixed job infos are stored in typed arrays indexed by the job number.
+# The remaining job infos are packed into tuples with interned strings and shared key tuples and are only
+# unpacked into dictionaries while a job is modified (until it is committed again)
+class JobStore(object):
+	_fixedKeys = ('status', 'attempt', 'submitted', 'changed')
+
+	def __init__(self):
+		(self._state, self._attempt) = (array.array('b'), array.array('i'))
+		(self._submitted, self._changed) = (array.array('d'), array.array('d'))
+		(self._wmsId, self._nextstate, self._history, self._extra) = ([], {}, {}, {})
+		(self._keyCache, self._unpacked, self._len) = ({}, {}, 0)
+
+
+	def __len__(self):
+		return self._len
+
+
+	def __contains__(self, jobNum):
+		return (0 <= jobNum < len(self._state)) and (self._state[jobNum] >= 0)
+
+
+	def keys(self):
+		return filter(lambda jobNum: self._state[jobNum] >= 0, range(len(self._state)))
+	__iter__ = lambda self: iter(self.keys())
+
+
+	def iteritems(self):
+		for jobNum in self.keys():
+			yield (jobNum, StoredJob(self, jobNum))
+	items = lambda self: list(self.iteritems())
+
+
+	def get(self, jobNum, default = None):
+		if jobNum in self:
+			return StoredJob(self, jobNum)
+		return default
+
+
+	def __getitem__(self, jobNum):
+		if jobNum not in self:
+			raise KeyError(jobNum)
+		return StoredJob(self, jobNum)
+
+
+	def __setitem__(self, jobNum, jobObj):
+		if isinstance(jobObj, StoredJob) and (jobObj._store is self) and (jobObj._jobNum == jobNum):
+			if jobNum in self._unpacked:
+				self._pack(jobNum, *self._unpacked[jobNum])
+			return
+		missing = jobNum + 1 - len(self._state)
+		if missing > 0:
+			self._state.extend([-1] * missing)
+			self._attempt.extend([0] * missing)
+			self._submitted.extend([0] * missing)
+			self._changed.extend([0] * missing)
+			self._wmsId.extend([None] * missing)
+		if self._state[jobNum] < 0:
+			self._len += 1
+		(self._state[jobNum], self._attempt[jobNum]) = (jobObj.state, jobObj.attempt)
+		(self._submitted[jobNum], self._changed[jobNum]) = (jobObj.submitted, jobObj.changed)
+		self._wmsId[jobNum] = jobObj.wmsId
+		StoredJob(self, jobNum).nextstate = jobObj.nextstate
+		# job infos which are available as job attributes are not stored twice
+		self._pack(jobNum, jobObj.history, utils.filterDict(jobObj.dict,
+			lambda key: (key not in self._fixedKeys) and not str(key).startswith('history_')))
+
+
+	def update(self, items):
+		if hasattr(items, 'iteritems'):
+			items = items.iteritems()
+		for (jobNum, jobObj) in items:
+			self[jobNum] = jobObj
+
+
+	def _pack(self, jobNum, history, data):
+		keys = tuple(map(internValue, data.keys()))
+		self._extra[jobNum] = (self._keyCache.setdefault(keys, keys), tuple(map(internValue, data.values())))
+		self._history[jobNum] = tuple(utils.flatten(map(lambda (k, v): (k, internValue(v)), history.items())))
+		self._unpacked.pop(jobNum, None)
+
+
+	# Returns the job infos without keeping them unpacked
+	def _peek(self, jobNum):
+		if jobNum in self._unpacked:
+			return self._unpacked[jobNum]
+		(keys, values) = self._extra.get(jobNum, ((), ()))
+		history = self._history.get(jobNum, ())
+		return (dict(zip(history[::2], history[1::2])), dict(zip(keys, values)))
+
+
+	def _unpack(self, jobNum):
+		if jobNum not in self._unpacked:
+			self._unpacked[jobNum] = self._peek(jobNum)
+		return self._unpacked[jobNum]
+
+
+	def _getValue(self, jobNum, key, default):
+		if jobNum in self._unpacked:
+			return self._unpacked[jobNum][1].get(key, default)
+		(keys, values) = self._extra.get(jobNum, ((), ()))
+		if key in keys:
+			return values[list(keys).index(key)]
+		return default
+
+
+def internValue(value):
+	if type(value) == str:
+		return intern(value)
+	return value
+
+
+# Copy of packed job infos - modifications are written through to the unpacked job infos
+class StoredJobInfos(dict):
+	def __init__(self, store, jobNum, idx):
+		dict.__init__(self, store._peek(jobNum)[idx])
+		(self._store, self._jobNum, self._idx) = (store, jobNum, idx)
+
+	def _writeThrough(name):
+		def modify(self, *args, **kwargs):
+			getattr(dict, name)(self, *args, **kwargs)
+			return getattr(self._store._unpack(self._jobNum)[self._idx], name)(*args, **kwargs)
+		return modify
+
+	(__setitem__, __delitem__) = (_writeThrough('__setitem__'), _writeThrough('__delitem__'))
+	(clear, pop, setdefault, update) = map(_writeThrough, ['clear', 'pop', 'setdefault', 'update'])
+	del _writeThrough
+
+	def popitem(self):
+		if not self:
+			raise KeyError('popitem(): dictionary is empty')
+		key = self.keys()[0]
+		return (key, self.pop(key))
+
+
+# Job object accessing the job infos inside a JobStore
+class StoredJob(Job):
+	__slots__ = ('_store', '_jobNum')
+
+	def __init__(self, store, jobNum):
+		(self._store, self._jobNum) = (store, jobNum)
+
+	def _arrayProperty(name):
+		def setValue(self, value):
+			getattr(self._store, name)[self._jobNum] = value
+		return property(lambda self: getattr(self._store, name)[self._jobNum], setValue)
+
+	state = _arrayProperty('_state')
+	attempt = _arrayProperty('_attempt')
+	submitted = _arrayProperty('_submitted')
+	changed = _arrayProperty('_changed')
+	wmsId = _arrayProperty('_wmsId')
+	del _arrayProperty
+
+	def _setNextState(self, value):
+		if value == None:
+			self._store._nextstate.pop(self._jobNum, None)
+		else:
+			self._store._nextstate[self._jobNum] = value
+	nextstate = property(lambda self: self._store._nextstate.get(self._jobNum), _setNextState)
+
+	# Reading history or dict of packed job infos returns a copy, which unpacks the
+	# job infos on modification - job infos stay unpacked until the job is committed
+	def _getInfos(self, idx):
+		if self._jobNum in self._store._unpacked:
+			return self._store._unpacked[self._jobNum][idx]
+		return StoredJobInfos(self._store, self._jobNum, idx)
+
+	def _setHistory(self, value):
+		self._store._pack(self._jobNum, value, self._store._peek(self._jobNum)[1])
+	history = property(lambda self: self._getInfos(0), _setHistory)
+
+	def _setDict(self, value):
+		self._store._pack(self._jobNum, self._store._peek(self._jobNum)[0], value)
+	dict = property(lambda self: self._getInfos(1), _setDict)
+
+	def set(self, key, value):
+		self._store._unpack(self._jobNum)
+		Job.set(self, key, value)
+
+	def get(self, key, default = None):
+		return self._store._getValue(self._jobNum, key, default)
+
+	def update(self, state):
+		self._store._unpack(self._jobNum)
+		Job.update(self, state)
+
+	def assignId(self, wmsId):
+		self._store._unpack(self._jobNum)
+		Job.assignId(self, wmsId)
+
+	def getAll(self):
+		unpacked = self._jobNum in self._store._unpacked
+		self._store._unpack(self._jobNum) # getAll can modify the legacy id entry
+		result = Job.getAll(self)
+		if not unpacked: # keep the job infos packed
+			self._store._pack(self._jobNum, *self._store._unpack(self._jobNum))
+		return result
+
+	def __reduce__(self): # unpickled as detached Job
+		return (Job, (), self.__getstate__())
+
+
 class JobClass:
 	mkJobClass = lambda *fList: (reduce(operator.add, map(lambda f: 1 << f, fList)), fList)
 	ATWMS = mkJobClass(Job.SUBMITTED, Job.WAITING, Job.READY, Job.QUEUED)
@@ -137,13 +356,55 @@ class JobClass:
 	PROCESSED = mkJobClass(Job.SUCCESS, Job.FAILED, Job.CANCELLED, Job.ABORTED)
 
 
+# Helper functions to read a chunk of the job database (executed in worker processes)
+def loadJobFiles((dbPath, jobFileList)):
+	return map(lambda (jobNum, jobFile): (jobNum, Job.load(os.path.join(dbPath, jobFile))), jobFileList)
+
+
 class JobDB(LoadableObject):
 	def __init__(self, config, jobLimit = -1, jobSelector = None):
 		self._dbPath = config.getWorkPath('jobs')
+		self._batchLocal = threading.local() # batches are tracked per thread (concurrent actions)
+		# Number of processes used to read the job database (0: number of cpus, 1: no worker processes)
+		self._loadProcesses = config.getInt('jobdb load processes', 0, onChange = None)
+		# Use compact job storage (reduces memory usage for very large tasks)
+		self._compactStore = config.getBool('jobdb compact', False, onChange = None)
+		(self._snapshotFile, self._snapshotLimit, self._snapshotExists) = (None, None, False)
 		self._jobMap = self.readJobs(jobLimit)
 		if jobLimit < 0 and len(self._jobMap) > 0:
 			jobLimit = max(self._jobMap) + 1
 		(self.jobLimit, self.alwaysSelector) = (jobLimit, jobSelector)
+		# State index of committed jobs - jobs without entry are in the INIT state
+		(self._stateMap, self._stateIndex) = ({}, {})
+		for (jobNum, state) in self._iterStates():
+			self._updateIndex(jobNum, state)
+
+
+	def _iterStates(self):
+		for (jobNum, jobObj) in self._jobMap.iteritems():
+			yield (jobNum, jobObj.state)
+
+
+	def _updateIndex(self, jobNum, state):
+		oldState = self._stateMap.get(jobNum)
+		if oldState == state:
+			return
+		if oldState != None:
+			self._stateIndex[oldState].discard(jobNum)
+		self._stateMap[jobNum] = state
+		self._stateIndex.setdefault(state, set()).add(jobNum)
+
+
+	# Get sorted list of jobs in the given states (according to the state index)
+	def _getJobsByState(self, states):
+		result = set()
+		for state in states:
+			result.update(self._stateIndex.get(state, []))
+		if Job.INIT in states:
+			result.update(set(xrange(self.jobLimit)).difference(self._stateMap))
+		if result and (max(result) >= self.jobLimit):
+			return sorted(filter(lambda jobNum: jobNum < self.jobLimit, result))
+		return sorted(result)
 
 
 	def readJobs(self, jobLimit):
@@ -154,24 +415,95 @@ class JobDB(LoadableObject):
 			raise RethrowError("Problem creating work directory '%s'" % self._dbPath)
 
 		candidates = fnmatch.filter(os.listdir(self._dbPath), 'job_*.txt')
-		(jobMap, log, maxJobs) = ({}, None, len(candidates))
-		for idx, jobFile in enumerate(candidates):
-			if (jobLimit >= 0) and (len(jobMap) >= jobLimit):
-				utils.eprint('Stopped reading job infos! The number of job infos in the work directory (%d) ' % len(jobMap), newline = False)
+		jobMap = self._readSnapshot(self._dbPath + '.snapshot', jobLimit)
+		if jobMap != None:
+			return jobMap
+		jobFileList = []
+		for jobFile in candidates:
+			if (jobLimit >= 0) and (len(jobFileList) >= jobLimit):
+				utils.eprint('Stopped reading job infos! The number of job infos in the work directory (%d) ' % len(jobFileList), newline = False)
 				utils.eprint('is larger than the maximum number of jobs (%d)' % jobLimit)
 				break
 			try: # 2xsplit is faster than regex
-				jobNum = int(jobFile.split(".")[0].split("_")[1])
+				jobFileList.append((int(jobFile.split(".")[0].split("_")[1]), jobFile))
 			except:
 				continue
-			jobObj = Job.load(os.path.join(self._dbPath, jobFile))
-			jobMap[jobNum] = jobObj
-			if idx % 100 == 0:
+		return self._loadChunks(loadJobFiles, self._dbPath, jobFileList, 'Reading job infos')
+
+
+	def _newJobMap(self):
+		if self._compactStore:
+			return JobStore()
+		return {}
+
+
+	def _getLoadProcesses(self):
+		if not multiprocessing:
+			return 1
+		return QM(self._loadProcesses > 0, self._loadProcesses, multiprocessing.cpu_count())
+
+
+	# Read the job objects in chunks - using a pool of worker processes if available
+	def _loadChunks(self, loadFun, dbPath, itemList, message, chunkSize = 1000):
+		chunkList = map(lambda idx: (dbPath, itemList[idx:idx + chunkSize]), range(0, len(itemList), chunkSize))
+		(jobMap, log, pool) = (self._newJobMap(), None, None)
+		if (self._getLoadProcesses() > 1) and (len(chunkList) > 1):
+			pool = multiprocessing.Pool(self._getLoadProcesses())
+			resultIter = pool.imap_unordered(loadFun, chunkList)
+		else:
+			resultIter = itertools.imap(loadFun, chunkList)
+		try:
+			for result in resultIter:
+				jobMap.update(result)
 				del log
-				log = utils.ActivityLog('Reading job infos ... %d [%d%%]' % (idx, (100.0 * idx) / maxJobs))
+				log = utils.ActivityLog('%s ... %d [%d%%]' % (message, len(jobMap), (100.0 * len(jobMap)) / len(itemList)))
+		finally:
+			if pool:
+				pool.terminate()
+		del log
 		return jobMap
 
 
+	# The snapshot contains the job infos of the last clean shutdown - it is removed by the first commit
+	def _getSnapshotKey(self):
+		return (os.path.getmtime(self._dbPath), len(fnmatch.filter(os.listdir(self._dbPath), 'job_*.txt')))
+
+
+	# Snapshots are only valid for the job limit used while reading the job infos
+	def _readSnapshot(self, fn, jobLimit):
+		(self._snapshotFile, self._snapshotLimit) = (fn, jobLimit)
+		try:
+			(version, key, jobData) = marshal.load(open(fn, 'rb'))
+			if (version == 2) and (key == (jobLimit, self._getSnapshotKey())):
+				self._snapshotExists = True
+				jobMap = self._newJobMap()
+				jobMap.update(map(lambda (jobNum, data): (jobNum, Job.loadData('%s:%d' % (fn, jobNum), data)), jobData.items()))
+				return jobMap
+		except:
+			pass
+		utils.removeFiles([fn])
+
+
+	def _removeSnapshot(self):
+		if self._snapshotExists:
+			utils.removeFiles([self._snapshotFile])
+			self._snapshotExists = False
+
+
+	# Called on a clean shutdown
+	def close(self):
+		if self._snapshotFile and not self._snapshotExists:
+			jobData = dict(map(lambda jobNum: (jobNum, self._jobMap[jobNum].getAll()), self._stateMap))
+			try:
+				fp = open(self._snapshotFile + '.tmp', 'wb')
+				marshal.dump((2, (self._snapshotLimit, self._getSnapshotKey()), jobData), fp)
+				fp.close()
+				os.rename(self._snapshotFile + '.tmp', self._snapshotFile)
+				self._snapshotExists = True
+			except:
+				utils.removeFiles([self._snapshotFile + '.tmp'])
+
+
 	def get(self, jobNum, default = None, create = False):
 		if create:
 			self._jobMap[jobNum] = self._jobMap.get(jobNum, Job())
@@ -179,18 +511,29 @@ class JobDB(LoadableObject):
 
 
 	def getJobsIter(self, jobSelector = None, subset = None):
+		selectorList = []
+		for selector in filter(lambda selector: selector != None, [jobSelector, self.alwaysSelector]):
+			states = getattr(selector, 'getStates', lambda: None)()
+			if states == None:
+				selectorList.append(selector)
+			elif subset == None: # Selection only depends on the job state - use state index
+				subset = self._getJobsByState(states)
+			else:
+				selected = set(self._getJobsByState(states))
+				subset = filter(lambda jobNum: jobNum in selected, subset)
 		if subset == None:
 			subset = xrange(self.jobLimit)
-		if jobSelector and self.alwaysSelector:
-			select = lambda *args: jobSelector(*args) and self.alwaysSelector(*args)
-		elif jobSelector or self.alwaysSelector:
-			select = QM(jobSelector, jobSelector, self.alwaysSelector)
-		else:
+		if not selectorList:
 			for jobNum in subset:
 				yield jobNum
 			raise StopIteration
+		defaultJob = Job()
 		for jobNum in subset:
-			if select(jobNum, self.get(jobNum, Job())):
+			jobObj = self.get(jobNum, defaultJob)
+			for selector in selectorList:
+				if not selector(jobNum, jobObj):
+					break
+			else:
 				yield jobNum
 
 
@@ -199,13 +542,35 @@ class JobDB(LoadableObject):
 
 
 	def getJobsN(self, jobSelector = None, subset = None):
-		counter = 0
-		for jobNum in self.getJobsIter(jobSelector, subset):
-			counter += 1
-		return counter
+		return len(self.getJobs(jobSelector, subset))
+
+
+	# Group commits - commits between startBatch and the matching finishBatch call can be
+	# buffered by the job database and are written together at the end of the outermost batch
+	# Commits of a thread outside of a batch are written immediately - even if other threads run a batch
+	def _setBatchDepth(self, value):
+		self._batchLocal.depth = value
+	_batchDepth = property(lambda self: getattr(self._batchLocal, 'depth', 0), _setBatchDepth)
+
+
+	def startBatch(self):
+		self._batchDepth += 1
+
+
+	def finishBatch(self):
+		self._batchDepth -= 1
+		if self._batchDepth == 0:
+			self._flushBatch()
+
+
+	def _flushBatch(self):
+		pass
 
 
 	def commit(self, jobNum, jobObj):
+		self._removeSnapshot()
+		self._updateIndex(jobNum, jobObj.state)
+		self._jobMap[jobNum] = jobObj
 		fp = open(os.path.join(self._dbPath, 'job_%d.txt' % jobNum), 'w')
 		utils.safeWrite(fp, utils.DictFormat(escapeString = True).format(jobObj.getAll()))
 #		if jobObj.state == Job.DISABLED:
@@ -0,0 +1,257 @@
+#-#  Copyright 2014 Karlsruhe Institute of Technology
+#-#
+#-#  Licensed under the Apache License, Version 2.0 (the "License");
+#-#  you may not use this file except in compliance with the License.
+#-#  You may obtain a copy of the License at
+#-#
+#-#      http://www.apache.org/licenses/LICENSE-2.0
+#-#
+#-#  Unless required by applicable law or agreed to in writing, software
+#-#  distributed under the License is distributed on an "AS IS" BASIS,
+#-#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#-#  See the License for the specific language governing permissions and
+#-#  limitations under the License.
+
+import os, time, struct, marshal, zlib, threading, utils
+from python_compat import sorted
+from job_db import Job, JobDB
+from job_db_zip import ZippedJobDB
+from exceptions import RuntimeError, RethrowError
+
+crc32 = lambda data: zlib.crc32(data) & 0xffffffff
+
+# Job database stored as append-only log of binary job records (header: job number, size, crc32, state)
+# The offset index (jobs.idx) is written at checkpoints - only records after it are replayed
+class LogJobDB(JobDB):
+	(logMagic, logHeader, recHeader) = ('GCJL', '>4sd', '>IIIB')
+	(logHeaderSize, recHeaderSize) = (struct.calcsize(logHeader), struct.calcsize(recHeader))
+
+	def __init__(self, config, jobLimit = -1, jobSelector = None):
+		self._dbFile = config.getWorkPath('jobs.log')
+		self._idxFile = config.getWorkPath('jobs.idx')
+		# Write offset index every <n> commits
+		self._checkpoint = config.getInt('jobdb checkpoint', 1000, onChange = None)
+		# Compact log in the background when it contains more than <n> records per job
+		self._compactRatio = config.getInt('jobdb compact ratio', 4, onChange = None)
+		(self._lock, self._compactThread, self._offsetMap) = (threading.Lock(), None, {})
+		JobDB.__init__(self, config, jobLimit, jobSelector)
+		if self.jobLimit < 0 and len(self._offsetMap) > 0:
+			self.jobLimit = max(self._offsetMap) + 1
+		self._logStates = None
+		if (self._checkpoint > 0) and (self._nReplay > self._checkpoint):
+			self._writeIndex()
+
+
+	def readJobs(self, jobLimit):
+		utils.removeFiles([self._dbFile + '.tmp'])
+		if not os.path.exists(self._dbFile):
+			self._createLog(self._dbFile, time.time()).close()
+		self._fp = open(self._dbFile, 'r+b')
+		(magic, self._generation) = struct.unpack(self.logHeader, self._fp.read(self.logHeaderSize))
+		if magic != self.logMagic:
+			raise RuntimeError('Invalid job database log %s' % self._dbFile)
+		(self._offsetMap, self._logStates, self._logSize, self._logRecords) = ({}, {}, self.logHeaderSize, 0)
+		try:
+			(version, generation, logSize, logRecords, offsetMap, stateMap) = marshal.loads(open(self._idxFile, 'rb').read())
+			if (version == 1) and (generation == self._generation) and (logSize <= os.path.getsize(self._dbFile)):
+				(self._offsetMap, self._logStates, self._logSize, self._logRecords) = (offsetMap, stateMap, logSize, logRecords)
+		except:
+			pass # Missing or outdated index - replay whole log
+
+		log = utils.ActivityLog('Replaying job database log')
+		self._nReplay = 0
+		for (jobNum, state, offset, end) in self._iterRecords(self._fp, self._logSize):
+			(self._offsetMap[jobNum], self._logStates[jobNum], self._logSize) = (offset, state, end)
+			self._nReplay += 1
+		self._logRecords += self._nReplay
+		self._fp.seek(0, 2)
+		if self._fp.tell() != self._logSize:
+			utils.eprint('Discarding broken transaction at the end of job database log %s' % self._dbFile)
+			self._fp.truncate(self._logSize)
+		del log
+		# Jobs beyond the job limit are hidden - their records are kept in the log and index
+		self._hiddenStates = {}
+		if (jobLimit >= 0) and (len(self._logStates) > jobLimit):
+			utils.eprint('Stopped reading job infos! The number of job infos in the work directory (%d) ' % len(self._logStates), newline = False)
+			utils.eprint('is larger than the maximum number of jobs (%d)' % jobLimit)
+			for jobNum in sorted(self._logStates)[jobLimit:]:
+				self._hiddenStates[jobNum] = self._logStates.pop(jobNum)
+		return self._newJobMap() # Job objects are decoded on first access
+
+
+	def _iterStates(self):
+		return self._logStates.iteritems()
+
+
+	def _createLog(self, fn, generation):
+		fp = open(fn, 'wb')
+		fp.write(struct.pack(self.logHeader, self.logMagic, generation))
+		return fp
+
+
+	# Yields (jobNum, state, record offset, record end) for all intact records after the given offset
+	def _iterRecords(self, fp, offset):
+		fp.seek(offset)
+		while True:
+			header = fp.read(self.recHeaderSize)
+			if len(header) != self.recHeaderSize:
+				break
+			(jobNum, size, crc, state) = struct.unpack(self.recHeader, header)
+			data = fp.read(size)
+			if (len(data) != size) or (crc32(data) != crc):
+				break
+			yield (jobNum, state, offset, offset + self.recHeaderSize + size)
+			offset += self.recHeaderSize + size
+
+
+	def _readRecord(self, jobNum):
+		self._lock.acquire()
+		try:
+			self._fp.seek(self._offsetMap[jobNum])
+			(jobNumRec, size, crc, state) = struct.unpack(self.recHeader, self._fp.read(self.recHeaderSize))
+			data = self._fp.read(size)
+		finally:
+			self._lock.release()
+		try:
+			return Job.loadData('%s:%d' % (self._dbFile, jobNum), marshal.loads(data))
+		except:
+			raise RethrowError('Unable to read job %d from job database log %s' % (jobNum, self._dbFile), RuntimeError)
+
+
+	def _writeIndex(self):
+		self._lock.acquire()
+		try:
+			stateMap = self._stateMap
+			if self._hiddenStates:
+				stateMap = dict(self._hiddenStates)
+				stateMap.update(self._stateMap)
+			data = (1, self._generation, self._logSize, self._logRecords, self._offsetMap, stateMap)
+			fp = open(self._idxFile + '.tmp', 'wb')
+			marshal.dump(data, fp)
+			fp.close()
+			os.rename(self._idxFile + '.tmp', self._idxFile)
+		finally:
+			self._lock.release()
+
+
+	def get(self, jobNum, default = None, create = False):
+		if jobNum not in self._jobMap:
+			if (jobNum in self._offsetMap) and (jobNum not in self._hiddenStates):
+				self._jobMap[jobNum] = self._readRecord(jobNum)
+			elif create:
+				self._jobMap[jobNum] = Job()
+		return self._jobMap.get(jobNum, default)
+
+
+	def commit(self, jobNum, jobObj):
+		data = marshal.dumps(jobObj.getAll())
+		self._lock.acquire()
+		try:
+			self._updateIndex(jobNum, jobObj.state)
+			self._hiddenStates.pop(jobNum, None)
+			self._fp.seek(self._logSize)
+			self._fp.write(struct.pack(self.recHeader, jobNum, len(data), crc32(data), jobObj.state) + data)
+			if (self._batchDepth == 0) or (jobObj.state == Job.SUBMITTED): # keep new WMS ids on disk
+				self._fp.flush()
+			(self._offsetMap[jobNum], self._jobMap[jobNum]) = (self._logSize, jobObj)
+			self._logSize += self.recHeaderSize + len(data)
+			self._logRecords += 1
+		finally:
+			self._lock.release()
+		if (self._checkpoint > 0) and (self._logRecords % self._checkpoint == 0):
+			self._writeIndex()
+		if (self._compactRatio > 0) and (self._logRecords > self._compactRatio * max(self._checkpoint, len(self._offsetMap))):
+			self._startCompact()
+
+
+	def _startCompact(self): # Only one compaction thread is running at a time
+		self._lock.acquire()
+		try:
+			if not (self._compactThread and self._compactThread.isAlive()):
+				self._compactThread = utils.gcStartThread('Compacting job database', self._compact)
+		finally:
+			self._lock.release()
+
+
+	def _flushBatch(self):
+		self._lock.acquire()
+		try:
+			self._fp.flush()
+		finally:
+			self._lock.release()
+
+
+	def close(self):
+		if self._compactThread:
+			self._compactThread.join()
+		self._flushBatch()
+		self._writeIndex()
+		self._fp.close()
+
+
+	# Copy the latest record of each job into a new log and swap it in
+	# Only the final swap (including records committed in the meantime) is done while holding the lock
+	def _compact(self):
+		try:
+			self._lock.acquire()
+			try:
+				self._fp.flush() # records of the current batch could still be buffered
+				(offsetMap, logSize) = (dict(self._offsetMap), self._logSize)
+			finally:
+				self._lock.release()
+			generation = time.time()
+			fpOld = open(self._dbFile, 'rb')
+			fpNew = self._createLog(self._dbFile + '.tmp', generation)
+			newOffsetMap = {}
+			for jobNum in sorted(offsetMap):
+				fpOld.seek(offsetMap[jobNum])
+				header = fpOld.read(self.recHeaderSize)
+				newOffsetMap[jobNum] = fpNew.tell()
+				fpNew.write(header + fpOld.read(struct.unpack(self.recHeader, header)[1]))
+			fpOld.close()
+
+			self._lock.acquire()
+			try:
+				self._fp.flush()
+				for (jobNum, state, offset, end) in list(self._iterRecords(self._fp, logSize)):
+					self._fp.seek(offset)
+					newOffsetMap[jobNum] = fpNew.tell()
+					fpNew.write(self._fp.read(end - offset))
+				newSize = fpNew.tell()
+				fpNew.close()
+				os.rename(self._dbFile + '.tmp', self._dbFile)
+				self._fp.close()
+				self._fp = open(self._dbFile, 'r+b')
+				(self._generation, self._offsetMap) = (generation, newOffsetMap)
+				(self._logSize, self._logRecords) = (newSize, len(newOffsetMap))
+			finally:
+				self._lock.release()
+			self._writeIndex()
+		finally:
+			utils.removeFiles([self._dbFile + '.tmp'])
+
+
+class Migrate2LogJobDB(LogJobDB):
+	def __init__(self, config, jobLimit = -1, jobSelector = None):
+		dbFile = config.getWorkPath('jobs.log')
+		dbPath = config.getWorkPath('jobs')
+		if not os.path.exists(dbFile):
+			oldDB = None
+			if os.path.exists(config.getWorkPath('jobs.zip')):
+				oldDB = ZippedJobDB(config)
+			elif os.path.exists(dbPath) and os.path.isdir(dbPath):
+				oldDB = JobDB(config)
+			if oldDB:
+				log = utils.ActivityLog('Converting job database...')
+				try:
+					newDB = LogJobDB(config)
+					for jobNum in oldDB.getJobs():
+						jobObj = oldDB.get(jobNum)
+						if jobObj:
+							newDB.commit(jobNum, jobObj)
+					newDB._writeIndex()
+				except:
+					utils.removeFiles([dbFile, config.getWorkPath('jobs.idx')])
+					raise
+				del log
+		LogJobDB.__init__(self, config, jobLimit, jobSelector)
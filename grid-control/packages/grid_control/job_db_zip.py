@@ -13,16 +13,35 @@
 #-#  limitations under the License.
 
 import os, utils, zipfile
+from python_compat import sorted
 from job_db import Job, JobDB
 
+def loadJobTransactions((dbFile, memberList)):
+	tar = zipfile.ZipFile(dbFile, 'r', zipfile.ZIP_DEFLATED)
+	try:
+		parseData = lambda fnTarInfo: utils.DictFormat(escapeString = True).parse(tar.open(fnTarInfo).read())
+		return map(lambda (jobNum, fnTarInfo): (jobNum, Job.loadData(fnTarInfo, parseData(fnTarInfo))), memberList)
+	finally:
+		tar.close()
+
+
 class ZippedJobDB(JobDB):
 	def __init__(self, config, jobLimit = -1, jobSelector = None):
 		self._dbFile = config.getWorkPath('jobs.zip')
+		self._initTransactions(config)
 		JobDB.__init__(self, config, jobLimit, jobSelector)
 
+
+	def _initTransactions(self, config):
+		(self._serial, self._nMembers, self._memberMap, self._pending) = (0, 0, {}, {})
+		# Maximum number of buffered job updates during a batch of commits
+		self._batchSize = config.getInt('jobdb batch size', 1000, onChange = None)
+		# Compact archive when it contains more than <n> transactions per job
+		self._compactRatio = config.getInt('jobdb compact ratio', 4, onChange = None)
+
+
 	def readJobs(self, jobLimit):
-		jobMap = {}
-		maxJobs = 0
+		(jobMap, self._snapshotFile) = (self._newJobMap(), self._dbFile + '.snapshot')
 		if os.path.exists(self._dbFile):
 			try:
 				tar = zipfile.ZipFile(self._dbFile, 'r', zipfile.ZIP_DEFLATED)
@@ -44,32 +63,80 @@ class ZippedJobDB(JobDB):
 				for broken in brokenList:
 					os.system('zip %s -d %s' % (self._dbFile, broken))
 				utils.eprint('Recover completed!')
-			log = None
-			maxJobs = len(tar.namelist())
-			tMap = {}
-			for idx, fnTarInfo in enumerate(tar.namelist()):
+			# Only the latest transaction of each job is parsed
+			(self._memberMap, tidMap) = ({}, {})
+			for fnTarInfo in tar.namelist():
 				(jobNum, tid) = tuple(map(lambda s: int(s[1:]), fnTarInfo.split('_', 1)))
-				if tid < tMap.get(jobNum, 0):
-					continue
-				data = utils.DictFormat(escapeString = True).parse(tar.open(fnTarInfo).read())
-				jobMap[jobNum] = Job.loadData(fnTarInfo, data)
-				tMap[jobNum] = tid
-				if idx % 100 == 0:
-					del log
-					log = utils.ActivityLog('Reading job transactions ... %d [%d%%]' % (idx, (100.0 * idx) / maxJobs))
-
-		self._serial = maxJobs
+				if tid >= tidMap.get(jobNum, -1):
+					(self._memberMap[jobNum], tidMap[jobNum]) = (fnTarInfo, tid)
+				self._serial = max(self._serial, tid + 1)
+				self._nMembers += 1
+			tar.close()
+			jobMap = self._readSnapshot(self._snapshotFile, jobLimit)
+			if jobMap == None:
+				# Each chunk has to open the archive again - so only use a few chunks per process
+				chunkSize = max(1000, len(self._memberMap) / (4 * self._getLoadProcesses()) + 1)
+				jobMap = self._loadChunks(loadJobTransactions, self._dbFile,
+					sorted(self._memberMap.items()), 'Reading job transactions', chunkSize)
+			self._compactCheck()
 		return jobMap
 
 
+	def _getSnapshotKey(self):
+		return (self._serial, os.path.getsize(self._dbFile))
+
+
 	def commit(self, jobNum, jobObj):
-		jobData = str.join('', utils.DictFormat(escapeString = True).format(jobObj.getAll()))
+		self._removeSnapshot()
+		self._updateIndex(jobNum, jobObj.state)
+		self._jobMap[jobNum] = jobObj
+		self._pending[jobNum] = str.join('', utils.DictFormat(escapeString = True).format(jobObj.getAll()))
+		# New WMS ids are written immediately - otherwise a crash would lose track of submitted jobs
+		if (self._batchDepth == 0) or (jobObj.state == Job.SUBMITTED) or (len(self._pending) >= self._batchSize):
+			self._flushBatch()
+
+
+	def _flushBatch(self):
+		if self._pending:
+			self._writeTransactions(self._pending.items())
+			self._pending = {}
+			self._compactCheck()
+
+
+	# Write all given (jobNum, jobData) entries while opening the archive only once
+	def _writeTransactions(self, jobDataList):
+		tar = zipfile.ZipFile(self._dbFile, 'a', zipfile.ZIP_DEFLATED)
 		try:
-			tar = zipfile.ZipFile(self._dbFile, 'a', zipfile.ZIP_DEFLATED)
-			tar.writestr('J%06d_T%06d' % (jobNum, self._serial), jobData)
+			for (jobNum, jobData) in sorted(jobDataList):
+				self._memberMap[jobNum] = 'J%06d_T%06d' % (jobNum, self._serial)
+				tar.writestr(self._memberMap[jobNum], jobData)
+				self._serial += 1
+				self._nMembers += 1
 		finally:
 			tar.close()
-		self._serial += 1
+
+
+	def _compactCheck(self):
+		if (self._compactRatio > 0) and (self._nMembers > self._compactRatio * max(100, len(self._memberMap))):
+			self._compact()
+
+
+	# Rewrite the archive without superseded transactions
+	def _compact(self):
+		log = utils.ActivityLog('Compacting job database')
+		try:
+			tarOld = zipfile.ZipFile(self._dbFile, 'r', zipfile.ZIP_DEFLATED)
+			tarNew = zipfile.ZipFile(self._dbFile + '.tmp', 'w', zipfile.ZIP_DEFLATED)
+			for fnTarInfo in sorted(self._memberMap.values()):
+				tarNew.writestr(fnTarInfo, tarOld.read(fnTarInfo))
+			tarNew.close()
+			tarOld.close()
+			os.rename(self._dbFile + '.tmp', self._dbFile)
+			self._nMembers = len(self._memberMap)
+			self._removeSnapshot() # snapshot key changed - a new snapshot is written on close
+		finally:
+			utils.removeFiles([self._dbFile + '.tmp'])
+		del log
 
 
 class Migrate2ZippedJobDB(ZippedJobDB):
@@ -78,14 +145,18 @@ class Migrate2ZippedJobDB(ZippedJobDB):
 		self._dbFile = config.getWorkPath('jobs.zip')
 		if os.path.exists(dbPath) and os.path.isdir(dbPath) and not os.path.exists(self._dbFile):
 			log = utils.ActivityLog('Converting job database...')
-			self._serial = 0
+			self._initTransactions(config)
 			try:
 				oldDB = JobDB(config)
-				oldDB.readJobs(-1)
+				fmt = utils.DictFormat(escapeString = True)
+				jobDataList = []
 				for jobNum in oldDB.getJobs():
-					self.commit(jobNum, oldDB.get(jobNum))
+					jobObj = oldDB.get(jobNum)
+					if jobObj:
+						jobDataList.append((jobNum, str.join('', fmt.format(jobObj.getAll()))))
+				self._writeTransactions(jobDataList)
 			except:
-				utils.removeFiles([dbFile])
+				utils.removeFiles([self._dbFile])
 				raise
 			del log
 
@@ -12,7 +12,7 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import sys, os, re, fnmatch, random, math, time, operator
+import sys, os, re, fnmatch, random, math, time, operator, threading
 import bisect
 from grid_control import QM, ConfigError, RuntimeError, RethrowError, Job, JobClass, JobDB, Report, utils, NamedObject
 from job_selector import JobSelector, ClassSelector, AndJobSelector
@@ -37,6 +37,16 @@ class JobManager(NamedObject):
 		self.maxRetry = config.getInt('max retry', -1, onChange = None)
 		self.continuous = config.getBool('continuous', False, onChange = None)
 		self._reportClass = config.getClass('abort report', 'LocationReport', cls = Report, onChange = None)
+		# Locks for job states and task module access - check, retrieve and submit can run in parallel
+		(self._lock, self._taskLock) = (threading.RLock(), threading.RLock())
+
+
+	def _locked(self, fun, *args):
+		self._lock.acquire()
+		try:
+			return fun(*args)
+		finally:
+			self._lock.release()
 
 
 	def getMaxJobs(self, task):
@@ -147,19 +157,27 @@ class JobManager(NamedObject):
 
 
 	def submit(self, wms, maxsample = 100):
-		jobList = self.getSubmissionJobs(maxsample)
+		self._taskLock.acquire()
+		try:
+			return self._submit(wms, maxsample)
+		finally:
+			self._taskLock.release()
+
+
+	def _submit(self, wms, maxsample):
+		jobList = self._locked(self.getSubmissionJobs, maxsample)
 		if len(jobList) == 0:
 			return False
 
 		submitted = []
-		for jobNum, wmsId, data in wms.submitJobs(jobList, self._task):
+		def processSubmission(jobNum, wmsId, data):
 			submitted.append(jobNum)
 			jobObj = self.jobDB.get(jobNum, create = True)
 
 			if wmsId == None:
 				# Could not register at WMS
 				self._update(jobObj, jobNum, Job.FAILED)
-				continue
+				return
 
 			jobObj.assignId(wmsId)
 			for key, value in data.iteritems():
@@ -167,8 +185,17 @@ class JobManager(NamedObject):
 
 			self._update(jobObj, jobNum, Job.SUBMITTED)
 			self._eventhandler.onJobSubmit(wms, jobObj, jobNum)
-			if utils.abort():
-				return False
+
+		self._locked(self.jobDB.startBatch)
+		try:
+			# After an abort the WMS stops to start new submissions - but the results of submissions
+			# which are already running have to be recorded, so the generator is consumed until its end
+			for jobNum, wmsId, data in wms.submitJobs(jobList, self._task):
+				self._locked(processSubmission, jobNum, wmsId, data)
+		finally:
+			self._locked(self.jobDB.finishBatch)
+		if utils.abort():
+			return False
 		return len(submitted) != 0
 
 
@@ -178,49 +205,68 @@ class JobManager(NamedObject):
 
 	def checkJobList(self, wms, jobList):
 		(change, timeoutList, reported) = (False, [], [])
-		for jobNum, wmsId, state, info in wms.checkJobs(self.wmsArgs(jobList)):
+		def processStatus(jobNum, wmsId, state, info):
 			if jobNum in self.offender:
 				self.offender.pop(jobNum)
 			reported.append(jobNum)
 			jobObj = self.jobDB.get(jobNum)
 			if state != jobObj.state:
-				change = True
 				for key, value in info.items():
 					jobObj.set(key, value)
 				self._update(jobObj, jobNum, state)
 				self._eventhandler.onJobUpdate(wms, jobObj, jobNum, info)
+				return True
 			else:
 				# If a job stays too long in an inital state, cancel it
 				if jobObj.state in (Job.SUBMITTED, Job.WAITING, Job.READY, Job.QUEUED):
 					if self.timeout > 0 and time.time() - jobObj.submitted > self.timeout:
 						timeoutList.append(jobNum)
+			return False
+
+		for jobNum, wmsId, state, info in wms.checkJobs(self._locked(self.wmsArgs, jobList)):
+			if self._locked(processStatus, jobNum, wmsId, state, info):
+				change = True
 			if utils.abort():
 				return (None, timeoutList, reported)
 		return (change, timeoutList, reported)
 
 
 	def check(self, wms, maxsample = 100):
-		jobList = self.sample(self.jobDB.getJobs(ClassSelector(JobClass.PROCESSING)), QM(self.continuous, maxsample, -1))
+		jobList = self._locked(lambda: self.sample(self.jobDB.getJobs(ClassSelector(JobClass.PROCESSING)),
+			QM(self.continuous, maxsample, -1)))
 
-		# Check jobs in the joblist and return changes, timeouts and successfully reported jobs
-		(change, timeoutList, reported) = self.checkJobList(wms, jobList)
-		if change == None: # neither True or False => abort
-			return False
+		self._locked(self.jobDB.startBatch)
+		try:
+			# Check jobs in the joblist and return changes, timeouts and successfully reported jobs
+			(change, timeoutList, reported) = self.checkJobList(wms, jobList)
+			if change == None: # neither True or False => abort
+				return False
 
-		# Cancel jobs which took too long
-		if len(timeoutList):
-			change = True
-			print '\nTimeout for the following jobs:'
-			self.cancel(wms, timeoutList)
+			# Cancel jobs which took too long
+			if len(timeoutList):
+				change = True
+				print '\nTimeout for the following jobs:'
+				self._locked(self.cancel, wms, timeoutList)
 
-		# Process task interventions
-		self.processIntervention(wms, self._task.getIntervention())
+			# Process task interventions
+			self._taskLock.acquire()
+			try:
+				self._locked(self.processIntervention, wms, self._task.getIntervention())
+			finally:
+				self._taskLock.release()
+		finally:
+			self._locked(self.jobDB.finishBatch)
 
 		# Quit when all jobs are finished
-		if self.jobDB.getJobsN(ClassSelector(JobClass.ENDSTATE)) == len(self.jobDB):
-			self.logDisabled()
+		if self._locked(lambda: self.jobDB.getJobsN(ClassSelector(JobClass.ENDSTATE)) == len(self.jobDB)):
+			self._locked(self.logDisabled)
 			self._eventhandler.onTaskFinish(len(self.jobDB))
-			if self._task.canFinish():
+			self._taskLock.acquire()
+			try:
+				canFinish = self._task.canFinish()
+			finally:
+				self._taskLock.release()
+			if canFinish:
 				utils.vprint('Task successfully completed. Quitting grid-control!', -1, True)
 				utils.abort(True)
 
@@ -229,12 +275,13 @@ class JobManager(NamedObject):
 
 	def retrieve(self, wms, maxsample = 100):
 		change = False
-		jobList = self.sample(self.jobDB.getJobs(ClassSelector(JobClass.DONE)), QM(self.continuous, maxsample, -1))
+		jobList = self._locked(lambda: self.sample(self.jobDB.getJobs(ClassSelector(JobClass.DONE)),
+			QM(self.continuous, maxsample, -1)))
 
-		for jobNum, retCode, data in wms.retrieveJobs(self.wmsArgs(jobList)):
+		def processOutput(jobNum, retCode, data):
 			jobObj = self.jobDB.get(jobNum)
-			if jobObj == None:
-				continue
+			if (jobObj == None) or (jobObj.state != Job.DONE): # job could have been reset in the meantime
+				return False
 
 			if retCode == 0:
 				state = Job.SUCCESS
@@ -243,16 +290,23 @@ class JobManager(NamedObject):
 			else:
 				state = Job.FAILED
 
-			if state != jobObj.state:
-				change = True
-				jobObj.set('retcode', retCode)
-				jobObj.set('runtime', data.get('TIME', -1))
-				self._update(jobObj, jobNum, state)
-				self._eventhandler.onJobOutput(wms, jobObj, jobNum, retCode)
-
-			if utils.abort():
-				return False
+			jobObj.set('retcode', retCode)
+			jobObj.set('runtime', data.get('TIME', -1))
+			self._update(jobObj, jobNum, state)
+			self._eventhandler.onJobOutput(wms, jobObj, jobNum, retCode)
+			return True
 
+		self._locked(self.jobDB.startBatch)
+		try:
+			# Retrieved outputs have to be recorded - so the generator is consumed until its end after an abort
+			for jobNum, retCode, data in wms.retrieveJobs(self._locked(self.wmsArgs, jobList)):
+				if self._locked(processOutput, jobNum, retCode, data):
+					change = True
+		finally:
+			self._locked(self.jobDB.finishBatch)
+
+		if utils.abort():
+			return False
 		return change
 
 
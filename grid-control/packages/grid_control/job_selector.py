@@ -24,6 +24,10 @@ class JobSelector(LoadableObject):
 
 	def __call__(self, jobNum, jobObj):
 		raise AbstractError
+
+	# Returns the job states if the selection only depends on the job state (allows the use of the state index)
+	def getStates(self):
+		return None
 JobSelector.registerObject()
 JobSelector.moduleMap.update({'id': 'IDSelector', 'state': 'StateSelector', 'site': 'SiteSelector',
 	'queue': 'QueueSelector', 'var': 'VarSelector', 'nick': 'NickSelector', 'stuck': 'StuckSelector',
@@ -37,6 +41,12 @@ class AndJobSelector(JobSelector): # Internally used
 	def __call__(self, jobNum, jobObj):
 		return reduce(operator.and_, map(lambda selector: selector(jobNum, jobObj), self.selectors))
 
+	def getStates(self):
+		stateList = map(lambda selector: getattr(selector, 'getStates', lambda: None)(), self.selectors)
+		if None in stateList:
+			return None
+		return reduce(lambda x, y: filter(lambda state: state in y, x), stateList)
+
 
 class ClassSelector(JobSelector):
 	def __init__(self, arg, **kwargs):
@@ -45,6 +55,9 @@ class ClassSelector(JobSelector):
 	def __call__(self, jobNum, jobObj):
 		return jobObj.state in self.states
 
+	def getStates(self):
+		return self.states
+
 
 class StuckSelector(JobSelector):
 	def __init__(self, arg, **kwargs):
@@ -96,7 +109,7 @@ class QueueSelector(RegExSelector):
 
 class BackendSelector(RegExSelector):
 	def __init__(self, arg, **kwargs):
-		RegExSelector.__init__(self, arg, lambda num, obj: obj.get('id', '..').split('.')[1])
+		RegExSelector.__init__(self, arg, lambda num, obj: QM(obj.wmsId, obj.wmsId, '..').split('.')[1])
 
 
 class StateSelector(RegExSelector):
@@ -109,6 +122,9 @@ class StateSelector(RegExSelector):
 	def __call__(self, jobNum, jobObj):
 		return jobObj.state in self.states
 
+	def getStates(self):
+		return self.states
+
 
 class VarSelector(JobSelector):
 	def __init__(self, arg, **kwargs):
@@ -12,12 +12,72 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import os, gzip
+import os, gzip, marshal, operator, threading
 from python_compat import set, sorted, md5
 from grid_control import APIError, UserError, LoadableObject, utils
-from psource_base import ParameterInfo, ParameterMetadata, ParameterSource
+from psource_base import ParameterInfo, ParameterMetadata, ParameterSource, missingValue, setColumnRows
 from psource_file import GCDumpParameterSource
 
+# Parameter hashes are used to identify parameter settings during resync
+def getHashValue(key, value): # Contribution of a (tracked) parameter value to the parameter hash
+	if (value is missingValue) or (value == None):
+		return ''
+	value = str(value)
+	if value:
+		return key + value
+	return ''
+
+def getHashValues(key, column): # Contributions of a column of parameter values to the parameter hashes
+	values = map(str, column)
+	if (missingValue in column) or (None in column) or ('' in values):
+		return map(getHashValue, [key] * len(column), column)
+	return map(operator.add, [key] * len(column), values)
+
+def getParameterHashes(keys, columns, size): # Hashes of column oriented job infos
+	parts = []
+	for key in filter(lambda key: key in columns, keys):
+		parts.append(getHashValues(key, columns[key]))
+	if not parts:
+		return [md5().digest()] * size
+	return map(lambda values: md5(str.join('', values)).digest(), zip(*parts))
+
+def getTrackedKeys(pa):
+	return sorted(filter(lambda k: k.untracked == False, pa.getJobKeys()))
+
+def joinParameterHashes(hashesOld, hashesNew):
+	""" Join old and new entries with the same hash - entries with identical hashes are paired in order
+	Returns the list of (old, new) index pairs and the indices of missing (old) and added (new) entries
+	>>> joinParameterHashes(['a', 'b', 'c'], ['c', 'a', 'd'])
+	([(0, 1), (2, 0)], [1], [2])
+	>>> joinParameterHashes(['a', 'x', 'a', 'a'], ['b', 'a', 'a', 'x'])
+	([(0, 1), (1, 3), (2, 2)], [3], [0])
+	>>> joinParameterHashes(['a', 'a'], ['a', 'b', 'a', 'a'])
+	([(0, 0), (1, 2)], [], [1, 3])
+	"""
+	(hashIndex, hashDuplicates) = ({}, {})
+	for (pNum, pHash) in enumerate(hashesNew):
+		if pHash in hashIndex:
+			hashDuplicates.setdefault(pHash, []).append(pNum)
+		else:
+			hashIndex[pHash] = pNum
+	for pNumList in hashDuplicates.values():
+		pNumList.reverse() # duplicates are taken from the end
+	(pairs, pMissing) = ([], [])
+	for (oldPNum, pHash) in enumerate(hashesOld):
+		pNum = hashIndex.pop(pHash, None)
+		if pNum == None:
+			pMissing.append(oldPNum)
+			continue
+		if hashDuplicates.get(pHash):
+			hashIndex[pHash] = hashDuplicates[pHash].pop()
+		pairs.append((oldPNum, pNum))
+	pAdded = hashIndex.values()
+	for (pHash, pNumList) in hashDuplicates.items():
+		if pHash in hashIndex:
+			pAdded.extend(pNumList)
+	return (pairs, pMissing, sorted(pAdded))
+
+
 class ParameterAdapter(LoadableObject):
 	def __init__(self, source):
 		self._source = source
@@ -45,6 +105,46 @@ class ParameterAdapter(LoadableObject):
 			result = utils.filterDict(result, vF = lambda v: v != '')
 		return result
 
+	# Get column oriented job infos of multiple jobs - the parameter source is evaluated for all jobs at once
+	def getJobColumns(self, jobNumList, pNumList = None):
+		if pNumList == None:
+			pNumList = jobNumList
+		result = {ParameterInfo.ACTIVE: [True] * len(pNumList), ParameterInfo.REQS: [[] for pNum in pNumList],
+			'MY_JOBID': list(jobNumList), 'GC_PARAM': list(pNumList)}
+		self._source.fillParameterInfoList(pNumList, result)
+		return result
+
+	# Get job infos of multiple jobs
+	def getJobInfoList(self, jobNumList, pNumList = None):
+		result = self.getJobColumns(jobNumList, pNumList)
+		(keys, columns) = (result.keys(), result.values())
+		infos = map(lambda values: dict(zip(keys, values)), zip(*columns))
+		# Remove missing (and pruned) values - only columns containing such values are processed
+		for (key, column) in result.items():
+			if (missingValue in column) or (self._prune and ('' in column)):
+				for (info, value) in zip(infos, column):
+					if (value is missingValue) or (self._prune and (value == '')):
+						info.pop(key)
+		return infos
+
+	# Iterate over the column oriented infos of all jobs (in batches of <batchSize> jobs)
+	def iterJobColumns(self, batchSize = 10000):
+		maxN = self.getMaxJobs()
+		if maxN == None:
+			return
+		for start in range(0, maxN, batchSize):
+			jobNumList = range(start, min(start + batchSize, maxN))
+			yield (len(jobNumList), self.getJobColumns(jobNumList))
+
+	# Iterate over the infos of all jobs (evaluated in batches)
+	def iterJobInfos(self, batchSize = 10000):
+		maxN = self.getMaxJobs()
+		if maxN == None:
+			return
+		for start in range(0, maxN, batchSize):
+			for info in self.getJobInfoList(range(start, min(start + batchSize, maxN))):
+				yield info
+
 	def canSubmit(self, jobNum): # Use caching to speed up job manager operations
 		return self.getJobInfo(jobNum)[ParameterInfo.ACTIVE]
 
@@ -61,6 +161,46 @@ class BasicParameterAdapter(ParameterAdapter):
 		ParameterAdapter.__init__(self, source)
 		self._activeMap = {}
 		self._resyncState = None
+		# Job infos of up to <cache size> jobs are kept until the next resync
+		self._infoCacheSize = config.getInt('parameter cache size', 10000, onChange = None)
+		(self._infoCache, self._infoLock, self._infoTick) = ({}, threading.Lock(), 0)
+
+	def getJobInfo(self, jobNum, pNum = None):
+		if pNum != None: # explicit parameter number
+			return ParameterAdapter.getJobInfo(self, jobNum, pNum)
+		self._infoLock.acquire()
+		try:
+			self._infoTick += 1
+			if jobNum in self._infoCache:
+				self._infoCache[jobNum][0] = self._infoTick
+				return dict(self._infoCache[jobNum][1])
+		finally:
+			self._infoLock.release()
+		result = self._getJobInfoUncached(jobNum)
+		if self._infoCacheSize > 0:
+			self._cacheJobInfo(jobNum, dict(result))
+		return result
+
+	def _getJobInfoUncached(self, jobNum):
+		return ParameterAdapter.getJobInfo(self, jobNum)
+
+	def _cacheJobInfo(self, jobNum, info):
+		self._infoLock.acquire()
+		try:
+			self._infoCache[jobNum] = [self._infoTick, info]
+			if len(self._infoCache) > self._infoCacheSize: # drop least recently used half of the cache
+				lruItems = sorted(self._infoCache.items(), key = lambda (jobNum, entry): entry[0])
+				for (jobNum, entry) in lruItems[:len(lruItems) / 2 + 1]:
+					self._infoCache.pop(jobNum)
+		finally:
+			self._infoLock.release()
+
+	def _clearJobInfo(self):
+		self._infoLock.acquire()
+		try:
+			(self._infoCache, self._activeMap) = ({}, {})
+		finally:
+			self._infoLock.release()
 
 	def canSubmit(self, jobNum): # Use caching to speed up job manager operations
 		if jobNum not in self._activeMap:
@@ -71,27 +211,28 @@ class BasicParameterAdapter(ParameterAdapter):
 		if (self._resyncState == None):
 			self._resyncInternal()
 		result = self._resyncState
-		if result != None:
-			self._activeMap = {} # invalidate cache on changes
 		self._resyncState = None
 		return result
 
 	def _resyncInternal(self):
 		self._resyncState = self._source.resync()
+		self._clearJobInfo() # sources can change job infos without reporting them (eg. dataset locations)
 
 
 class TrackedParameterAdapter(BasicParameterAdapter):
 	def __init__(self, config, source):
 		self._rawSource = source
 		BasicParameterAdapter.__init__(self, config, source)
-		self._mapJob2PID = {}
+		(self._mapJob2PID, self._rawRows) = ({}, None) # parameters below rawRows are provided by the raw source
 		self._pathJob2PID = config.getWorkPath('params.map.gz')
-		self._pathParams = config.getWorkPath('params.dat.gz')
+		self._pathParams = config.getWorkPath('params.dat')
+		self._pathParamsText = config.getWorkPath('params.dat.gz') # parameter dump of older versions
+		self._pathHashes = config.getWorkPath('params.hash')
 
 		# Find out if init should be performed - overrides userResync!
 		userInit = config.getState(detail = 'parameters')
 		needInit = False
-		if not (os.path.exists(self._pathParams) and os.path.exists(self._pathJob2PID)):
+		if not ((os.path.exists(self._pathParams) or os.path.exists(self._pathParamsText)) and os.path.exists(self._pathJob2PID)):
 			needInit = True # Init needed if no parameter log exists
 		if userInit and not needInit and (source.getMaxParameters() != None):
 			utils.eprint('Re-Initialization will overwrite the current mapping between jobs and parameter/dataset content! This can lead to invalid results!')
@@ -116,8 +257,7 @@ class TrackedParameterAdapter(BasicParameterAdapter):
 			self.storedHash = None
 			self._resyncInternal()
 		elif doInit: # Write current state
-			self.writeJob2PID(self._pathJob2PID)
-			GCDumpParameterSource.write(self._pathParams, self)
+			self.writeParams()
 
 	def readJob2PID(self):
 		fp = gzip.open(self._pathJob2PID, 'r')
@@ -126,7 +266,7 @@ class TrackedParameterAdapter(BasicParameterAdapter):
 			self.maxN = None
 		mapInfo = filter(lambda x: x, map(str.strip, fp.readline().split(',')))
 		self._mapJob2PID = dict(map(lambda x: tuple(map(lambda y: int(y.lstrip('!')), x.split(':'))), mapInfo))
-		self._activeMap = {}
+		self._clearJobInfo()
 
 	def writeJob2PID(self, fn):
 		fp = gzip.open(fn, 'w')
@@ -135,17 +275,79 @@ class TrackedParameterAdapter(BasicParameterAdapter):
 		datastr = map(lambda (jobNum, pNum): '%d:%d' % (jobNum, pNum), data)
 		fp.write('%s\n' % str.join(',', datastr))
 
-	def getJobInfo(self, jobNum): # Perform mapping between jobNum and parameter number
+	def _getJobInfoUncached(self, jobNum): # Perform mapping between jobNum and parameter number
 		pNum = self._mapJob2PID.get(jobNum, jobNum)
 		if (pNum < self._source.getMaxParameters()) or (self._source.getMaxParameters() == None):
-			result = BasicParameterAdapter.getJobInfo(self, jobNum, pNum)
+			result = ParameterAdapter.getJobInfo(self, jobNum, pNum)
 		else:
 			result = {ParameterInfo.ACTIVE: False}
 		result['MY_JOBID'] = jobNum
 		return result
 
+	def getJobColumns(self, jobNumList, pNumList = None):
+		if pNumList != None: # explicit parameter numbers
+			return ParameterAdapter.getJobColumns(self, jobNumList, pNumList)
+		maxN = self._source.getMaxParameters()
+		pNumList = map(lambda jobNum: self._mapJob2PID.get(jobNum, jobNum), jobNumList)
+		rows = filter(lambda row: (maxN == None) or (pNumList[row] < maxN), range(len(jobNumList)))
+		columns = ParameterAdapter.getJobColumns(self, map(jobNumList.__getitem__, rows), map(pNumList.__getitem__, rows))
+		if len(rows) == len(jobNumList):
+			return columns
+		result = {ParameterInfo.ACTIVE: [False] * len(jobNumList), 'MY_JOBID': list(jobNumList)}
+		setColumnRows(result, rows, columns, len(jobNumList))
+		return result
+
+	# Write mapping, parameter dump and the hashes of the dumped parameters (collected while writing)
+	def writeParams(self):
+		keys = getTrackedKeys(self)
+		(hashes, active) = ([], [])
+		def collectHashes(size, columns):
+			hashes.extend(getParameterHashes(keys, columns, size))
+			active.extend(columns[ParameterInfo.ACTIVE])
+		self.writeJob2PID(self._pathJob2PID + '.old')
+		GCDumpParameterSource.write(self._pathParams + '.old', self, hook = collectHashes)
+		stat = os.stat(self._pathParams + '.old')
+		fp = open(self._pathHashes + '.old', 'wb')
+		rawRows = self._rawRows
+		if rawRows == None:
+			rawRows = self._rawSource.getMaxParameters()
+		marshal.dump((2, self._rawSource.getHash(), (stat.st_size, stat.st_mtime), rawRows, hashes, active), fp)
+		fp.close()
+		os.rename(self._pathJob2PID + '.old', self._pathJob2PID)
+		os.rename(self._pathParams + '.old', self._pathParams)
+		os.rename(self._pathHashes + '.old', self._pathHashes)
+		utils.removeFiles([self._pathParamsText])
+
+	def _readParams(self):
+		if os.path.exists(self._pathParams) or not os.path.exists(self._pathParamsText):
+			return ParameterAdapter(GCDumpParameterSource(self._pathParams))
+		return ParameterAdapter(GCDumpParameterSource(self._pathParamsText))
+
+	# Returns source hash, number of raw source entries, parameter hashes and activity of the dumped parameters
+	def readParamHashes(self):
+		try:
+			(version, sourceHash, stamp, rawRows, hashes, active) = marshal.load(open(self._pathHashes, 'rb'))
+			stat = os.stat(self._pathParams)
+			if (version == 2) and (stamp == (stat.st_size, stat.st_mtime)) and (len(hashes) == len(active)):
+				return (sourceHash, rawRows, hashes, active)
+		except:
+			pass # Missing or outdated hashes - recalculate them from the parameter dump
+		old = self._readParams()
+		(hashes, active) = self._getParamHashes(old, range(old.getMaxJobs()))
+		return (None, 0, hashes, active)
+
+	def _getParamHashes(self, pa, pNumList, batchSize = 10000):
+		(keys, hashes, active) = (getTrackedKeys(pa), [], [])
+		for start in range(0, len(pNumList), batchSize):
+			batch = pNumList[start:start + batchSize]
+			columns = pa.getJobColumns(batch)
+			hashes.extend(getParameterHashes(keys, columns, len(batch)))
+			active.extend(columns[ParameterInfo.ACTIVE])
+		return (hashes, active)
+
 	def _resyncInternal(self): # This function is _VERY_ time critical!
 		tmp = self._rawSource.resync() # First ask about plugin changes
+		self._clearJobInfo() # sources can change job infos without reporting them (eg. dataset locations)
 		(redo, disable, sizeChange) = (set(tmp[0]), set(tmp[1]), tmp[2])
 		hashNew = self._rawSource.getHash()
 		hashChange = self.storedHash != hashNew
@@ -154,63 +356,59 @@ class TrackedParameterAdapter(BasicParameterAdapter):
 			self._resyncState = None
 			return 
 
-		def translatePlugin(plugin): # Reduces plugin output to essential information for diff
-			keys_store = sorted(filter(lambda k: k.untracked == False, plugin.getJobKeys()))
-			def translateEntry(meta): # Translates parameter setting into hash
-				tmp = md5()
-				for key in filter(lambda k: k in meta, keys_store):
-					if str(meta[key]):
-						tmp.update(key)
-						tmp.update(str(meta[key]))
-				return { ParameterInfo.HASH: tmp.hexdigest(), 'GC_PARAM': meta['GC_PARAM'],
-					ParameterInfo.ACTIVE: meta[ParameterInfo.ACTIVE] }
-			if plugin.getMaxJobs() != None:
-				for jobNum in range(plugin.getMaxJobs()):
-					yield translateEntry(plugin.getJobInfo(jobNum))
-
-		old = ParameterAdapter(GCDumpParameterSource(self._pathParams))
-		params_old = list(translatePlugin(old))
+		# Parameter entries are reduced to their hash and activity (indexed by GC_PARAM) for the diff
+		(oldSourceHash, oldRawRows, hashesOld, activeOld) = self.readParamHashes()
 		new = ParameterAdapter(self._rawSource)
-		params_new = list(translatePlugin(new))
+		newMaxJobs = new.getMaxJobs()
+		(hashesNew, activeNew) = ([None] * max(0, newMaxJobs), [None] * max(0, newMaxJobs))
+		if not (hashChange or sizeChange) and (oldSourceHash == hashNew):
+			# Unchanged parameter source - only entries reported by the resync have to be evaluated
+			for (jobNum, pHash) in enumerate(hashesOld):
+				pNum = self._mapJob2PID.get(jobNum, jobNum)
+				if (pNum < min(newMaxJobs, oldRawRows)) and (pNum not in redo) and (pNum not in disable):
+					(hashesNew[pNum], activeNew[pNum]) = (pHash, activeOld[jobNum])
+		evalList = filter(lambda pNum: hashesNew[pNum] == None, range(len(hashesNew)))
+		for (pNum, pHash, pActive) in zip(evalList, *self._getParamHashes(new, evalList)):
+			(hashesNew[pNum], activeNew[pNum]) = (pHash, pActive)
 
+		# Join old and new entries with the same hash
+		(pairs, pMissing, pAdded) = joinParameterHashes(hashesOld, hashesNew)
 		mapJob2PID = {}
-		def sameParams(paramsAdded, paramsMissing, paramsSame, oldParam, newParam):
-			if not oldParam[ParameterInfo.ACTIVE] and newParam[ParameterInfo.ACTIVE]:
-				redo.add(newParam['GC_PARAM'])
-			if oldParam[ParameterInfo.ACTIVE] and not newParam[ParameterInfo.ACTIVE]:
-				disable.add(newParam['GC_PARAM'])
-			mapJob2PID[oldParam['GC_PARAM']] = newParam['GC_PARAM']
-		(pAdded, pMissing, pSame) = utils.DiffLists(params_old, params_new,
-			lambda a, b: cmp(a[ParameterInfo.HASH], b[ParameterInfo.HASH]), sameParams)
+		for (oldPNum, pNum) in pairs:
+			if not activeOld[oldPNum] and activeNew[pNum]:
+				redo.add(pNum)
+			if activeOld[oldPNum] and not activeNew[pNum]:
+				disable.add(pNum)
+			if oldPNum != pNum:
+				mapJob2PID[oldPNum] = pNum
 
 		# Construct complete parameter space plugin with missing parameter entries and intervention state
 		# NNNNNNNNNNNNN OOOOOOOOO | source: NEW (==self) and OLD (==from file)
 		# <same><added> <missing> | same: both in NEW and OLD, added: only in NEW, missing: only in OLD
-		oldMaxJobs = old.getMaxJobs()
+		oldMaxJobs = len(hashesOld)
 		# assign sequential job numbers to the added parameter entries
-		pAdded.sort(key = lambda x: x['GC_PARAM'])
-		for (idx, meta) in enumerate(pAdded):
-			if oldMaxJobs + idx != meta['GC_PARAM']:
-				mapJob2PID[oldMaxJobs + idx] = meta['GC_PARAM']
+		for (idx, pNum) in enumerate(pAdded):
+			if oldMaxJobs + idx != pNum:
+				mapJob2PID[oldMaxJobs + idx] = pNum
+
+		if pMissing: # Only the missing entries are read from the parameter dump
+			old = self._readParams()
+			missingInfos = []
+			for (idx, oldPNum) in enumerate(pMissing):
+				mapJob2PID[oldPNum] = newMaxJobs + idx
+				tmp = old.getJobInfo(newMaxJobs + idx, oldPNum)
+				tmp.pop('GC_PARAM')
+				if tmp[ParameterInfo.ACTIVE]:
+					tmp[ParameterInfo.ACTIVE] = False
+					disable.add(newMaxJobs + idx)
+				missingInfos.append(tmp)
 
-		missingInfos = []
-		newMaxJobs = new.getMaxJobs()
-		pMissing.sort(key = lambda x: x['GC_PARAM'])
-		for (idx, meta) in enumerate(pMissing):
-			mapJob2PID[meta['GC_PARAM']] = newMaxJobs + idx
-			tmp = old.getJobInfo(newMaxJobs + idx, meta['GC_PARAM'])
-			tmp.pop('GC_PARAM')
-			if tmp[ParameterInfo.ACTIVE]:
-				tmp[ParameterInfo.ACTIVE] = False
-				disable.add(newMaxJobs + idx)
-			missingInfos.append(tmp)
-
-		if missingInfos:
 			from psource_meta import ChainParameterSource
 			from psource_basic import InternalParameterSource
 			currentInfoKeys = new.getJobKeys()
 			missingInfoKeys = filter(lambda key: key not in currentInfoKeys, old.getJobKeys())
 			self._source = ChainParameterSource(self._rawSource, InternalParameterSource(missingInfos, missingInfoKeys))
+			self._rawRows = newMaxJobs
 
 		self._mapJob2PID = mapJob2PID # Update Job2PID map
 		redo = redo.difference(disable)
@@ -221,7 +419,9 @@ class TrackedParameterAdapter(BasicParameterAdapter):
 		elif sizeChange:
 			self._resyncState = (set(), set(), sizeChange)
 		# Write resynced state
-		self.writeJob2PID(self._pathJob2PID + '.old')
-		GCDumpParameterSource.write(self._pathParams + '.old', self)
-		os.rename(self._pathJob2PID + '.old', self._pathJob2PID)
-		os.rename(self._pathParams + '.old', self._pathParams)
+		self.writeParams()
+
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -22,6 +22,44 @@ class ParameterInfo:
 		locals()[reqType] = idx
 
 
+# Column oriented parameter infos: columns[key][row] is the value of the parameter in the given row
+# Rows without value for the key are marked with missingValue
+class MissingValue(object):
+	def __repr__(self):
+		return '<missing>'
+missingValue = MissingValue()
+
+def getColumnRow(columns, row): # Get parameter info dictionary of a single row
+	result = {}
+	for (key, column) in columns.iteritems():
+		if column[row] is not missingValue:
+			result[key] = column[row]
+	return result
+
+def setColumnRow(columns, row, info, size): # Store parameter info dictionary in the given row
+	for (key, column) in columns.iteritems():
+		if key not in info:
+			column[row] = missingValue
+	for (key, value) in info.iteritems():
+		if key not in columns:
+			columns[key] = [missingValue] * size
+		columns[key][row] = value
+
+def getColumnRows(columns, rows): # Select rows of column oriented parameter infos
+	result = {}
+	for (key, column) in columns.iteritems():
+		result[key] = map(column.__getitem__, rows)
+	return result
+
+def setColumnRows(columns, rows, source, size): # Store column oriented parameter infos in the given rows
+	for (key, column) in source.iteritems():
+		if key not in columns:
+			columns[key] = [missingValue] * size
+		target = columns[key]
+		for (row, value) in zip(rows, column):
+			target[row] = value
+
+
 class ParameterMetadata(str):
 	def __new__(cls, value, untracked = False):
 		obj = str.__new__(cls, value)
@@ -51,6 +89,19 @@ class ParameterSource(LoadableObject):
 	def fillParameterInfo(self, pNum, result):
 		raise AbstractError
 
+	# Fill column oriented parameter infos (see getColumnRow) of the parameters start ... stop - 1
+	def fillParameterInfoRange(self, start, stop, result):
+		self.fillParameterInfoList(range(start, stop), result)
+
+	# Fill column oriented parameter infos - row i contains the parameter pNumList[i]
+	# Generic implementation via fillParameterInfo - sources should provide faster column-wise versions
+	def fillParameterInfoList(self, pNumList, result):
+		size = len(pNumList)
+		for (row, pNum) in enumerate(pNumList):
+			info = getColumnRow(result, row)
+			self.fillParameterInfo(pNum, info)
+			setColumnRow(result, row, info, size)
+
 	def resyncCreate(self):
 		return (set(), set(), False) # returns two sets of parameter ids and boolean (redo, disable, sizeChange)
 
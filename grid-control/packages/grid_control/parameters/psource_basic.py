@@ -15,7 +15,7 @@
 import random, re
 from python_compat import md5
 from grid_control import ConfigError, utils, WMS, APIError
-from psource_base import ParameterSource, ParameterMetadata, ParameterInfo
+from psource_base import ParameterSource, ParameterMetadata, ParameterInfo, missingValue
 
 class InternalParameterSource(ParameterSource):
 	def __init__(self, values, keys):
@@ -28,6 +28,13 @@ class InternalParameterSource(ParameterSource):
 	def fillParameterInfo(self, pNum, result):
 		result.update(self.values[pNum])
 
+	def fillParameterInfoList(self, pNumList, result): # (stored values can contain keys not in self.keys)
+		for (row, pNum) in enumerate(pNumList):
+			for (key, value) in self.values[pNum].iteritems():
+				if key not in result:
+					result[key] = [missingValue] * len(pNumList)
+				result[key][row] = value
+
 	def fillParameterKeys(self, result):
 		result.extend(self.keys)
 
@@ -96,6 +103,9 @@ class SimpleParameterSource(SingleParameterSource):
 	def fillParameterInfo(self, pNum, result):
 		result[self.key] = self.values[pNum]
 
+	def fillParameterInfoList(self, pNumList, result):
+		result[self.key] = map(self.values.__getitem__, pNumList)
+
 	def getHash(self):
 		return utils.md5(str(self.key) + str(self.values)).hexdigest()
 
@@ -131,6 +141,9 @@ class ConstParameterSource(SingleParameterSource):
 	def fillParameterInfo(self, pNum, result):
 		result[self.key] = self.value
 
+	def fillParameterInfoList(self, pNumList, result):
+		result[self.key] = [self.value] * len(pNumList)
+
 	def create(cls, pconfig, key, value = None):
 		if value == None:
 			value = pconfig.get(key)
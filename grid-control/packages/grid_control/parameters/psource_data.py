@@ -56,7 +56,7 @@ class DataParameterSource(ParameterSource):
 		elif os.path.exists(self.getDataPath('cache.dat') and self.getDataPath('map.tar')):
 			self.dataSplitter.importState(self.getDataPath('map.tar'))
 		else:
-			self.dataProvider.saveState(self.getDataPath('cache.dat'))
+			self.dataProvider.saveState(self.getDataPath('cache.dat'), binary = True)
 			self.dataSplitter.splitDataset(self.getDataPath('map.tar'), self.dataProvider.getBlocks())
 
 		self.maxN = self.dataSplitter.getMaxJobs()
@@ -85,32 +85,36 @@ class DataParameterSource(ParameterSource):
 	def getDataPath(self, postfix):
 		return os.path.join(self.dataDir, self.srcName + postfix)
 
+	def _resyncMapping(self, old, new, result_redo, result_disable):
+		self.dataProvider.saveState(self.getDataPath('cache-new.dat'), binary = True)
+
+		# Use old splitting information to synchronize with new dataset infos
+		jobChanges = self.dataSplitter.resyncMapping(self.getDataPath('map-new.tar'), old, new)
+		if jobChanges:
+			# Move current splitting to backup and use the new splitting from now on
+			def backupRename(old, cur, new):
+				if self.keepOld:
+					os.rename(self.getDataPath(cur), self.getDataPath(old))
+				os.rename(self.getDataPath(new), self.getDataPath(cur))
+			backupRename(  'map-old-%d.tar' % time.time(),   'map.tar',   'map-new.tar')
+			backupRename('cache-old-%d.dat' % time.time(), 'cache.dat', 'cache-new.dat')
+			old_maxN = self.dataSplitter.getMaxJobs()
+			self.dataSplitter.importState(self.getDataPath('map.tar'))
+			self.maxN = self.dataSplitter.getMaxJobs()
+			self.dataSplitter.getMaxJobs()
+			result_redo.update(jobChanges[0])
+			result_disable.update(jobChanges[1])
+			return old_maxN != self.maxN
+		return False
+
 	def resync(self):
 		(result_redo, result_disable, result_sizeChange) = ParameterSource.resync(self)
 		if self.resyncEnabled() and self.dataProvider:
 			# Get old and new dataset information
 			old = DataProvider.loadState(self.getDataPath('cache.dat')).getBlocks()
-			self.dataProvider.clearCache()
-			new = self.dataProvider.getBlocks()
-			self.dataProvider.saveState(self.getDataPath('cache-new.dat'))
-
-			# Use old splitting information to synchronize with new dataset infos
-			jobChanges = self.dataSplitter.resyncMapping(self.getDataPath('map-new.tar'), old, new)
-			if jobChanges:
-				# Move current splitting to backup and use the new splitting from now on
-				def backupRename(old, cur, new):
-					if self.keepOld:
-						os.rename(self.getDataPath(cur), self.getDataPath(old))
-					os.rename(self.getDataPath(new), self.getDataPath(cur))
-				backupRename(  'map-old-%d.tar' % time.time(),   'map.tar',   'map-new.tar')
-				backupRename('cache-old-%d.dat' % time.time(), 'cache.dat', 'cache-new.dat')
-				old_maxN = self.dataSplitter.getMaxJobs()
-				self.dataSplitter.importState(self.getDataPath('map.tar'))
-				self.maxN = self.dataSplitter.getMaxJobs()
-				self.dataSplitter.getMaxJobs()
-				result_redo.update(jobChanges[0])
-				result_disable.update(jobChanges[1])
-				result_sizeChange = result_sizeChange or (old_maxN != self.maxN)
+			(new, changed) = self.dataProvider.refreshBlocks(old)
+			if changed: # Nothing to do if the fingerprints of all blocks are unchanged
+				result_sizeChange = self._resyncMapping(old, new, result_redo, result_disable) or result_sizeChange
 			self.resyncFinished()
 		return (result_redo, result_disable, result_sizeChange)
 
@@ -12,17 +12,53 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-import os, csv, gzip
-from python_compat import sorted
-from grid_control import utils
-from psource_base import ParameterSource, ParameterMetadata, ParameterInfo
+import os, csv, gzip, zlib, struct, marshal
+from python_compat import set, sorted
+from grid_control import utils, RuntimeError
+from psource_base import ParameterSource, ParameterMetadata, ParameterInfo, missingValue
 from psource_basic import InternalParameterSource
 from psource_meta import ForwardingParameterSource
 
 # Reader for grid-control dump files
+# Binary dumps consist of a header with the key table, a sequence of zlib compressed blocks of entries
+# (marshaled activity flags and columns of indices into a table of the distinct values) and a block index
+# Blocks are only decoded on access - the text format of older versions is still readable
 class GCDumpParameterSource(ParameterSource):
-	def __init__(self, fn):
+	(dumpMagic, dumpHeader, dumpTrailer) = ('GCPD', '>4sII', '>Q')
+	(dumpHeaderSize, dumpTrailerSize) = (struct.calcsize(dumpHeader), struct.calcsize(dumpTrailer))
+
+	def __init__(self, fn, cacheSize = 16):
 		ParameterSource.__init__(self)
+		(self._blockCache, self._cacheSize) = ({}, cacheSize)
+		fp = open(fn, 'rb')
+		if fp.read(len(self.dumpMagic)) == self.dumpMagic:
+			fp.seek(0)
+			(magic, version, keySize) = struct.unpack(self.dumpHeader, fp.read(self.dumpHeaderSize))
+			if version != 1:
+				raise RuntimeError('Unsupported version %d of parameter dump %s' % (version, fn))
+			self.keys = marshal.loads(fp.read(keySize))
+			fp.seek(-self.dumpTrailerSize, 2)
+			fp.seek(struct.unpack(self.dumpTrailer, fp.read(self.dumpTrailerSize))[0])
+			(self._maxN, self._blockSize, self._blockOffsets) = marshal.load(fp)
+			self._fp = fp
+		else:
+			fp.close()
+			self._readText(fn)
+
+	def _readText(self, fn): # Read the whole (gzipped) text dump
+		""" Text dumps of older versions contain the key list and a line for each entry (inactive: '!')
+		>>> import tempfile
+		>>> from padapter import ParameterAdapter
+		>>> fn = tempfile.mktemp('.gz')
+		>>> fp = gzip.open(fn, 'wb')
+		>>> fp.writelines(["# ['A', 'B']\\n", "0\\t1\\t'x'\\n", "1!\\t'a'\\tNone\\n", "2\\t''\\t[1, 2]\\n"])
+		>>> fp.close()
+		>>> pa = ParameterAdapter(GCDumpParameterSource(fn))
+		>>> infoItems = lambda info: sorted(filter(lambda (k, v): k in ['A', 'B', ParameterInfo.ACTIVE], info.items()))
+		>>> map(lambda jobNum: infoItems(pa.getJobInfo(jobNum)), range(pa.getMaxJobs()))
+		[[(0, True), ('A', 1), ('B', 'x')], [(0, False), ('A', 'a')], [(0, True), ('B', [1, 2])]]
+		>>> os.remove(fn)
+		"""
 		fp = gzip.open(fn, 'rb')
 		keyline = fp.readline().lstrip('#').strip()
 		self.keys = []
@@ -31,37 +67,115 @@ class GCDumpParameterSource(ParameterSource):
 		def parseLine(line):
 			if not line.startswith('#'):
 				pNumStr, stored = map(str.strip, line.split('\t', 1))
-				return ('!' in pNumStr, int(pNumStr.rstrip('!')), map(eval, stored.split('\t')))
-		self.values = map(parseLine, fp.readlines())
+				return (not '!' in pNumStr, map(eval, stored.split('\t')))
+		values = map(parseLine, fp.readlines())
+		(self._maxN, self._blockSize, self._fp) = (len(values), max(1, len(values)), None)
+		self._blockCache[0] = (map(lambda (active, entry): active, values),
+			map(lambda idx: map(lambda (active, entry): entry[idx], values), range(len(self.keys))))
+
+	def _getBlock(self, blockNum): # Returns activity flags and value columns of the block
+		if blockNum not in self._blockCache:
+			if len(self._blockCache) >= self._cacheSize:
+				self._blockCache = {}
+			self._fp.seek(self._blockOffsets[blockNum])
+			(size,) = struct.unpack('>I', self._fp.read(4))
+			(active, columns) = marshal.loads(zlib.decompress(self._fp.read(size)))
+			columns = map(lambda (table, indices): map(table.__getitem__, indices), columns)
+			self._blockCache[blockNum] = (active, columns)
+		return self._blockCache[blockNum]
 
 	def getMaxParameters(self):
-		return len(self.values)
+		return self._maxN
 
 	def fillParameterKeys(self, result):
 		result.extend(map(lambda k: ParameterMetadata(k, untracked = False), self.keys))
 
 	def fillParameterInfo(self, pNum, result):
-		result[ParameterInfo.ACTIVE] = not self.values[pNum][0]
-		result.update(filter(lambda (k, v): v != None, zip(self.keys, self.values[pNum][2])))
+		(active, columns) = self._getBlock(pNum / self._blockSize)
+		row = pNum % self._blockSize
+		result[ParameterInfo.ACTIVE] = active[row]
+		for (key, column) in zip(self.keys, columns):
+			if column[row] != None:
+				result[key] = column[row]
+
+	def fillParameterInfoList(self, pNumList, result):
+		resultActive = result[ParameterInfo.ACTIVE]
+		for key in self.keys:
+			if key not in result:
+				result[key] = [missingValue] * len(pNumList)
+		resultColumns = map(result.__getitem__, self.keys)
+		for (row, pNum) in enumerate(pNumList):
+			(active, columns) = self._getBlock(pNum / self._blockSize)
+			blockRow = pNum % self._blockSize
+			resultActive[row] = active[blockRow]
+			for (resultColumn, column) in zip(resultColumns, columns):
+				if column[blockRow] != None:
+					resultColumn[row] = column[blockRow]
 
-	def write(cls, fn, pa):
-		fp = gzip.open(fn, 'wb')
+	# Entries are written in blocks of <blockSize> entries - the hook is called with the columns of each block
+	def write(cls, fn, pa, blockSize = 1000, hook = None):
+		""" Missing and None values are not stored, other values are read back like from the text dump
+		>>> import tempfile
+		>>> from padapter import ParameterAdapter
+		>>> keys = map(ParameterMetadata, ['A', 'B', 'C'])
+		>>> values = [{'A': 1, 'B': None, 'C': [1, 'x']}, {'A': 'a', ParameterInfo.ACTIVE: False}, {'B': 2.5, 'C': ()}]
+		>>> fn = tempfile.mktemp()
+		>>> GCDumpParameterSource.write(fn, ParameterAdapter(InternalParameterSource(values, keys)), blockSize = 2)
+		>>> pa = ParameterAdapter(GCDumpParameterSource(fn, cacheSize = 1))
+		>>> infoItems = lambda info: sorted(filter(lambda (k, v): k in ['A', 'B', 'C', ParameterInfo.ACTIVE], info.items()))
+		>>> map(lambda jobNum: infoItems(pa.getJobInfo(jobNum)), range(pa.getMaxJobs()))
+		[[(0, True), ('A', 1), ('C', [1, 'x'])], [(0, False), ('A', 'a')], [(0, True), ('B', 2.5), ('C', ())]]
+		>>> map(infoItems, pa.getJobInfoList([2, 0, 1])) # blocks are read again after dropping the cache
+		[[(0, True), ('B', 2.5), ('C', ())], [(0, True), ('A', 1), ('C', [1, 'x'])], [(0, False), ('A', 'a')]]
+		>>> os.remove(fn)
+		"""
 		keys = sorted(filter(lambda p: p.untracked == False, pa.getJobKeys()))
-		fp.write('# %s\n' % keys)
-		maxN = pa.getMaxJobs()
-		if maxN:
-			log = None
-			for jobNum in range(maxN):
-				del log
-				log = utils.ActivityLog('Writing parameter dump [%d/%d]' % (jobNum + 1, maxN))
-				meta = pa.getJobInfo(jobNum)
-				if meta.get(ParameterInfo.ACTIVE, True):
-					fp.write('%d\t%s\n' % (jobNum, str.join('\t', map(lambda k: repr(meta.get(k, '')), keys))))
-				else:
-					fp.write('%d!\t%s\n' % (jobNum, str.join('\t', map(lambda k: repr(meta.get(k, '')), keys))))
+		keyData = marshal.dumps(map(str, keys))
+		fp = open(fn, 'wb')
+		fp.write(struct.pack(cls.dumpHeader, cls.dumpMagic, 1, len(keyData)) + keyData)
+		(maxN, offsets, nEntries, log) = (pa.getMaxJobs(), [], 0, None)
+		for (size, columns) in pa.iterJobColumns(blockSize):
+			del log
+			log = utils.ActivityLog('Writing parameter dump [%d/%d]' % (nEntries + 1, maxN))
+			if hook:
+				hook(size, columns)
+			offsets.append(fp.tell())
+			values = map(lambda key: internValues(columns.get(key, [''] * size)), keys)
+			data = zlib.compress(marshal.dumps((columns[ParameterInfo.ACTIVE], values)))
+			fp.write(struct.pack('>I', len(data)) + data)
+			nEntries += size
+		indexOffset = fp.tell()
+		marshal.dump((nEntries, blockSize, offsets), fp)
+		fp.write(struct.pack(cls.dumpTrailer, indexOffset))
+		fp.close()
 	write = classmethod(write)
 
 
+# Values are stored as table of distinct values and indices into this table
+def internValues(values):
+	valueTypes = set(map(type, values))
+	if (len(valueTypes) == 1) and (valueTypes.pop() in (str, int, long, float, unicode)):
+		table = list(set(values))
+		tableMap = dict(zip(table, range(len(table))))
+		return (table, map(tableMap.__getitem__, values))
+	(table, tableMap, indices) = ([], {}, [])
+	for value in values:
+		if value is missingValue:
+			value = ''
+		elif type(value) not in (str, int, long, float, bool, unicode, type(None)):
+			value = eval(repr(value)) # (same as the value read back from the text dump)
+		try:
+			tableKey = (type(value), value)
+			hash(tableKey)
+		except TypeError:
+			tableKey = (type(value), repr(value))
+		if tableKey not in tableMap:
+			tableMap[tableKey] = len(table)
+			table.append(value)
+		indices.append(tableMap[tableKey])
+	return (table, indices)
+
+
 # Reader for CSV files
 class CSVParameterSource(InternalParameterSource):
 	def __init__(self, fn, format = 'sniffed'):
@@ -85,3 +199,8 @@ class CSVParameterSource(InternalParameterSource):
 		return CSVParameterSource(fn , pconfig.get(src, 'format', 'sniffed'))
 	create = classmethod(create)
 ParameterSource.managerMap['csv'] = CSVParameterSource
+
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -13,17 +13,69 @@
 #-#  limitations under the License.
 
 import re
-from grid_control import utils, ConfigError, QM
-from psource_base import ParameterSource, ParameterInfo
+from python_compat import sorted
+from grid_control import utils, AbstractError, ConfigError, QM
+from psource_base import ParameterSource, ParameterInfo, missingValue
 from psource_basic import KeyParameterSource, SingleParameterSource, SimpleParameterSource
 
+# Matches parameter values against lookup patterns - each pattern is compiled only once into a predicate
+class LookupFunction:
+	exact = False # exact matchers can be resolved via dictionary lookup
+
+	def __call__(self, value, pat):
+		return self.compile(pat)(value)
+
+	def compile(self, pat):
+		raise AbstractError
+
+class StartLookupFunction(LookupFunction):
+	def compile(self, pat):
+		return lambda value: value.startswith(pat)
+
+class EndLookupFunction(LookupFunction):
+	def compile(self, pat):
+		return lambda value: value.endswith(pat)
+
+class EqualLookupFunction(LookupFunction):
+	exact = True
+	def compile(self, pat):
+		return lambda value: value == pat
+
+class ExprLookupFunction(LookupFunction):
+	def compile(self, pat):
+		return eval('lambda value: %s' % pat)
+
+class RegexLookupFunction(LookupFunction):
+	def compile(self, pat):
+		return re.compile(pat).search
+
+LookupFunction.functionMap = {'start': StartLookupFunction, 'end': EndLookupFunction,
+	'equal': EqualLookupFunction, 'expr': ExprLookupFunction, 'regex': RegexLookupFunction}
+
+
 class LookupMatcher:
-	def __init__(self, lookupKeys, lookupFunctions, lookupDictConfig):
+	def __init__(self, lookupKeys, lookupFunctions, lookupDictConfig, cacheSize = 10000):
 		(self.lookupKeys, self.lookupFunctions) = (lookupKeys, lookupFunctions)
 		if len(lookupDictConfig) == 2 and isinstance(lookupDictConfig[0], dict):
 			self.lookupDict, self.lookupOrder = lookupDictConfig
 		else:
 			self.lookupDict, self.lookupOrder = ({None: lookupDictConfig}, [])
+		# Rules are compiled into predicates and rules of exact matchers are indexed by their values
+		def compileRule(lookupValues):
+			return (lookupValues, map(compileMatch, zip(lookupFunctions, lookupValues)))
+		def compileMatch((lmatch, lval)):
+			if isinstance(lmatch, LookupFunction):
+				return lmatch.compile(lval)
+			return lambda value: lmatch(value, lval)
+		self._rules = map(compileRule, self.lookupOrder)
+		self._exactMap = None
+		if not filter(lambda lmatch: not getattr(lmatch, 'exact', False), lookupFunctions) and \
+				not filter(lambda lookupValues: len(lookupValues) != len(lookupKeys), self.lookupOrder):
+			self._exactMap = {}
+			for lookupValues in self.lookupOrder:
+				self._exactMap.setdefault(tuple(lookupValues), lookupValues)
+		# Matching rules are memorised for up to <cacheSize> combinations of source values
+		(self._matchCache, self._cacheSize) = ({}, cacheSize)
 
 	def getHash(self):
 		return utils.md5(str(map(lambda x: self.lookupDict, self.lookupOrder))).hexdigest()
@@ -32,19 +84,53 @@ class LookupMatcher:
 		return 'key(%s)' % str.join(', ', map(lambda x: "'%s'" % x, self.lookupKeys))
 
 	def matchRule(self, src):
-		srcValues = map(lambda key: src.get(key, None), self.lookupKeys)
-		for lookupValues in self.lookupOrder:
-			match = True
-			for (sval, lval, lmatch) in zip(srcValues, lookupValues, self.lookupFunctions):
-				if sval != None:
-					match = match and lmatch(sval, lval)
-			if match:
+		return self.matchValues(tuple(map(lambda key: src.get(key, None), self.lookupKeys)))
+
+	# Returns the first rule matching the tuple of source values (None matches all patterns)
+	def matchValues(self, srcValues):
+		if (self._exactMap != None) and (None not in srcValues):
+			try:
+				return self._exactMap.get(srcValues)
+			except TypeError: # unhashable source values
+				return self._matchRules(srcValues)
+		try:
+			cacheKey = (srcValues, tuple(map(type, srcValues)))
+			return self._matchCache[cacheKey]
+		except KeyError:
+			pass
+		except TypeError: # unhashable source values
+			return self._matchRules(srcValues)
+		result = self._matchRules(srcValues)
+		if len(self._matchCache) >= self._cacheSize:
+			self._matchCache = {}
+		self._matchCache[cacheKey] = result
+		return result
+
+	def _matchRules(self, srcValues):
+		for (lookupValues, predicates) in self._rules:
+			for (sval, predicate) in zip(srcValues, predicates):
+				if (sval != None) and not predicate(sval):
+					break
+			else:
 				return lookupValues
 
 	def lookup(self, info):
 		rule = self.matchRule(info)
 		return self.lookupDict.get(rule, None)
 
+	# Lookup results for all rows of column oriented parameter infos
+	def lookupColumns(self, columns, size):
+		def getValues(key):
+			column = columns.get(key, [None] * size)
+			if missingValue in column:
+				return map(lambda value: QM(value is missingValue, None, value), column)
+			return column
+		srcValueList = [()] * size
+		if self.lookupKeys:
+			srcValueList = zip(*map(getValues, self.lookupKeys))
+		for srcValues in srcValueList:
+			yield self.lookupDict.get(self.matchValues(srcValues), None)
+
 
 def lookupConfigParser(pconfig, key, lookup):
 	def collectKeys(src):
@@ -68,25 +154,9 @@ def lookupConfigParser(pconfig, key, lookup):
 			raise ConfigError('Match-functions (length %d) and match-keys (length %d) do not match!' %
 				(len(matchstrList), len(lookup)))
 	for matchstr in matchstrList:
-		if matchstr == 'start':
-			matchfun.append(lambda value, pat: value.startswith(pat))
-		elif matchstr == 'end':
-			matchfun.append(lambda value, pat: value.endswith(pat))
-		elif matchstr == 'equal':
-			matchfun.append(lambda value, pat: value == pat)
-		elif matchstr == 'expr':
-			matchfun.append(lambda value, pat: eval('lambda value: %s' % pat)(value))
-		elif matchstr == 'regex':
-			class MatchObj:
-				def __init__(self):
-					self.expr = {}
-				def __call__(self, value, pat):
-					if pat not in self.expr:
-						self.expr[pat] = re.compile(pat)
-					return self.expr[pat].search(value)
-			matchfun.append(MatchObj())
-		else:
+		if matchstr not in LookupFunction.functionMap:
 			raise ConfigError('Invalid matcher selected! "%s"' % matchstr)
+		matchfun.append(LookupFunction.functionMap[matchstr]())
 	(content, order) = pconfig.getParameter(key.lstrip('!'))
 	if pconfig.getBool(key.lstrip('!'), 'empty set', False) == False:
 		for k in content:
@@ -109,6 +179,18 @@ class SimpleLookupParameterSource(SingleParameterSource):
 		elif lookupResult[0] != None:
 			result[self.key] = lookupResult[0]
 
+	def fillParameterInfoList(self, pNumList, result):
+		if self.key not in result:
+			result[self.key] = [missingValue] * len(pNumList)
+		column = result[self.key]
+		for (row, lookupResult) in enumerate(self.matcher.lookupColumns(result, len(pNumList))):
+			if lookupResult == None:
+				continue
+			elif len(lookupResult) != 1:
+				raise ConfigError("%s can't handle multiple lookup parameter sets!" % self.__class__.__name__)
+			elif lookupResult[0] != None:
+				column[row] = lookupResult[0]
+
 	def show(self, level = 0):
 		ParameterSource.show(self, level, 'var = %s, lookup = %s' % (self.key, str.join(',', self.matcher.lookupKeys)))
 
@@ -129,23 +211,31 @@ class SwitchingLookupParameterSource(SingleParameterSource):
 		SingleParameterSource.__init__(self, outputKey)
 		self.matcher = LookupMatcher(lookupKeys, lookupFunctions, lookupDictConfig)
 		self.plugin = plugin
+		(self._pluginHash, self._lookupResults) = (None, {})
 		self.pSpace = self.initPSpace()
 
-	def initPSpace(self):
+	# The parameter space consists of (plugin parameter number, resolved lookup value) entries
+	# Lookup results are stored for each plugin parameter - only the given plugin parameters are updated
+	def initPSpace(self, pNumChanged = None):
 		result = []
-		def addEntry(pNum):
-			tmp = {ParameterInfo.ACTIVE: True, ParameterInfo.REQS: []}
-			self.plugin.fillParameterInfo(pNum, tmp)
-			lookupResult = self.matcher.lookup(tmp)
-			if lookupResult:
-				for (lookupIdx, tmp) in enumerate(lookupResult):
-					result.append((pNum, lookupIdx))
-
-		if self.plugin.getMaxParameters() == None:
-			addEntry(None)
+		pNumList = [None]
+		if self.plugin.getMaxParameters() != None:
+			pNumList = range(self.plugin.getMaxParameters())
+		pluginHash = self.plugin.getHash()
+		if (pNumChanged == None) or (pluginHash != self._pluginHash) or (len(pNumList) != len(self._lookupResults)):
+			(self._lookupResults, pNumChanged) = ({}, pNumList)
 		else:
-			for pNum in range(self.plugin.getMaxParameters()):
-				addEntry(pNum)
+			pNumChanged = sorted(filter(lambda pNum: pNum in self._lookupResults, pNumChanged))
+		self._pluginHash = pluginHash
+		if pNumChanged:
+			tmp = {ParameterInfo.ACTIVE: [True] * len(pNumChanged), ParameterInfo.REQS: map(lambda pNum: [], pNumChanged)}
+			self.plugin.fillParameterInfoList(pNumChanged, tmp)
+			self._lookupResults.update(zip(pNumChanged, self.matcher.lookupColumns(tmp, len(pNumChanged))))
+		for pNum in pNumList:
+			lookupResult = self._lookupResults[pNum]
+			if lookupResult:
+				for value in lookupResult:
+					result.append((pNum, value))
 		if len(result) == 0:
 			utils.vprint('Lookup parameter "%s" has no matching entries!' % self.key, -1)
 		return result
@@ -157,9 +247,15 @@ class SwitchingLookupParameterSource(SingleParameterSource):
 		if len(self.pSpace) == 0:
 			self.plugin.fillParameterInfo(pNum, result)
 			return
-		subNum, lookupIndex = self.pSpace[pNum]
+		subNum, value = self.pSpace[pNum]
 		self.plugin.fillParameterInfo(subNum, result)
-		result[self.key] = self.matcher.lookup(result)[lookupIndex]
+		result[self.key] = value
+
+	def fillParameterInfoList(self, pNumList, result):
+		if len(self.pSpace) == 0:
+			return self.plugin.fillParameterInfoList(pNumList, result)
+		self.plugin.fillParameterInfoList(map(lambda pNum: self.pSpace[pNum][0], pNumList), result)
+		result[self.key] = map(lambda pNum: self.pSpace[pNum][1], pNumList)
 
 	def fillParameterKeys(self, result):
 		result.append(self.meta)
@@ -169,9 +265,12 @@ class SwitchingLookupParameterSource(SingleParameterSource):
 		(result_redo, result_disable, result_sizeChange) = ParameterSource.resync(self)
 		if self.resyncEnabled():
 			(plugin_redo, plugin_disable, plugin_sizeChange) = self.plugin.resync()
-			self.pSpace = self.initPSpace()
+			if plugin_sizeChange:
+				self.pSpace = self.initPSpace()
+			else: # only the lookup results of changed plugin parameters are updated
+				self.pSpace = self.initPSpace(plugin_redo)
 			for pNum, pInfo in enumerate(self.pSpace):
-				subNum, lookupIndex = pInfo
+				subNum, value = pInfo
 				if subNum in plugin_redo:
 					result_redo.add(pNum)
 				if subNum in plugin_disable:
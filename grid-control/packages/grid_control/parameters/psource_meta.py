@@ -14,7 +14,16 @@
 
 from grid_control import QM
 from python_compat import md5
-from psource_base import ParameterSource, ParameterMetadata
+from psource_base import ParameterSource, ParameterMetadata, getColumnRows, setColumnRows
+
+# Fill column oriented parameter infos of the selected rows (with the given sub-plugin parameter numbers)
+def fillSelectedRows(plugin, rows, pNumList, result, size):
+	if len(rows) == size:
+		plugin.fillParameterInfoList(pNumList, result)
+	elif rows:
+		tmp = getColumnRows(result, rows)
+		plugin.fillParameterInfoList(pNumList, tmp)
+		setColumnRows(result, rows, tmp, size)
 
 def combineSyncResult(a, b, sc_fun = lambda x, y: x or y):
 	if a == None:
@@ -39,6 +48,9 @@ class ForwardingParameterSource(ParameterSource):
 	def fillParameterInfo(self, pNum, result):
 		self.plugin.fillParameterInfo(pNum, result)
 
+	def fillParameterInfoList(self, pNumList, result):
+		self.plugin.fillParameterInfoList(pNumList, result)
+
 	def resync(self):
 		return self.plugin.resync()
 
@@ -66,6 +78,9 @@ class RangeParameterSource(ForwardingParameterSource):
 	def fillParameterInfo(self, pNum, result):
 		self.plugin.fillParameterInfo(pNum + self.posStart, result)
 
+	def fillParameterInfoList(self, pNumList, result):
+		self.plugin.fillParameterInfoList(map(lambda pNum: pNum + self.posStart, pNumList), result)
+
 	def resync(self):
 		(result_redo, result_disable, result_sizeChange) = self.resyncCreate()
 		(plugin_redo, plugin_disable, plugin_sizeChange) = self.plugin.resync()
@@ -146,6 +161,14 @@ class BaseZipParameterSource(MultiParameterSource):
 			else:
 				plugin.fillParameterInfo(pNum, result)
 
+	def fillParameterInfoList(self, pNumList, result):
+		for (plugin, maxN) in zip(self.pluginList, self.pluginMaxList):
+			if maxN != None:
+				rows = filter(lambda row: pNumList[row] < maxN, range(len(pNumList)))
+				fillSelectedRows(plugin, rows, map(pNumList.__getitem__, rows), result, len(pNumList))
+			else:
+				plugin.fillParameterInfoList(pNumList, result)
+
 	def resync(self): # Quicker version than the general purpose implementation
 		result = self.resyncCreate()
 		for plugin in self.pluginList:
@@ -187,6 +210,11 @@ class ChainParameterSource(MultiParameterSource):
 				return plugin.fillParameterInfo(pNum - limit, result)
 			limit += maxN
 
+	def fillParameterInfoList(self, pNumList, result):
+		for (plugin, maxN, limit) in zip(self.pluginList, self.pluginMaxList, self.offsetList):
+			rows = filter(lambda row: (pNumList[row] >= limit) and (pNumList[row] < limit + maxN), range(len(pNumList)))
+			fillSelectedRows(plugin, rows, map(lambda row: pNumList[row] - limit, rows), result, len(pNumList))
+
 	def __repr__(self):
 		return 'chain(%s)' % str.join(', ', map(repr, self.pluginList))
 ParameterSource.managerMap['chain'] = ChainParameterSource
@@ -210,6 +238,9 @@ class RepeatParameterSource(ChainParameterSource):
 	def fillParameterInfo(self, pNum, result):
 		self.plugin.fillParameterInfo(pNum % self.maxN, result)
 
+	def fillParameterInfoList(self, pNumList, result):
+		self.plugin.fillParameterInfoList(map(lambda pNum: pNum % self.maxN, pNumList), result)
+
 	def show(self, level = 0):
 		ParameterSource.show(self, level, 'times = %d' % self.times)
 		self.plugin.show(level + 1)
@@ -245,6 +276,13 @@ class CrossParameterSource(MultiParameterSource):
 			else:
 				plugin.fillParameterInfo(pNum, result)
 
+	def fillParameterInfoList(self, pNumList, result):
+		for (plugin, maxN, prev) in self.quickFill:
+			if maxN:
+				plugin.fillParameterInfoList(map(lambda pNum: (pNum / prev) % maxN, pNumList), result)
+			else:
+				plugin.fillParameterInfoList(pNumList, result)
+
 	def __repr__(self):
 		return 'cross(%s)' % str.join(', ', map(repr, self.pluginList))
 ParameterSource.managerMap['cross'] = CrossParameterSource
@@ -16,6 +16,18 @@
 # grid-control: https://ekptrac.physik.uni-karlsruhe.de/trac/grid-control
 
 GC_SANDBOX="${GC_SANDBOX:-$1}"
+# Array jobs get a file with the sandbox of each array index
+if [ -f "$GC_SANDBOX" ]; then
+	GC_ARRAY_INDEX="${SGE_TASK_ID:-${PBS_ARRAYID:-${PBS_ARRAY_INDEX:-$LSB_JOBINDEX}}}"
+	GC_SANDBOX="$(sed -n "${GC_ARRAY_INDEX}p" "$GC_SANDBOX")"
+	[ ! -d "$GC_SANDBOX" ] && echo "Sandbox of array index $GC_ARRAY_INDEX not found" && exit 101
+	if [ -n "$GC_DELAY_OUTPUT" ]; then
+		GC_DELAY_OUTPUT="$GC_SANDBOX/gc.stdout"
+		GC_DELAY_ERROR="$GC_SANDBOX/gc.stderr"
+	else
+		exec > "$GC_SANDBOX/gc.stdout" 2> "$GC_SANDBOX/gc.stderr"
+	fi
+fi
 GC_JOBCONF="$GC_SANDBOX/_jobconfig.sh"
 source "$GC_JOBCONF"
 if [ ! -f "$GC_SANDBOX/job_${MY_JOBID}.var" ]; then
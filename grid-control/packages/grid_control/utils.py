@@ -88,25 +88,158 @@ def gcStartThread(desc, fun, *args, **kargs):
 	return thread
 
 
-def getThreadedGenerator(genList): # Combines multiple, threaded generators into single generator
-	(listThread, queue) = ([], Queue.Queue())
-	for (desc, gen) in genList:
-		def genThread():
+# Runs generators in threads and yields their items - the number of threads (in total and per group of
+# generators) and the number of buffered items are limited, so fast generators can't outrun the consumer
+class GeneratorExecutor(object):
+	def __init__(self, maxThreads = 0, maxGroupThreads = 0, maxQueue = 0, timeout = 0):
+		(self._maxThreads, self._maxGroupThreads) = (maxThreads, maxGroupThreads)
+		(self._maxQueue, self._timeout, self._active) = (maxQueue, timeout, [])
+
+	def cancel(self): # Generators of all running calls are stopped before their next item
+		for status in list(self._active):
+			status['cancel'] = True
+
+	def iterResults(self, genList): # genList = [(group, generator), ...]
+		(queue, pending, running, error) = (Queue.Queue(max(0, self._maxQueue)), list(genList), {}, None)
+		status = {'cancel': False, 'stop': False}
+		def put(item):
+			while not status['cancel']:
+				try:
+					return queue.put(item, True, 1)
+				except Queue.Full:
+					pass
+		def genThread(group, gen):
 			try:
-				for item in gen:
-					queue.put(item)
+				try: # after a timeout no new items are requested - items already produced are delivered
+					while not (status['cancel'] or status['stop']):
+						try:
+							item = gen.next()
+						except StopIteration:
+							break
+						put((True, item))
+				except:
+					put((False, sys.exc_info()))
 			finally:
-				queue.put(queue) # Use queue as end-of-generator marker
-		listThread.append(gcStartThread(desc, genThread))
-	while len(listThread):
-		tmp = queue.get(True)
-		if tmp == queue:
-			listThread.pop()
-		else:
-			yield tmp
+				put((None, group)) # end-of-generator marker
+		def cleanup(): # stop remaining threads - also if the consumer stops early (GeneratorExit)
+			status['cancel'] = True
+			self._active = filter(lambda x: x is not status, self._active)
+
+		(startTime, self._active) = (time.time(), self._active + [status])
+		try:
+			while (pending or running) and not status['cancel']:
+				if abort(): # running generators stop on their own after their running tasks
+					pending = []
+				for (group, gen) in list(pending):
+					if (self._maxThreads > 0) and (sum(running.values()) >= self._maxThreads):
+						break
+					if (self._maxGroupThreads > 0) and (running.get(group, 0) >= self._maxGroupThreads):
+						continue
+					pending.remove((group, gen))
+					running[group] = running.get(group, 0) + 1
+					gcStartThread('Generator %s' % group, genThread, group, gen)
+				if (self._timeout > 0) and (time.time() - startTime > self._timeout) and not status['stop']:
+					eprint('Timeout after %s while waiting for %s' % (strTime(self._timeout), str.join(', ', map(str, running))))
+					(status['stop'], pending) = (True, [])
+				try:
+					(itemType, item) = queue.get(True, 1) # timeout allows signal handlers to run
+				except Queue.Empty:
+					continue
+				if itemType == None:
+					running[item] -= 1
+					if not running[item]:
+						running.pop(item)
+				elif itemType:
+					yield item
+				elif not error: # running generators are finished before raising the first exception
+					(error, pending) = (item, [])
+		except: # (no try/finally around yield for older python versions)
+			excInfo = sys.exc_info()
+			cleanup()
+			raise excInfo[0], excInfo[1], excInfo[2]
+		cleanup()
+		if error:
+			raise error[0], error[1], error[2]
+
+
+def getThreadedGenerator(genList): # Combines multiple, threaded generators into single generator
+	return GeneratorExecutor().iterResults(genList)
+
+
+def getThreadedResults(taskIter, maxThreads, ordered = False): # Runs callables with up to maxThreads threads and yields results as they complete
+	(taskIter, taskLock, queue, status) = (iter(taskIter), threading.Lock(), Queue.Queue(), {'stop': False, 'idx': 0})
+	# Ordered results are yielded in the order of the tasks - up to 2 * maxThreads results are kept back
+	slots = threading.Semaphore(2 * max(1, maxThreads))
+	def getTask(): # tasks are requested one after another, so taskIter can be a normal generator
+		if ordered:
+			slots.acquire()
+		taskLock.acquire()
+		try:
+			if status['stop']:
+				return None
+			try:
+				status['idx'] += 1
+				return (status['idx'] - 1, taskIter.next())
+			except StopIteration:
+				status['stop'] = True
+		finally:
+			taskLock.release()
+	def workerThread():
+		try:
+			try:
+				task = getTask()
+				while task:
+					queue.put((True, (task[0], task[1]())))
+					task = getTask()
+			except:
+				status['stop'] = True
+				queue.put((False, sys.exc_info()))
+		finally:
+			queue.put(queue) # Use queue as end-of-worker marker
+	nThreads = max(1, maxThreads)
+	for idx in range(nThreads):
+		gcStartThread('Worker %d' % idx, workerThread)
+	def stopWorkers(nThreads): # stop handing out tasks and wait for running tasks
+		status['stop'] = True
+		for idx in range(nThreads):
+			slots.release()
+		while nThreads:
+			try:
+				if queue.get(True, 1) == queue:
+					nThreads -= 1
+			except Queue.Empty:
+				pass
+	(error, resultMap, nextIdx) = (None, {}, 0)
+	try:
+		while nThreads:
+			try:
+				tmp = queue.get(True, 1) # timeout allows signal handlers to run
+			except Queue.Empty:
+				continue
+			if tmp == queue:
+				nThreads -= 1
+				slots.release() # unblock remaining workers waiting for a slot
+			elif not tmp[0]:
+				error = error or tmp[1] # finish running tasks before raising the first exception
+			elif not ordered:
+				yield tmp[1][1]
+			else:
+				resultMap[tmp[1][0]] = tmp[1][1]
+				while (nextIdx in resultMap) and not error:
+					yield resultMap.pop(nextIdx)
+					nextIdx += 1
+					slots.release()
+	except: # also if the consumer stops early (GeneratorExit) - no try/finally around yield for older python versions
+		excInfo = sys.exc_info()
+		stopWorkers(nThreads)
+		raise excInfo[0], excInfo[1], excInfo[2]
+	if error:
+		raise error[0], error[1], error[2]
 
 
 class LoggedProcess(object):
+	logLock = threading.Lock()
+
 	def __init__(self, cmd, args = '', niceCmd = False, niceArgs = False):
 		self.niceCmd = QM(niceCmd, niceCmd, os.path.basename(cmd))
 		self.niceArgs = QM(niceArgs, niceArgs, args)
@@ -161,24 +294,28 @@ class LoggedProcess(object):
 		if not brief:
 			eprint('\n%s' % self.getError(), printTime=True)
 
+		LoggedProcess.logLock.acquire() # processes can be logged from several threads
 		try:
-			tar = tarfile.TarFile.open(target, 'a')
-			data = {'retCode': self.wait(), 'exec': self.cmd, 'args': self.args}
-			files = [VirtualFile(os.path.join(entry, 'info'), DictFormat().format(data))]
-			kwargs.update({'stdout': self.getOutput(), 'stderr': self.getError()})
-			for key, value in kwargs.items():
-				try:
-					content = open(value, 'r').readlines()
-				except:
-					content = [value]
-				files.append(VirtualFile(os.path.join(entry, key), content))
-			for fileObj in files:
-				info, handle = fileObj.getTarInfo()
-				tar.addfile(info, handle)
-				handle.close()
-			tar.close()
-		except:
-			raise RethrowError('Unable to log errors of external process "%s" to "%s"' % (self.niceCmd, target), RuntimeError)
+			try:
+				tar = tarfile.TarFile.open(target, 'a')
+				data = {'retCode': self.wait(), 'exec': self.cmd, 'args': self.args}
+				files = [VirtualFile(os.path.join(entry, 'info'), DictFormat().format(data))]
+				kwargs.update({'stdout': self.getOutput(), 'stderr': self.getError()})
+				for key, value in kwargs.items():
+					try:
+						content = open(value, 'r').readlines()
+					except:
+						content = [value]
+					files.append(VirtualFile(os.path.join(entry, key), content))
+				for fileObj in files:
+					info, handle = fileObj.getTarInfo()
+					tar.addfile(info, handle)
+					handle.close()
+				tar.close()
+			except:
+				raise RethrowError('Unable to log errors of external process "%s" to "%s"' % (self.niceCmd, target), RuntimeError)
+		finally:
+			LoggedProcess.logLock.release()
 		eprint('All logfiles were moved to %s' % target)
 
 
@@ -799,7 +936,8 @@ class ActivityLog:
 
 	def __init__(self, message):
 		self.saved = (sys.stdout, sys.stderr)
-		if sys.stdout.isatty():
+		# Output streams are only wrapped for activities of the main thread
+		if sys.stdout.isatty() and (threading.currentThread().getName() == 'MainThread'):
 			self.activity = self.Activity(sys.stdout, message)
 			sys.stdout = self.WrappedStream(sys.stdout, self.activity)
 			sys.stderr = self.WrappedStream(sys.stderr, self.activity)
@@ -12,6 +12,7 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
+import sys, time
 from grid_control.abstract import NamedObject, ClassFactory
 from grid_control.tasks import TaskModule
 from grid_control.monitoring import Monitoring
@@ -52,26 +53,35 @@ class Workflow(NamedObject):
 		global_config = config.clone()
 		self._actionList = global_config.getList('jobs', 'action', ['check', 'retrieve', 'submit'], onChange = None)
 		self.runContinuous = global_config.getBool('jobs', 'continuous', False, onChange = None)
+		# Run check, retrieve and submit at the same time
+		self._concurrent = global_config.getBool('jobs', 'concurrent actions', False, onChange = None)
 
 		self._checkSpace = config.getInt('workdir space', 10, onChange = None)
+		(self._lastSpaceMsg, self._resourcesOK) = (0, True)
 		self._submitFlag = config.getBool('submission', True, onChange = None)
 		guiClass = config.getClass('gui', 'SimpleConsole', cls = GUI, onChange = None)
 		self._gui = guiClass.getInstance(config, self)
 
 
+	# Check whether wms can submit and whether there is enough free disk space
+	def _checkResources(self):
+		if not self.wms.canSubmit(self.task.wallTime, self._submitFlag):
+			self._submitFlag = False
+		if (self._checkSpace > 0) and utils.freeSpace(self._workDir) < self._checkSpace:
+			if time.time() - self._lastSpaceMsg > 5 * 60:
+				utils.vprint('Not enough space left in working directory', -1, True)
+				self._lastSpaceMsg = time.time()
+			return False
+		return True
+
+
 	# Job submission loop
 	def jobCycle(self, wait = utils.wait):
+		if self._concurrent:
+			return self._jobCycleConcurrent(wait)
 		while True:
-			(didWait, lastSpaceMsg) = (False, 0)
-			# Check whether wms can submit
-			if not self.wms.canSubmit(self.task.wallTime, self._submitFlag):
-				self._submitFlag = False
-			# Check free disk space
-			if (self._checkSpace > 0) and utils.freeSpace(self._workDir) < self._checkSpace:
-				if time.time() - lastSpaceMsg > 5 * 60:
-					utils.vprint('Not enough space left in working directory', -1, True)
-					lastSpaceMsg = time.time()
-			else:
+			didWait = False
+			if self._checkResources():
 				for action in map(str.lower, self._actionList):
 					if action.startswith('c') and not utils.abort():   # check for jobs
 						if self.jobManager.check(self.wms):
@@ -90,6 +100,48 @@ class Workflow(NamedObject):
 			if not didWait:
 				wait(self.wms.getTimings()[0])
 
+
+	# Concurrent job cycle - check, retrieve and submit run in their own threads
+	# Resources are checked by the calling thread, which also waits for the action threads
+	def _jobCycleConcurrent(self, wait):
+		(threadList, errorList) = ([], [])
+		self._resourcesOK = self._checkResources()
+		for action in map(str.lower, self._actionList):
+			threadList.append(utils.gcStartThread('Job cycle: %s' % action, self._actionCycle, action, errorList))
+		while filter(lambda thread: thread.isAlive(), threadList):
+			if self.runContinuous and not utils.abort():
+				wait(self.wms.getTimings()[1])
+				self._resourcesOK = self._checkResources()
+			else:
+				map(lambda thread: thread.join(1), threadList)
+		if errorList:
+			raise errorList[0][0], errorList[0][1], errorList[0][2]
+
+
+	def _actionCycle(self, action, errorList):
+		def sleep(timeout): # returns False if the waiting was interrupted by abort
+			for x in range(timeout):
+				if utils.abort():
+					return False
+				time.sleep(1)
+			return True
+		actionMap = {'c': self.jobManager.check, 'r': self.jobManager.retrieve, 's': self.jobManager.submit}
+		try:
+			while not utils.abort():
+				didWait = False
+				if self._resourcesOK and (action[:1] in actionMap) and (self._submitFlag or not action.startswith('s')):
+					if actionMap[action[:1]](self.wms):
+						didWait = sleep(self.wms.getTimings()[1])
+				if not self.runContinuous:
+					break
+				if not didWait:
+					sleep(self.wms.getTimings()[0])
+		except:
+			errorList.append(sys.exc_info())
+			utils.abort(True)
+
+
 	def run(self):
 		self._gui.displayWorkflow()
+		self.jobManager.jobDB.close()
 Workflow.registerObject(tagName = 'workflow')
@@ -12,6 +12,8 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
+import sys, bisect
+
 def makeint(x):
 	if x.strip().upper() not in ['', 'MAX', 'MIN']:
 		return int(x)
@@ -98,7 +100,45 @@ def parseLumiFilter(lumiexpr):
 				lumis.append(parseLumiFromString(token[0]))
 			except:
 				raise grid_control.ConfigError('Could not process lumi filter expression:\n%s' % token[0])
-	return mergeLumi(lumis)
+	return LumiFilter(mergeLumi(lumis))
+
+
+class LumiFilter(list):
+	""" List of lumi filter ranges with a lookup structure compiled on construction:
+	The ranges are mapped to sorted, disjoint (run, lumi) intervals which are searched by bisection.
+	Ranges with open run but fixed lumi section apply to every run and are checked separately
+	>>> lumifilter = LumiFilter([([1, 3], [5, 12]), ([7, None], [7, None]), ([None, 5], [None, 6])])
+	>>> map(lumifilter.select, [(1, 2), (2, 1), (5, 13), (7, 100), (9, 5), (9, 7)])
+	[False, True, False, True, True, False]
+	>>> map(LumiFilter([([1, None], [None, None])]).select, [(0, 5), (1, 1), (9999, 9999)])
+	[False, True, True]
+	"""
+	def __init__(self, lumifilter = []):
+		list.__init__(self, lumifilter)
+		default = lambda x, d: (x, d)[x == None]
+		(intervals, self._irregular) = ([], [])
+		for (start, end) in self:
+			if ((start[0] == None) and (start[1] != None)) or ((end[0] == None) and (end[1] != None)):
+				self._irregular.append((start, end))
+			else:
+				intervals.append(((default(start[0], -1), default(start[1], -1)),
+					(default(end[0], sys.maxint), default(end[1], sys.maxint))))
+		intervals.sort()
+		(self._starts, self._ends) = ([], [])
+		for (start, end) in intervals:
+			if self._ends and (start <= self._ends[-1]): # overlapping intervals
+				self._ends[-1] = max(self._ends[-1], end)
+			else:
+				self._starts.append(start)
+				self._ends.append(end)
+
+
+	def select(self, run_lumi):
+		run_lumi = tuple(run_lumi)
+		idx = bisect.bisect_right(self._starts, run_lumi) - 1
+		if (idx >= 0) and (run_lumi <= self._ends[idx]):
+			return True
+		return (len(self._irregular) > 0) and selectLumi(run_lumi, self._irregular)
 
 
 def filterLumiFilter(runs, lumifilter):
@@ -126,7 +166,11 @@ def selectLumi(run_lumi, lumifilter):
 	True
 	>>> selectLumi((9,2), [([3, 23], [None, None])])
 	True
+	>>> selectLumi((2,1), LumiFilter([([1, 3], [5, 12])]))
+	True
 	"""
+	if isinstance(lumifilter, LumiFilter): # compiled lookup
+		return lumifilter.select(run_lumi)
 	(run, lumi) = run_lumi
 	for (sel_start, sel_end) in lumifilter:
 		(sel_start_run, sel_start_lumi) = sel_start
@@ -37,6 +37,14 @@ class CMSProvider(DataProvider):
 		self.includeLumi = config.getBool('keep lumi metadata', False)
 		self.onlyValid = config.getBool('only valid', True)
 		self.checkUnique = config.getBool('check unique', True)
+		# Number of blocks queried concurrently, number of retries of failed queries and the
+		# maximum number of concurrent connections to each webservice endpoint
+		self.queryThreads = config.getInt('query threads', 8, onChange = None)
+		self.queryRetries = config.getInt('query retries', 2, onChange = None)
+		self.endpointLimiter = EndpointLimiter(config.getInt('webservice connections', 4, onChange = None))
+		self.phedexURL = config.get('phedex url', 'https://cmsweb.cern.ch/phedex/datasvc/json/prod/blockreplicas', onChange = None)
+		# Webservice responses are cached in the work directory - they are revalidated via ETag after the ttl
+		self.responseCache = ResponseCache(config.getWorkPath('webcache'), config.getTime('webservice cache ttl', 0, onChange = None))
 
 		# This works in tandem with active task module (cmssy.py supports only [section] lumi filter!)
 		self.selectedLumis = parseLumiFilter(config.get('lumi filter', ''))
@@ -66,7 +74,7 @@ class CMSProvider(DataProvider):
 	def lumiFilter(self, lumilist, runkey, lumikey):
 		if self.selectedLumis:
 			for lumi in lumilist:
-				if selectLumi((lumi[runkey], lumi[lumikey]), self.selectedLumis):
+				if self.selectedLumis.select((lumi[runkey], lumi[lumikey])):
 					return True
 		return self.selectedLumis == None
 
@@ -89,8 +97,20 @@ class CMSProvider(DataProvider):
 	# Get dataset se list from PhEDex (perhaps concurrent with listFiles)
 	def getPhedexSEList(self, blockPath, dictSE):
 		dictSE[blockPath] = []
-		url = 'https://cmsweb.cern.ch/phedex/datasvc/json/prod/blockreplicas'
-		for phedexBlock in readJSON(url, {'block': blockPath})['phedex']['block']:
+		self._readPhedexReplicas({'block': blockPath}, dictSE, blockPath)
+
+
+	# Get the se lists of all blocks of a dataset with a single PhEDEx query - returns {blockPath: seList}
+	def getPhedexDatasetSEList(self, datasetPath):
+		dictSE = {}
+		self._readPhedexReplicas({'dataset': datasetPath}, dictSE)
+		return dictSE
+
+
+	def _readPhedexReplicas(self, query, dictSE, blockPath = None):
+		for phedexBlock in readJSON(self.phedexURL, query, retries = self.queryRetries,
+				limiter = self.endpointLimiter, cache = self.responseCache)['phedex']['block']:
+			seList = dictSE.setdefault(QM(blockPath, blockPath, phedexBlock.get('name')), [])
 			for replica in phedexBlock['replica']:
 				if self.nodeFilter(replica['node'], replica['complete'] == 'y'):
 					location = None
@@ -101,10 +121,10 @@ class CMSProvider(DataProvider):
 					elif self.locationFormat == 'both' and (replica.get('node') or replica.get('se')):
 						location = '%s/%s' % (replica.get('node'), replica.get('se'))
 					if location:
-						dictSE[blockPath].append(location)
+						seList.append(location)
 					else:
 						utils.vprint('Warning: Dataset block %s replica at %s / %s is skipped!' %
-							(blockPath, replica.get('node'), replica.get('se')) , -1)
+							(phedexBlock.get('name', blockPath), replica.get('node'), replica.get('se')) , -1)
 
 
 	def getCMSDatasets(self):
@@ -125,6 +145,28 @@ class CMSProvider(DataProvider):
 		return result # List of (blockname, selist) tuples
 
 
+	# Returns {blockPath: fingerprint} based on the block summary of the dataset (None: not supported)
+	def getCMSBlockFingerprints(self, datasetPath):
+		fingerprints = self.getCMSBlockFingerprintsImpl(datasetPath)
+		if fingerprints != None:
+			return dict(filter(lambda (blockPath, fingerprint): self.blockFilter(blockPath), fingerprints))
+
+
+	def getCMSBlockFingerprintsImpl(self, datasetPath):
+		return None
+
+
+	def getFingerprints(self):
+		result = {}
+		for datasetPath in self.getCMSDatasets():
+			fingerprints = self.getCMSBlockFingerprints(datasetPath)
+			if fingerprints == None:
+				return None
+			for (blockPath, fingerprint) in fingerprints.items():
+				result[tuple(blockPath.split('#', 1))] = fingerprint
+		return result
+
+
 	def getCMSFiles(self, blockPath):
 		lumiDict = {}
 		if self.selectedLumis: # Central lumi query
@@ -137,7 +179,7 @@ class CMSProvider(DataProvider):
 				def acceptLumi():
 					for (run, lumiList) in listLumi:
 						for lumi in lumiList:
-							if selectLumi((run, lumi), self.selectedLumis):
+							if self.selectedLumis.select((run, lumi)):
 								return True
 				if not acceptLumi():
 					continue
@@ -157,54 +199,72 @@ class CMSProvider(DataProvider):
 		return None
 
 
+	def getGCBlock(self, blockPath, listSE, fingerprint, usePhedex):
+		result = {}
+		result[DataProvider.Dataset] = blockPath.split('#')[0]
+		result[DataProvider.BlockName] = blockPath.split('#')[1]
+		result[DataProvider.ResyncInfo] = fingerprint
+
+		if usePhedex: # Start parallel phedex query
+			dictSE = {}
+			tPhedex = utils.gcStartThread("Query phedex site info for %s" % blockPath, self.getPhedexSEList, blockPath, dictSE)
+
+		if self.selectedLumis:
+			result[DataProvider.Metadata] = ['Runs']
+			if self.includeLumi:
+				result[DataProvider.Metadata].append('Lumi')
+		result[DataProvider.FileList] = list(self.getCMSFiles(blockPath))
+		if self.checkUnique:
+			uniqueURLs = set(map(lambda x: x[DataProvider.URL], result[DataProvider.FileList]))
+			if len(result[DataProvider.FileList]) != len(uniqueURLs):
+				utils.vprint('Warning: The webservice returned %d duplicated files in dataset block %s! Continuing with unique files...' %
+					(len(result[DataProvider.FileList]) - len(uniqueURLs), blockPath), -1)
+			uniqueFIs = []
+			for fi in result[DataProvider.FileList]:
+				if fi[DataProvider.URL] in uniqueURLs:
+					uniqueURLs.remove(fi[DataProvider.URL])
+					uniqueFIs.append(fi)
+			result[DataProvider.FileList] = uniqueFIs
+
+		if usePhedex:
+			tPhedex.join()
+			listSE = dictSE.get(blockPath)
+		result[DataProvider.Locations] = listSE
+		return result
+
+
+	# The file lists (and site infos) of the blocks are queried concurrently - blocks are returned in order
 	def getGCBlocks(self, usePhedex):
 		blockCache = []
 		for datasetPath in self.getCMSDatasets():
 			counter = 0
-			for (blockPath, listSE) in self.getCMSBlocks(datasetPath, getSites = not usePhedex):
-				if blockPath in blockCache:
-					raise DatasetError('CMS source provided duplicate blocks! %s' % blockPath)
-				blockCache.append(blockPath)
-				result = {}
-				result[DataProvider.Dataset] = blockPath.split('#')[0]
-				result[DataProvider.BlockName] = blockPath.split('#')[1]
-
-				if usePhedex: # Start parallel phedex query
-					dictSE = {}
-					tPhedex = utils.gcStartThread("Query phedex site info for %s" % blockPath, self.getPhedexSEList, blockPath, dictSE)
-
-				if self.selectedLumis:
-					result[DataProvider.Metadata] = ['Runs']
-					if self.includeLumi:
-						result[DataProvider.Metadata].append('Lumi')
-				result[DataProvider.FileList] = list(self.getCMSFiles(blockPath))
-				if self.checkUnique:
-					uniqueURLs = set(map(lambda x: x[DataProvider.URL], result[DataProvider.FileList]))
-					if len(result[DataProvider.FileList]) != len(uniqueURLs):
-						utils.vprint('Warning: The webservice returned %d duplicated files in dataset block %s! Continuing with unique files...' %
-							(len(result[DataProvider.FileList]) - len(uniqueURLs)), -1)
-					uniqueFIs = []
-					for fi in result[DataProvider.FileList]:
-						if fi[DataProvider.URL] in uniqueURLs:
-							uniqueURLs.remove(fi[DataProvider.URL])
-							uniqueFIs.append(fi)
-					result[DataProvider.FileList] = uniqueFIs
-
-				if usePhedex:
-					tPhedex.join()
-					listSE = dictSE.get(blockPath)
-				result[DataProvider.Locations] = listSE
-
+			fingerprints = self.getCMSBlockFingerprints(datasetPath) or {}
+			def getBlockQueries():
+				for (blockPath, listSE) in self.getCMSBlocks(datasetPath, getSites = not usePhedex):
+					if blockPath in blockCache:
+						raise DatasetError('CMS source provided duplicate blocks! %s' % blockPath)
+					blockCache.append(blockPath)
+					if (self._blockSelection != None) and (tuple(blockPath.split('#', 1)) not in self._blockSelection):
+						continue # Only changed blocks are retrieved during incremental refresh
+					yield self._getBlockQuery(blockPath, listSE, fingerprints.get(blockPath), usePhedex)
+
+			for result in utils.getThreadedResults(getBlockQueries(), self.queryThreads, ordered = True):
 				if len(result[DataProvider.FileList]):
 					counter += 1
 					yield result
 
-			if (counter == 0) and self.selectedLumis:
+			if self._blockSelection != None:
+				continue
+			elif (counter == 0) and self.selectedLumis:
 				raise DatasetError('Dataset %s does not contain the requested run/lumi sections!' % datasetPath)
 			elif counter == 0:
 				raise DatasetError('Dataset %s does not contain any valid blocks!' % datasetPath)
 
 
+	def _getBlockQuery(self, blockPath, listSE, fingerprint, usePhedex):
+		return lambda: self.getGCBlock(blockPath, listSE, fingerprint, usePhedex)
+
+
 class DBS2Provider(CMSProvider):
 	def __init__(self, config, datasetExpr, datasetNick, datasetID = 0):
 		raise DatasetError('CMS deprecated all DBS2 Services in April 2014! Please use DBS3Provider instead.')
@@ -28,7 +28,7 @@ class DASProvider(CMSProvider):
 	def queryDAS(self, query):
 		(start, sleep) = (time.time(), 0.4)
 		while time.time() - start < 60:
-			tmp = readURL(self.url, {"input": query}, {"Accept": "application/json"})
+			tmp = readURL(self.url, {"input": query}, {"Accept": "application/json"}, limiter = self.endpointLimiter)
 			if len(tmp) != 32:
 				return parseJSON(tmp)['data']
 			time.sleep(sleep)
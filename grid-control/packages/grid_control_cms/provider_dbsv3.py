@@ -12,26 +12,32 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
-from grid_control import QM, utils, UserError, DatasetError, RethrowError, datasets
+from grid_control import QM, utils, UserError, ConfigError, DatasetError, RethrowError, datasets
 from grid_control.datasets import DataProvider
 from provider_cms import CMSProvider
 from webservice_api import *
+from python_compat import sorted
 import os
 
 # required format: <dataset path>[@<instance>][#<block>]
 class DBS3Provider(CMSProvider):
 	def __init__(self, config, datasetExpr, datasetNick, datasetID = 0):
 		CMSProvider.__init__(self, config, datasetExpr, datasetNick, datasetID)
-		if self.url != '':
-			raise ConfigError('Other DBS instances are not yet supported!')
-		self.url = 'https://cmsweb.cern.ch/dbs/prod/global/DBSReader'
+		if self.url == '':
+			self.url = 'https://cmsweb.cern.ch/dbs/prod/global/DBSReader'
+		elif not (self.url.startswith('http://') or self.url.startswith('https://')):
+			raise ConfigError('Other DBS instances are not yet supported!') # Only full URLs of DBS readers
 
 
 	def queryDBSv3(self, api, **params):
+		if not self.url.startswith('https://'): # eg. local DBS reader
+			return readJSON(self.url + '/%s' % api, params, retries = self.queryRetries,
+				limiter = self.endpointLimiter, cache = self.responseCache)
 		proxyPath = os.environ.get('X509_USER_PROXY', '')
 		if not os.path.exists(proxyPath):
 			raise UserError('VOMS proxy needed to query DBS3! Environment variable X509_USER_PROXY is "%s"' % proxyPath)
-		return readJSON(self.url + '/%s' % api, params, cert = os.environ['X509_USER_PROXY'])
+		return readJSON(self.url + '/%s' % api, params, cert = os.environ['X509_USER_PROXY'],
+			retries = self.queryRetries, limiter = self.endpointLimiter, cache = self.responseCache)
 
 
 	def getCMSDatasetsImpl(self, datasetPath):
@@ -44,6 +50,13 @@ class DBS3Provider(CMSProvider):
 		return map(lambda b: (b['block_name'], None), self.queryDBSv3('blocks', dataset = datasetPath))
 
 
+	# Replica moves don't change the block summary - the (sorted) block locations are part of the fingerprint
+	def getCMSBlockFingerprintsImpl(self, datasetPath):
+		dictSE = self.getPhedexDatasetSEList(datasetPath)
+		return map(lambda b: (b['block_name'], (b['file_count'], b['block_size'], b['last_modification_date'],
+			sorted(dictSE.get(b['block_name'], [])))), self.queryDBSv3('blocks', dataset = datasetPath, detail = True))
+
+
 	def getCMSFilesImpl(self, blockPath, onlyValid, queryLumi):
 		for fi in self.queryDBSv3('files', block_name = blockPath, detail = True):
 			if onlyValid and (fi['is_file_valid'] != 1):
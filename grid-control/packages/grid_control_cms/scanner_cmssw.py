@@ -15,39 +15,57 @@
 import os, re, tarfile, operator, xml.dom.minidom
 from grid_control import QM, RethrowError
 from grid_control.datasets import InfoScanner
+from python_compat import md5
 
 class ObjectsFromCMSSW(InfoScanner):
+	parallel = True
+
 	def __init__(self, config):
 		self.importParents = config.getBool('include parent infos', False)
 		self.mergeConfigs = config.getBool('merge config infos', True)
-		self.cfgStore = {}
-
-	def getEntries(self, path, metadata, events, seList, objStore):
+		(self.cfgStore, self.cfgContents) = ({}, {})
+
+	# Config contents are only stored once per content hash - in memory and in the scan cache
+	def shareConfig(self, cfgContent):
+		key = md5(cfgContent).hexdigest()
+		self.cfgContents.setdefault(key, cfgContent)
+		if self._cache:
+			self._cache.share(key, cfgContent)
+		return key
+
+	def getConfig(self, key):
+		if (key not in self.cfgContents) and self._cache:
+			cfgContent = self._cache.getShared(key)
+			if cfgContent != None:
+				self.cfgContents.setdefault(key, cfgContent)
+		return self.cfgContents.get(key)
+
+	# Returns config hashes, config and file infos of a job - the results are cached for unchanged archives
+	# Config contents are replaced by their content hash in the returned infos
+	def readJobInfos(self, tarPath, jobNum):
 		def readTag(base, tag, default = None):
 			try:
 				return str(base.getElementsByTagName(tag)[0].childNodes[0].data)
 			except:
 				return default
 
-		jobNum = metadata['GC_JOBNUM']
-		tar = tarfile.open(os.path.join(path, 'cmssw.dbs.tar.gz'), 'r')
+		tar = tarfile.open(tarPath, 'r')
 		try:
 			tmpFiles = {}
 			for rawdata in map(str.split, tar.extractfile('files').readlines()):
 				tmpFiles[rawdata[2]] = {'SE_OUTPUT_HASH_CRC32': rawdata[0], 'SE_OUTPUT_SIZE': int(rawdata[1])}
-			objStore['CMSSW_FILES'] = tmpFiles
 		except:
 			raise RethrowError('Could not read CMSSW file infos for job %d!' % jobNum)
 
-		tmpCfg = {}
+		(cfgHashes, tmpCfg, cfgContentKeys) = ([], {}, {})
 		cmsswVersion = tar.extractfile('version').read().strip()
 		for cfg in filter(lambda x: not '/' in x and x not in ['version', 'files'], tar.getnames()):
 			try:
 				cfgContent = tar.extractfile('%s/config' % cfg).read()
 				cfgHash = tar.extractfile('%s/hash' % cfg).readlines()[-1].strip()
-				metadata.setdefault('CMSSW_CONFIG_JOBHASH', []).append(cfgHash)
+				cfgHashes.append(cfgHash)
 				tmpCfg[cfg] = {'CMSSW_CONFIG_FILE': cfg, 'CMSSW_CONFIG_HASH': cfgHash, 'CMSSW_VERSION': cmsswVersion}
-				tmpCfg[cfg]['CMSSW_CONFIG_CONTENT'] = self.cfgStore.setdefault(QM(self.mergeConfigs, cfgHash, cfg), cfgContent)
+				cfgContentKeys[cfg] = self.shareConfig(cfgContent)
 				# Get annotation from config content
 				def searchConfigFile(key, regex, default):
 					try:
@@ -84,8 +102,23 @@ class ObjectsFromCMSSW(InfoScanner):
 				tmpOut['CMSSW_LUMIS'] = lumis
 
 				tmpFiles.setdefault(readTag(outputFile, 'PFN'), {}).update(tmpOut)
-		objStore.update({'CMSSW_CONFIG': tmpCfg, 'CMSSW_FILES': tmpFiles})
 		tar.close()
+		return (cfgHashes, tmpCfg, tmpFiles, cfgContentKeys)
+
+	def getEntries(self, path, metadata, events, seList, objStore):
+		(jobNum, tarPath) = (metadata['GC_JOBNUM'], os.path.join(path, 'cmssw.dbs.tar.gz'))
+		readInfos = lambda: self.readJobInfos(tarPath, jobNum)
+		(cfgHashes, tmpCfg, tmpFiles, cfgContentKeys) = self.cached(tarPath, self.importParents, readInfos)
+		if None in map(self.getConfig, cfgContentKeys.values()): # config contents missing in the cache
+			(cfgHashes, tmpCfg, tmpFiles, cfgContentKeys) = readInfos()
+		if cfgHashes:
+			metadata.setdefault('CMSSW_CONFIG_JOBHASH', []).extend(cfgHashes)
+		cfgInfos = {}
+		for cfg in tmpCfg: # cached infos are copied - identical config contents are shared between jobs
+			cfgKey = QM(self.mergeConfigs, tmpCfg[cfg]['CMSSW_CONFIG_HASH'], cfg)
+			cfgInfos[cfg] = dict(tmpCfg[cfg])
+			cfgInfos[cfg]['CMSSW_CONFIG_CONTENT'] = self.cfgStore.setdefault(cfgKey, self.getConfig(cfgContentKeys[cfg]))
+		objStore.update({'CMSSW_CONFIG': cfgInfos, 'CMSSW_FILES': tmpFiles})
 		yield (path, metadata, events, seList, objStore)
 
 
@@ -12,46 +12,326 @@
 #-#  See the License for the specific language governing permissions and
 #-#  limitations under the License.
 
+import os, sys, time, threading
+from python_compat import md5, sorted
+
 # Helper to access CMS webservices (SiteDB, Phedex)
 
-def removeUnicode(obj):
-	if type(obj) in (list, tuple, set):
-		(obj, oldType) = (list(obj), type(obj))
-		for i, v in enumerate(obj):
-			obj[i] = removeUnicode(v)
-		obj = oldType(obj)
-	elif isinstance(obj, dict):
-		result = {}
-		for k, v in obj.iteritems():
-			result[removeUnicode(k)] = removeUnicode(v)
-		return result
-	elif isinstance(obj, unicode):
-		return str(obj)
-	return obj
-
-def readURL(url, params = None, headers = {}, cert = None):
-	import urllib, urllib2, httplib
+# Limit the number of concurrent requests to each webservice endpoint (scheme, host and first path element)
+# Each user (eg. dataset provider) can have its own limiter - requests without limiter use the default one
+def getEndpoint(url):
+	return str.join('/', url.split('/')[:4])
+
+class EndpointLimiter(object):
+	def __init__(self, limit):
+		(self._limit, self._semaphores, self._lock) = (max(1, limit), {}, threading.Lock())
+
+	def getSemaphore(self, url):
+		self._lock.acquire()
+		try:
+			endpoint = getEndpoint(url)
+			if endpoint not in self._semaphores:
+				self._semaphores[endpoint] = threading.Semaphore(self._limit)
+			return self._semaphores[endpoint]
+		finally:
+			self._lock.release()
+
+defaultLimiter = EndpointLimiter(4)
+
+# Keep-alive connections are pooled per (scheme, host, certificate) and reused by subsequent requests
+(connectionPool, connectionLock) = ({}, threading.Lock())
+
+def getConnection(scheme, host, cert):
+	connectionLock.acquire()
+	try:
+		idle = connectionPool.get((scheme, host, cert), [])
+		if idle:
+			return (idle.pop(), True)
+	finally:
+		connectionLock.release()
+	import httplib
+	if scheme == 'https':
+		return (httplib.HTTPSConnection(host, key_file = cert, cert_file = cert), False)
+	return (httplib.HTTPConnection(host), False)
+
+def releaseConnection(scheme, host, cert, conn):
+	connectionLock.acquire()
+	try:
+		connectionPool.setdefault((scheme, host, cert), []).append(conn)
+	finally:
+		connectionLock.release()
+
+# Requests via proxy servers (configured by the http_proxy / https_proxy / no_proxy environment variables)
+# are done with urllib2 - the returned response object provides the used parts of the httplib interface
+def useProxy(scheme, host):
+	import urllib
+	return (scheme in urllib.getproxies()) and not urllib.proxy_bypass(host)
+
+class ProxyResponse(object):
+	def __init__(self, response):
+		(self.status, self.reason, self.msg) = (response.code, getattr(response, 'msg', ''), response.info())
+		self.will_close = True
+
+	def getheader(self, name, default = None):
+		return self.msg.getheader(name, default)
+
+def requestProxyURL(url, headers, cert):
+	import urllib2, httplib
 	class HTTPSClientAuthHandler(urllib2.HTTPSHandler):
-		def __init__(self, key, cert):
-			urllib2.HTTPSHandler.__init__(self)
-			(self.key, self.cert) = (key, cert)
 		def https_open(self, req):
 			return self.do_open(self.getConnection, req)
 		def getConnection(self, host, timeout = None):
-			return httplib.HTTPSConnection(host, key_file=self.key, cert_file=self.cert)
-
+			return httplib.HTTPSConnection(host, key_file = cert, cert_file = cert)
+	handlers = []
 	if cert:
-		cert_handler = HTTPSClientAuthHandler(cert, cert)
-		opener = urllib2.build_opener(cert_handler)
-		urllib2.install_opener(opener)
+		handlers.append(HTTPSClientAuthHandler())
+	try:
+		response = urllib2.build_opener(*handlers).open(urllib2.Request(url, None, headers))
+	except urllib2.HTTPError, error: # error responses (and 304) are processed by the caller
+		response = error
+	return (response.code, ProxyResponse(response), response.read())
+
+# Returns (status, response headers, data) - connections closed by the server are retried once
+def requestURL(url, headers, cert):
+	import urlparse
+	(scheme, host, path, query, fragment) = urlparse.urlsplit(url)
+	if useProxy(scheme, host):
+		return requestProxyURL(url, headers, cert)
+	if query:
+		path += '?' + query
+	while True:
+		(conn, reused) = getConnection(scheme, host, cert)
+		try:
+			conn.request('GET', path or '/', None, headers)
+			response = conn.getresponse()
+			data = response.read()
+		except Exception:
+			conn.close()
+			if reused: # stale keep-alive connection
+				continue
+			raise
+		if response.will_close:
+			conn.close()
+		else:
+			releaseConnection(scheme, host, cert, conn)
+		return (response.status, response, data)
+
+# On-disk cache of webservice responses - each user (eg. dataset provider) can have its own cache
+# Entries are used for <ttl> seconds (or max-age given by the server) and revalidated afterwards via ETag
+class ResponseCache(object):
+	def __init__(self, path, ttl = 0):
+		(self._path, self._ttl) = (path, ttl)
+
+	def getCacheFile(self, url, headers, cert):
+		import marshal
+		if self._path and os.path.exists(os.path.dirname(self._path)):
+			key = marshal.dumps((url, sorted(headers.items()), cert))
+			return os.path.join(self._path, md5(key).hexdigest())
 
+	def read(self, fn):
+		import marshal
+		try:
+			return marshal.loads(open(fn, 'rb').read()) # (expiry time, etag, data)
+		except Exception:
+			return None
+
+	def write(self, fn, response, data):
+		import marshal, re
+		cacheControl = response.getheader('cache-control', '').lower()
+		if ('no-store' in cacheControl) or ('no-cache' in cacheControl):
+			return
+		ttl = self._ttl
+		maxAge = re.search('max-age=(\d+)', cacheControl)
+		if maxAge:
+			ttl = int(maxAge.group(1))
+		try:
+			if not os.path.exists(self._path):
+				os.mkdir(self._path)
+			fp = open(fn + '.tmp%d' % os.getpid(), 'wb')
+			fp.write(marshal.dumps((time.time() + ttl, response.getheader('etag'), data)))
+			fp.close()
+			os.rename(fp.name, fn)
+		except Exception:
+			pass # cache is optional
+
+def readURL(url, params = None, headers = {}, cert = None, cache = None, limiter = None):
+	import urllib, urllib2
 	if params:
 		url += '?%s' % urllib.urlencode(params)
-	return urllib2.urlopen(urllib2.Request(url, None, headers)).read()
+	(cacheFile, cached) = (None, None)
+	if cache:
+		cacheFile = cache.getCacheFile(url, headers, cert)
+	if cacheFile:
+		cached = cache.read(cacheFile)
+		if cached and (cached[0] > time.time()):
+			return cached[2]
+
+	reqHeaders = dict(headers)
+	if cached and cached[1]:
+		reqHeaders['If-None-Match'] = cached[1]
+	semaphore = (limiter or defaultLimiter).getSemaphore(url)
+	semaphore.acquire()
+	try:
+		for redirect in range(5):
+			(status, response, data) = requestURL(url, reqHeaders, cert)
+			if (status not in [301, 302, 303, 307]) or not response.getheader('location'):
+				break
+			url = urllib.basejoin(url, response.getheader('location'))
+	finally:
+		semaphore.release()
+
+	if (status == 304) and cached:
+		data = cached[2]
+	elif status >= 400:
+		raise urllib2.HTTPError(url, status, response.reason, response.msg, None)
+	if cacheFile:
+		cache.write(cacheFile, response, data)
+	return data
 
+# Dictionaries are already converted by removeUnicodeItems - only strings and lists are processed
+def removeUnicodeList(obj):
+	result = []
+	for value in obj:
+		if isinstance(value, unicode):
+			value = str(value)
+		elif isinstance(value, list):
+			value = removeUnicodeList(value)
+		result.append(value)
+	return result
+
+def removeUnicodeItems(obj):
+	result = {}
+	for (key, value) in obj.iteritems():
+		if isinstance(value, unicode):
+			value = str(value)
+		elif isinstance(value, list):
+			value = removeUnicodeList(value)
+		result[str(key)] = value
+	return result
+
+# Dictionaries are converted during decoding - the single quote replacement is only tried for invalid JSON
 def parseJSON(data):
 	import json
-	return removeUnicode(json.loads(data.replace('\'', '"')))
+	try:
+		result = json.loads(data, object_hook = removeUnicodeItems)
+	except ValueError:
+		result = json.loads(data.replace('\'', '"'), object_hook = removeUnicodeItems)
+	if isinstance(result, list):
+		return removeUnicodeList(result)
+	elif isinstance(result, unicode):
+		return str(result)
+	return result
+
+# Failed queries are retried (with increasing delay) - except for client errors (HTTP status 4xx)
+def readJSON(url, params = None, headers = {}, cert = None, retries = 0, retryDelay = 1, limiter = None, cache = None):
+	attempt = 0
+	while True:
+		try:
+			return parseJSON(readURL(url, params, headers, cert, cache = cache, limiter = limiter))
+		except Exception:
+			if (attempt >= retries) or (getattr(sys.exc_info()[1], 'code', 500) < 500):
+				raise
+		attempt += 1
+		time.sleep(retryDelay * attempt)
+
+
+if __name__ == '__main__':
+	import doctest, tempfile, shutil, BaseHTTPServer, SocketServer
+
+	# Local HTTP stand-in for webservices - responses = {path: [(status, data[, etag]), ...]}
+	# The responses of a path are returned in order (the last one is repeated)
+	def startStandIn(responses, delay = 0):
+		stats = {'hits': {}, 'active': 0, 'maxActive': 0, 'notModified': 0}
+		statsLock = threading.Lock()
+		class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1' # keep-alive
+			def do_GET(self):
+				path = self.path.split('?')[0]
+				statsLock.acquire()
+				stats['hits'][path] = stats['hits'].get(path, 0) + 1
+				stats['active'] += 1
+				stats['maxActive'] = max(stats['maxActive'], stats['active'])
+				(status, data, etag) = (tuple(responses.get(path, [(404, '')])[0]) + (None,))[:3]
+				if len(responses.get(path, [])) > 1:
+					responses[path].pop(0)
+				if etag and (self.headers.getheader('If-None-Match') == etag):
+					(status, data) = (304, '')
+					stats['notModified'] += 1
+				statsLock.release()
+				time.sleep(delay)
+				self.send_response(status)
+				if etag:
+					self.send_header('ETag', etag)
+				self.send_header('Content-Length', str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+				statsLock.acquire()
+				stats['active'] -= 1
+				statsLock.release()
+			def log_message(self, *args):
+				pass
+		class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+			daemon_threads = True
+		server = StandInServer(('127.0.0.1', 0), StandInHandler)
+		thread = threading.Thread(target = server.serve_forever)
+		thread.setDaemon(True)
+		thread.start()
+		return ('http://127.0.0.1:%d' % server.server_address[1], stats)
+
+	def readConcurrently(urlList, limiter):
+		threadList = map(lambda url: threading.Thread(target = readURL, args = (url,), kwargs = {'limiter': limiter}), urlList)
+		map(lambda thread: thread.start(), threadList)
+		map(lambda thread: thread.join(), threadList)
+
+	__test__ = {'standin': """
+	Failed queries are retried - except for client errors:
+	>>> (url, stats) = startStandIn({'/dbs/blocks': [(503, ''), (200, '[{"block_name": "/a/b/c#1"}]')]})
+	>>> readJSON(url + '/dbs/blocks', {'dataset': '/a/b/c'}, retries = 1, retryDelay = 0)
+	[{'block_name': '/a/b/c#1'}]
+	>>> readJSON(url + '/dbs/missing', retries = 3, retryDelay = 0)
+	Traceback (most recent call last):
+	HTTPError: HTTP Error 404: Not Found
+	>>> (stats['hits']['/dbs/blocks'], stats['hits']['/dbs/missing'])
+	(2, 1)
+
+	Proxy servers given by the environment are used:
+	>>> (proxyURL, proxyStats) = startStandIn({'http://dbs.invalid/dbs/blocks': [(200, '[]')],
+	...	url + '/dbs/blocks': [(200, '["proxy"]')]})
+	>>> os.environ['http_proxy'] = proxyURL
+	>>> (readJSON('http://dbs.invalid/dbs/blocks', {'dataset': '/a'}), readJSON(url + '/dbs/blocks'))
+	([], ['proxy'])
+	>>> readJSON('http://dbs.invalid/dbs/missing', retries = 3, retryDelay = 0)
+	Traceback (most recent call last):
+	HTTPError: HTTP Error 404: Not Found
+	>>> os.environ['no_proxy'] = '127.0.0.1'
+	>>> readJSON(url + '/dbs/blocks')
+	[{'block_name': '/a/b/c#1'}]
+	>>> (proxyStats['hits']['http://dbs.invalid/dbs/blocks'], proxyStats['hits']['http://dbs.invalid/dbs/missing'])
+	(1, 1)
+	>>> (os.environ.pop('http_proxy'), os.environ.pop('no_proxy')) and None
+
+	Concurrent requests are limited per endpoint and limiter:
+	>>> (url, stats) = startStandIn({'/dbs/files': [(200, '[]')]}, delay = 0.2)
+	>>> readConcurrently([url + '/dbs/files'] * 6, EndpointLimiter(2))
+	>>> (stats['hits']['/dbs/files'], stats['maxActive'])
+	(6, 2)
+	>>> readConcurrently([url + '/dbs/files'] * 3, EndpointLimiter(1))
+	>>> (stats['hits']['/dbs/files'], stats['maxActive'])
+	(9, 2)
 
-def readJSON(url, params = None, headers = {}, cert = None):
-	return parseJSON(readURL(url, params, headers, cert))
+	Responses are cached per cache - without ttl they are revalidated via ETag by each request:
+	>>> (url, stats) = startStandIn({'/phedex/blockreplicas': [(200, '{"block": 1}', '"v1"'), (200, '{"block": 2}', '"v2"')]})
+	>>> cacheDir = tempfile.mkdtemp()
+	>>> (cacheTTL, cacheETag) = (ResponseCache(os.path.join(cacheDir, 'ttl'), 60), ResponseCache(os.path.join(cacheDir, 'etag')))
+	>>> map(lambda idx: readJSON(url + '/phedex/blockreplicas', cache = cacheTTL), range(3))
+	[{'block': 1}, {'block': 1}, {'block': 1}]
+	>>> map(lambda idx: readJSON(url + '/phedex/blockreplicas', cache = cacheETag), range(3))
+	[{'block': 2}, {'block': 2}, {'block': 2}]
+	>>> (stats['hits']['/phedex/blockreplicas'], stats['notModified'])
+	(4, 2)
+	>>> shutil.rmtree(cacheDir)
+	"""}
+	doctest.testmod()
+	for connList in connectionPool.values(): # finish keep-alive connections of the stand-in
+		map(lambda conn: conn.close(), connList)
+	time.sleep(0.1)
@@ -135,8 +135,7 @@ if opts.listparams:
 	needGCParam = False
 	if plugin.getMaxJobs() != None:
 		countActive = 0
-		for jobNum in range(plugin.getMaxJobs()):
-			info = plugin.getJobInfo(jobNum)
+		for (jobNum, info) in enumerate(plugin.iterJobInfos()):
 			if info[ParameterInfo.ACTIVE]:
 				countActive += 1
 			if opts.inactive or info[ParameterInfo.ACTIVE]: